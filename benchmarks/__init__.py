@@ -0,0 +1,3 @@
+"""
+    This package contains offline benchmarks which run the app against a local Stripe stand-in.
+"""
@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stripe_stub import StripeStub
+
+"""
+    This module compares the throughput of the sync WSGI views with the async ASGI views against a local Stripe
+    stand-in. Run it from the project root:
+
+        python -m benchmarks.async_vs_sync --requests 400 --threads 8 --concurrency 200 --latency 0.05
+
+    The default route, a POST of default-card/, calls Stripe on every request. The GET routes are mostly answered
+    from the Stripe read cache and the card mirror, they measure the views rather than the Stripe calls.
+"""
+
+
+def setup_django(stripe_api_base):
+    """
+    Function is used to configure django against a throwaway database and the Stripe stand-in.
+    :param stripe_api_base: url of the Stripe stand-in.
+    :return: access token of a benchmark user.
+    """
+    os.environ['STRIPE_API_BASE'] = stripe_api_base
+    # The stub is not rate limited, keep the limiter from capping the measured throughput.
+    os.environ.setdefault('STRIPE_RATE_LIMIT_ENABLED', 'false')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stripe_card_payment.settings')
+    import django
+    from django.conf import settings
+    django.setup()
+    settings.DATABASES['default']['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+
+    from django.core.management import call_command
+    from rest_framework_simplejwt.tokens import RefreshToken
+    from users.models import User
+    call_command('migrate', verbosity=0)
+    user = User.objects.create_user(username='benchmark', email='benchmark@example.com', password='benchmark',
+                                    first_name='benchmark', customer_id='cus_benchmark')
+    return str(RefreshToken.for_user(user).access_token)
+
+
+def run_sync(method, path, body, token, total, threads):
+    """
+    Function is used to drive the WSGI handler from a fixed pool of worker threads, like a threaded WSGI server.
+    :return: elapsed seconds and status code counts.
+    """
+    from django.test import Client
+
+    def call(_):
+        return Client().generic(method, path, body, content_type='application/json',
+                                HTTP_AUTHORIZATION='Bearer %s' % token).status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        codes = list(executor.map(call, range(total)))
+    return time.perf_counter() - start, codes
+
+
+def run_async(method, path, body, token, total, concurrency):
+    """
+    Function is used to drive the ASGI handler from a single event loop with a bounded number of requests in flight.
+    :return: elapsed seconds and status code counts.
+    """
+    from django.test import AsyncClient
+    from stripe_utils.transport import async_stripe
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        client = AsyncClient()
+
+        async def call():
+            async with semaphore:
+                response = await client.generic(method, path, body, content_type='application/json',
+                                                authorization='Bearer %s' % token)
+                return response.status_code
+
+        start = time.perf_counter()
+        codes = await asyncio.gather(*(call() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+        await async_stripe.close()
+        return elapsed, codes
+
+    return asyncio.run(main())
+
+
+def report(name, elapsed, codes):
+    ok = sum(1 for code in codes if code < 400)
+    print("{:<12} {:>8} {:>8} {:>10.2f} {:>10.1f}".format(name, len(codes), ok, elapsed, len(codes) / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync WSGI and async ASGI throughput.")
+    parser.add_argument('--requests', type=int, default=400, help="Requests sent per mode.")
+    parser.add_argument('--threads', type=int, default=8, help="Worker threads of the sync WSGI run.")
+    parser.add_argument('--concurrency', type=int, default=200, help="Requests in flight in the async ASGI run.")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds the Stripe stand-in waits per call.")
+    parser.add_argument('--method', default='POST', help="HTTP method sent to the endpoint.")
+    parser.add_argument('--endpoint', default='default-card/', help="Payments endpoint called in both modes.")
+    parser.add_argument('--data', default=json.dumps({'card_id': 'card_benchmark'}),
+                        help="JSON body of the requests, ignored by GET.")
+    args = parser.parse_args()
+    method = args.method.upper()
+    body = '' if method == 'GET' else args.data
+
+    with StripeStub(latency=args.latency) as stub:
+        token = setup_django(stub.url)
+        print("{:<12} {:>8} {:>8} {:>10} {:>10}".format('mode', 'requests', 'ok', 'seconds', 'req/s'))
+        calls = stub.calls
+        report('sync wsgi', *run_sync(method, '/api/payments/' + args.endpoint, body, token, args.requests,
+                                      args.threads))
+        print("Stripe stand-in served {} calls.".format(stub.calls - calls))
+        calls = stub.calls
+        report('async asgi', *run_async(method, '/api/async/payments/' + args.endpoint, body, token, args.requests,
+                                        args.concurrency))
+        print("Stripe stand-in served {} calls.".format(stub.calls - calls))
+
+
+if __name__ == '__main__':
+    main()
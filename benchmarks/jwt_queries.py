@@ -0,0 +1,73 @@
+import argparse
+import time
+
+from benchmarks.async_vs_sync import setup_django
+from benchmarks.stripe_stub import StripeStub
+
+"""
+    This module measures the database queries and the time the JWT authentication adds to every request, with the
+    stock simplejwt authentication and with the stateless one. Run it from the project root:
+
+        python -m benchmarks.jwt_queries --requests 500 --endpoint default-card/
+"""
+
+
+def run(path, token, total, authentication_class):
+    """
+    Function is used to send the same GET request with the given authentication class.
+    :return: queries per request, milliseconds per request and status code counts.
+    """
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.views import APIView
+
+    original = APIView.authentication_classes
+    APIView.authentication_classes = [authentication_class]
+    client = Client()
+    codes = []
+    try:
+        # Warm the caches so only the steady state is measured.
+        client.get(path, HTTP_AUTHORIZATION='Bearer %s' % token)
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(total):
+                codes.append(client.get(path, HTTP_AUTHORIZATION='Bearer %s' % token).status_code)
+            elapsed = time.perf_counter() - start
+    finally:
+        APIView.authentication_classes = original
+    return len(queries) / total, elapsed * 1000 / total, codes
+
+
+def report(name, queries, milliseconds, codes):
+    ok = sum(1 for code in codes if code < 400)
+    print("{:<26} {:>8} {:>8} {:>12.2f} {:>10.3f}".format(name, len(codes), ok, queries, milliseconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the queries of the stock and the stateless JWT auth.")
+    parser.add_argument('--requests', type=int, default=500, help="Requests sent per mode.")
+    parser.add_argument('--endpoint', default='default-card/', help="Payments endpoint to GET.")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds the Stripe stand-in waits per call.")
+    args = parser.parse_args()
+
+    with StripeStub(latency=args.latency) as stub:
+        legacy_token = setup_django(stub.url)
+        from django.test import Client
+        from rest_framework_simplejwt.authentication import JWTAuthentication
+        from users.authentication import StatelessJWTAuthentication
+        response = Client().post('/api/token/', {'username': 'benchmark', 'password': 'benchmark'})
+        claims_token = response.json()['access']
+
+        path = '/api/payments/' + args.endpoint
+        print("{:<26} {:>8} {:>8} {:>12} {:>10}".format('mode', 'requests', 'ok', 'queries/req', 'ms/req'))
+        stock = run(path, legacy_token, args.requests, JWTAuthentication)
+        report('stock jwt', *stock)
+        claims = run(path, claims_token, args.requests, StatelessJWTAuthentication)
+        report('stateless, claims', *claims)
+        report('stateless, cache fallback', *run(path, legacy_token, args.requests, StatelessJWTAuthentication))
+        print("Queries saved per request: {:.2f}".format(stock[0] - claims[0]))
+
+
+if __name__ == '__main__':
+    main()
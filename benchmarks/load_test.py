@@ -0,0 +1,263 @@
+import argparse
+import hashlib
+import hmac
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.async_vs_sync import setup_django
+from benchmarks.stripe_stub import StripeStub
+
+"""
+    This module load tests every route of the payments and users apps against the local Stripe stand-in, with a
+    throwaway database, and reports the latency percentiles and the throughput of each route. Run it from the
+    project root:
+
+        python -m benchmarks.load_test --requests 200 --concurrency 8 --latency 0.05 --output run.json
+        python -m benchmarks.load_test --requests 200 --concurrency 8 --latency 0.05 --compare run.json
+
+    The JWTs are obtained from api/token/ like a client would, and api/token/ is load tested as a route too.
+"""
+
+
+class Scenario:
+    """
+        This is a class for describing the requests sent to one route.
+
+        Attributes:
+            name (str): Method and route reported in the results.
+            method (str): Http method.
+            path (function): Called with the request number, returns the path to request.
+            body (function): Called with the request number, returns the json body or None.
+            role (str): ``user`` or ``admin`` for the JWT sent, None for an anonymous request.
+            raw (function): Called with the request number, returns an encoded body and its extra headers, it
+                replaces ``body``.
+    """
+
+    def __init__(self, method, route, body=None, role='user', path=None, raw=None):
+        self.name = '{} {}'.format(method, route)
+        self.method = method
+        self.path = path or (lambda number: '/' + route)
+        self.body = body or (lambda number: None)
+        self.role = role
+        self.raw = raw
+
+    def request(self, number):
+        """
+        Function is used to build a request of the scenario.
+        :param number: request number.
+        :return: encoded body or None and extra headers.
+        """
+        if self.raw is not None:
+            return self.raw(number)
+        body = self.body(number)
+        return (json.dumps(body) if body is not None else None), {}
+
+
+def signed_event(number, secret):
+    """
+    Function is used to build a Stripe event signed like Stripe does.
+    :return: payload and the Stripe-Signature header.
+    """
+    payload = json.dumps({'id': 'evt_load_%d' % number, 'object': 'event', 'type': 'payment_intent.created',
+                          'data': {'object': {'id': 'pi_load_%d' % number, 'object': 'payment_intent'}}})
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), ('%d.%s' % (timestamp, payload)).encode(), hashlib.sha256).hexdigest()
+    return payload, {'HTTP_STRIPE_SIGNATURE': 't=%d,v1=%s' % (timestamp, signature)}
+
+
+def build_scenarios(fixtures, total):
+    """
+    Function is used to list the requests of every route, each request works on its own objects so it can be
+    repeated ``total`` times.
+    :param fixtures: ids prepared by ``prepare()``.
+    :param total: requests sent per route.
+    :return: list of Scenario.
+    """
+    user_pk = fixtures['user_pk']
+    return [
+        Scenario('POST', 'api/token/', role=None,
+                 body=lambda number: {'username': 'benchmark', 'password': 'benchmark'}),
+        Scenario('POST', 'api/token/refresh/', role=None, body=lambda number: {'refresh': fixtures['refresh']}),
+        Scenario('POST', 'api/token/verify/', role=None, body=lambda number: {'token': fixtures['tokens']['user']}),
+        Scenario('POST', 'api/payments/create-payment-intent/', body=lambda number: {'no_count': 1 + number % 5}),
+        Scenario('POST', 'api/payments/refund-payment-intent/',
+                 body=lambda number: {'payment_intent': 'pi_refund_%d' % number}),
+        Scenario('POST', 'api/payments/bulk-refund-payment-intent/', role='admin',
+                 body=lambda number: {'payment_intents': ['pi_bulk_%d_%d' % (number, item) for item in range(5)]}),
+        Scenario('POST', 'api/payments/cancel-payment-intent/',
+                 body=lambda number: {'payment_intent': 'pi_cancel_%d' % number}),
+        Scenario('GET', 'api/payments/card-manage/'),
+        Scenario('POST', 'api/payments/card-manage/', body=lambda number: {'source_id': 'tok_load_%d' % number}),
+        Scenario('PUT', 'api/payments/card-manage/',
+                 body=lambda number: {'card_id': 'card_put_%d' % number, 'name': 'Load', 'exp_month': 12,
+                                      'exp_year': 2031}),
+        Scenario('DELETE', 'api/payments/card-manage/', body=lambda number: {'card_id': 'card_delete_%d' % number}),
+        Scenario('GET', 'api/payments/default-card/'),
+        Scenario('POST', 'api/payments/default-card/',
+                 body=lambda number: {'card_id': 'card_put_%d' % (number % max(total, 1))}),
+        Scenario('POST', 'api/payments/webhook/', role=None,
+                 raw=lambda number: signed_event(number, fixtures['webhook_secret'])),
+        Scenario('GET', 'api/payments/stripe-metrics/', role='admin'),
+        Scenario('GET', 'api/users/list/', role='admin'),
+        Scenario('POST', 'api/users/list/', role=None,
+                 body=lambda number: {'username': 'load_%d' % number, 'email': 'load_%d@example.com' % number,
+                                      'first_name': 'Load', 'password': 'load-password'}),
+        Scenario('GET', 'api/users/details/<pk>/', path=lambda number: '/api/users/details/%d/' % user_pk),
+        Scenario('PUT', 'api/users/details/<pk>/', path=lambda number: '/api/users/details/%d/' % user_pk,
+                 body=lambda number: {'last_name': 'Load %d' % number}),
+        Scenario('DELETE', 'api/users/details/<pk>/',
+                 path=lambda number: '/api/users/details/%d/' % fixtures['deleted_pks'][number]),
+        Scenario('POST', 'api/users/import/', role='admin',
+                 body=lambda number: {'users': [{'username': 'import_%d_%d' % (number, item),
+                                                 'email': 'import_%d_%d@example.com' % (number, item),
+                                                 'first_name': 'Import'} for item in range(5)]}),
+        Scenario('GET', 'api/users/import/<pk>/', role='admin',
+                 path=lambda number: '/api/users/import/%d/' % fixtures['import_pk']),
+    ]
+
+
+def prepare(total):
+    """
+    Function is used to create the admin, the users to delete and an import, then obtain the JWTs from api/token/.
+    :param total: requests sent per route.
+    :return: dict of fixture ids and tokens.
+    """
+    from django.conf import settings
+    from django.test import Client
+    from users.models import User, UserImport
+
+    User.objects.create_superuser(username='admin', email='admin@example.com', password='admin',
+                                  first_name='admin', customer_id='cus_admin')
+    User.objects.bulk_create([User(username='delete_%d' % number, email='delete_%d@example.com' % number,
+                                   first_name='Delete') for number in range(total)])
+    client = Client()
+    tokens, refresh = {}, None
+    for role, username in (('user', 'benchmark'), ('admin', 'admin')):
+        response = client.post('/api/token/', {'username': username, 'password': username})
+        tokens[role] = response.json()['access']
+        refresh = refresh or response.json()['refresh']
+    return {
+        'tokens': tokens,
+        'refresh': refresh,
+        'user_pk': User.objects.get(username='benchmark').pk,
+        'deleted_pks': list(User.objects.filter(username__startswith='delete_').order_by('id')
+                            .values_list('id', flat=True)),
+        'import_pk': UserImport.objects.create(name='load').pk,
+        'webhook_secret': settings.STRIPE_WEBHOOK_SECRET,
+    }
+
+
+def percentile(values, percent):
+    """
+    Function is used to get a percentile with the nearest rank method.
+    :param values: sorted values.
+    :param percent: percentile from 0 to 100.
+    :return: value or None when there are no values.
+    """
+    if not values:
+        return None
+    return values[max(int(math.ceil(percent / 100 * len(values))) - 1, 0)]
+
+
+def run_scenario(scenario, fixtures, total, concurrency):
+    """
+    Function is used to send the requests of a scenario from a pool of threads, each with its own client.
+    :return: dict of the route results.
+    """
+    from django.test import Client
+
+    local = threading.local()
+
+    def call(number):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = Client(raise_request_exception=False)
+        body, headers = scenario.request(number)
+        if scenario.role is not None:
+            headers['HTTP_AUTHORIZATION'] = 'Bearer %s' % fixtures['tokens'][scenario.role]
+        path = scenario.path(number)
+        start = time.perf_counter()
+        if body is None:
+            response = getattr(client, scenario.method.lower())(path, **headers)
+        else:
+            response = getattr(client, scenario.method.lower())(path, body, content_type='application/json',
+                                                                **headers)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response.status_code, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(call, range(total)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(seconds * 1000 for _, seconds in results)
+    return {
+        'requests': total,
+        'errors': sum(1 for code, _ in results if code >= 400),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'throughput': total / elapsed,
+    }
+
+
+def change(current, baseline):
+    if not baseline:
+        return ''
+    return '{:+.0f}%'.format((current - baseline) / baseline * 100)
+
+
+def report(results, baseline=None):
+    routes = (baseline or {}).get('routes', {})
+    print("{:<48} {:>6} {:>6} {:>9} {:>9} {:>9} {:>9} {:>8} {:>8}".format(
+        'route', 'reqs', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'p95 chg', 'req/s chg'))
+    for name, route in results['routes'].items():
+        previous = routes.get(name, {})
+        print("{:<48} {:>6} {:>6} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.1f} {:>8} {:>8}".format(
+            name, route['requests'], route['errors'], route['p50_ms'], route['p95_ms'], route['p99_ms'],
+            route['throughput'], change(route['p95_ms'], previous.get('p95_ms')),
+            change(route['throughput'], previous.get('throughput'))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test every route against the local Stripe stand-in.")
+    parser.add_argument('--requests', type=int, default=100, help="Requests sent per route.")
+    parser.add_argument('--concurrency', type=int, default=8, help="Requests in flight per route.")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds the Stripe stand-in waits per call.")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random extra Stripe latency, in seconds.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of the Stripe calls which fail.")
+    parser.add_argument('--error-status', type=int, default=500, help="Http status of the failing Stripe calls.")
+    parser.add_argument('--routes', default='', help="Only run the routes containing this text.")
+    parser.add_argument('--output', help="Write the results to this json file.")
+    parser.add_argument('--compare', help="Results json file of a previous run to compare with.")
+    args = parser.parse_args()
+
+    with StripeStub(latency=args.latency, jitter=args.jitter) as stub:
+        setup_django(stub.url)
+        fixtures = prepare(args.requests)
+        if args.error_rate:
+            stub.inject(status=args.error_status, rate=args.error_rate)
+        results = {'config': vars(args), 'routes': {}}
+        for scenario in build_scenarios(fixtures, args.requests):
+            if args.routes in scenario.name:
+                results['routes'][scenario.name] = run_scenario(scenario, fixtures, args.requests, args.concurrency)
+        results['stripe_calls'] = stub.calls
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    report(results, baseline)
+    print("Stripe stand-in served {} calls.".format(results['stripe_calls']))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stripe_card_payment.settings')
+    main()
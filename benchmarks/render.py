@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import timeit
+
+"""
+    This module compares the rest_framework JSON rendering of the ApiResponse envelopes with ApiJSONRenderer, on
+    card lists read from the local mirror and on Stripe objects. Run it from the project root:
+
+        python -m benchmarks.render --cards 10 100 500
+"""
+
+
+def stripe_card(index):
+    return {
+        'id': 'card_%024d' % index, 'object': 'card', 'brand': 'Visa', 'country': 'US', 'customer': 'cus_benchmark',
+        'cvc_check': 'pass', 'exp_month': 12, 'exp_year': 2030, 'fingerprint': 'Xt5EWLLDS7FJjR1c',
+        'funding': 'credit', 'last4': '4242', 'metadata': {}, 'name': None, 'address_city': None,
+        'address_country': None, 'address_line1': None, 'address_line1_check': None, 'address_line2': None,
+        'address_state': None, 'address_zip': None, 'address_zip_check': None, 'dynamic_last4': None,
+        'tokenization_method': None,
+    }
+
+
+def render_time(renderer, build_data, number):
+    """
+    Function is used to time building the data of a response, as the view does, then rendering it.
+    :return: microseconds per response and the rendered bytes.
+    """
+    from response_utils import ApiResponse
+
+    def render():
+        response = ApiResponse(status=1, data=build_data(), message='ok').create_response()
+        return renderer.render(response.data, 'application/json', {})
+
+    seconds = min(timeit.repeat(render, number=number, repeat=5)) / number
+    return seconds * 1000000, render()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the rest_framework renderer with ApiJSONRenderer.")
+    parser.add_argument('--cards', type=int, nargs='+', default=[10, 100, 500], help="Cards per payload.")
+    parser.add_argument('--number', type=int, default=200, help="Responses rendered per measure.")
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stripe_card_payment.settings')
+    import django
+    django.setup()
+    import stripe
+    from rest_framework.renderers import JSONRenderer
+    from response_utils import ApiJSONRenderer, RawJSON
+
+    print("{:<20} {:>6} {:>10} {:>10} {:>8}".format('payload', 'cards', 'drf us', 'fast us', 'speedup'))
+    for count in args.cards:
+        stored = [json.dumps(stripe_card(index)) for index in range(count)]
+        listing = stripe.util.convert_to_stripe_object(
+            {'object': 'list', 'url': '/v1/customers/cus_benchmark/sources', 'has_more': False,
+             'data': [stripe_card(index) for index in range(count)]}, 'sk_test', None, None)
+        cases = [
+            # The card list of the local mirror used to parse every stored card then serialize it again.
+            ('mirrored card list',
+             lambda: {'object': 'list', 'data': [json.loads(card) for card in stored], 'has_more': False},
+             lambda: {'object': 'list', 'data': [RawJSON(card) for card in stored], 'has_more': False}),
+            ('stripe list object', lambda: listing, lambda: listing),
+        ]
+        for name, drf_data, fast_data in cases:
+            drf, drf_content = render_time(JSONRenderer(), drf_data, args.number)
+            fast, fast_content = render_time(ApiJSONRenderer(), fast_data, args.number)
+            assert json.loads(drf_content) == json.loads(fast_content)
+            print("{:<20} {:>6} {:>10.1f} {:>10.1f} {:>7.2f}x".format(name, count, drf, fast, drf / fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+import collections
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+"""
+    This module contains a local stand-in for the handful of Stripe endpoints used by the app.
+"""
+
+_ids = itertools.count(1)
+
+
+def _new_id(prefix):
+    return "%s_stub%010d" % (prefix, next(_ids))
+
+
+def _fingerprint(value):
+    return hashlib.sha1(value.encode()).hexdigest()[:16]
+
+
+def _customer(params, customer_id=None):
+    return {
+        'id': customer_id or _new_id('cus'),
+        'object': 'customer',
+        'default_source': params.get('default_source'),
+        'email': params.get('email'),
+        'name': params.get('name'),
+        'phone': params.get('phone'),
+        'sources': {'object': 'list', 'data': [], 'has_more': False},
+    }
+
+
+def _card(customer_id, card_id=None, token=None, params=None):
+    params = params or {}
+    card_id = card_id or _new_id('card')
+    return {
+        'id': card_id,
+        'object': 'card',
+        'customer': customer_id,
+        'brand': 'Visa',
+        'last4': '4242',
+        'exp_month': int(params.get('exp_month') or 12),
+        'exp_year': int(params.get('exp_year') or 2030),
+        'name': params.get('name'),
+        'fingerprint': _fingerprint(token or card_id),
+    }
+
+
+def _payment_intent(params, intent_id=None, status='requires_payment_method'):
+    intent_id = intent_id or _new_id('pi')
+    return {
+        'id': intent_id,
+        'object': 'payment_intent',
+        'amount': int(params.get('amount') or 50),
+        'currency': params.get('currency', 'usd'),
+        'customer': params.get('customer'),
+        'client_secret': '%s_secret_stub' % intent_id,
+        'status': status,
+    }
+
+
+def _list(data=None):
+    return {'object': 'list', 'data': data or [], 'has_more': False}
+
+
+ROUTES = [
+    ('GET', r'/v1/customers', lambda m, p: _list()),
+    ('POST', r'/v1/customers', lambda m, p: _customer(p)),
+    ('GET', r'/v1/customers/(?P<customer>[^/]+)', lambda m, p: _customer(p, m['customer'])),
+    ('POST', r'/v1/customers/(?P<customer>[^/]+)', lambda m, p: _customer(p, m['customer'])),
+    ('DELETE', r'/v1/customers/(?P<customer>[^/]+)',
+     lambda m, p: {'id': m['customer'], 'object': 'customer', 'deleted': True}),
+    ('GET', r'/v1/customers/(?P<customer>[^/]+)/sources', lambda m, p: _list()),
+    ('POST', r'/v1/customers/(?P<customer>[^/]+)/sources',
+     lambda m, p: _card(m['customer'], token=p.get('source'))),
+    ('POST', r'/v1/customers/(?P<customer>[^/]+)/sources/(?P<card>[^/]+)',
+     lambda m, p: _card(m['customer'], m['card'], params=p)),
+    ('DELETE', r'/v1/customers/(?P<customer>[^/]+)/sources/(?P<card>[^/]+)',
+     lambda m, p: {'id': m['card'], 'object': 'card', 'deleted': True}),
+    ('GET', r'/v1/tokens/(?P<token>[^/]+)',
+     lambda m, p: {'id': m['token'], 'object': 'token', 'card': {'fingerprint': _fingerprint(m['token'])}}),
+    ('POST', r'/v1/payment_intents', lambda m, p: _payment_intent(p)),
+    ('GET', r'/v1/payment_intents/(?P<intent>[^/]+)', lambda m, p: _payment_intent(p, m['intent'])),
+    ('POST', r'/v1/payment_intents/(?P<intent>[^/]+)', lambda m, p: _payment_intent(p, m['intent'])),
+    ('POST', r'/v1/payment_intents/(?P<intent>[^/]+)/cancel',
+     lambda m, p: _payment_intent(p, m['intent'], status='canceled')),
+    ('GET', r'/v1/refunds', lambda m, p: _list()),
+    ('POST', r'/v1/refunds', lambda m, p: {'id': _new_id('re'), 'object': 'refund', 'status': 'succeeded',
+                                           'payment_intent': p.get('payment_intent')}),
+]
+ROUTES = [(method, re.compile(pattern + '$'), builder) for method, pattern, builder in ROUTES]
+
+
+class StripeStubHandler(BaseHTTPRequestHandler):
+    """
+    Class is used to answer Stripe API calls with canned objects after a configurable delay.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _params(self, url):
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            params.update(parse_qsl(self.rfile.read(length).decode()))
+        return params
+
+    def _send(self, code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Request-Id', _new_id('req'))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        params = self._params(url)
+        self.server.stub.record(self.command, url.path)
+        latency = self.server.stub.latency_for()
+        if latency:
+            time.sleep(latency)
+        fault = self.server.stub.fault_for(url.path)
+        if fault is not None:
+            if fault['delay']:
+                time.sleep(fault['delay'])
+            if fault['status']:
+                return self._send(fault['status'], {'error': {'type': 'api_error', 'message': 'Injected fault.'}})
+        for method, pattern, builder in ROUTES:
+            match = pattern.match(url.path)
+            if method == self.command and match:
+                return self._send(200, builder(match.groupdict(), params))
+        return self._send(404, {'error': {'type': 'invalid_request_error',
+                                          'message': 'Unrecognized request URL (%s: %s)' % (self.command, url.path)}})
+
+    do_GET = do_POST = do_DELETE = _handle
+
+
+class StripeStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class StripeStub:
+    """
+        This is a class for running the Stripe stand-in on a background thread.
+
+        Attributes:
+            latency (float): Seconds every call sleeps before answering, imitating the Stripe round trip.
+            jitter (float): Extra seconds, drawn uniformly from 0 to jitter, added to the latency of every call.
+            calls (int): Number of calls served so far.
+            requests (deque): Method and raw path of the last calls served.
+            faults (list): Injected faults, see ``inject()``.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.05, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self.requests = collections.deque(maxlen=1000)
+        self.faults = []
+        self._lock = threading.Lock()
+        self._server = StripeStubServer((host, port), StripeStubHandler)
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://%s:%s" % (host, port)
+
+    def latency_for(self):
+        return self.latency + random.uniform(0, self.jitter) if self.jitter else self.latency
+
+    def record(self, method, path):
+        with self._lock:
+            self.calls += 1
+            self.requests.append((method, path))
+
+    def inject(self, status=500, rate=1.0, path_prefix='/v1/', delay=0.0):
+        """
+        Function is used to make a share of the calls fail or hang, the first matching fault applies.
+        :param status: http status answered, None to answer normally after the delay.
+        :param rate: share of the matching calls affected, from 0 to 1.
+        :param path_prefix: only calls whose path starts with it are affected.
+        :param delay: extra seconds the affected calls wait, above the client read timeout it imitates a hang.
+        """
+        self.faults.append({'status': status, 'rate': rate, 'path_prefix': path_prefix, 'delay': delay})
+
+    def clear_faults(self):
+        self.faults = []
+
+    def fault_for(self, path):
+        for fault in self.faults:
+            if path.startswith(fault['path_prefix']) and random.random() < fault['rate']:
+                return fault
+        return None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the local Stripe stand-in.")
+    parser.add_argument('--port', type=int, default=12111)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random extra latency of up to this many seconds.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of the calls answered with an error.")
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--fault-delay', type=float, default=0.0, help="Extra seconds the failing calls wait.")
+    args = parser.parse_args()
+    stub = StripeStub(port=args.port, latency=args.latency, jitter=args.jitter)
+    if args.error_rate:
+        stub.inject(status=args.error_status, rate=args.error_rate, delay=args.fault_delay)
+    print("Stripe stub listening on %s, set STRIPE_API_BASE to use it." % stub.url)
+    stub._server.serve_forever()
@@ -5,15 +5,37 @@ UPDATE_USER_SUCCESS = "User updated successfully."
 DELETE_USER_SUCCESS = "User deleted successfully."
 GET_USER_SUCCESS = "User retrieved successfully."
 USER_DOES_NOT_EXIST = "User does not exist."
+GET_USERS_SUCCESS = "Users retrieved successfully."
+INVALID_CURSOR = "Invalid cursor."
+INVALID_ORDERING = "Invalid ordering, use one of {}."
+INVALID_COUNT_MODE = "Invalid count, use one of {}."
+INVALID_PAGE_SIZE = "Invalid page_size, use a number from 1 to {}."
+PARAM_CURSOR_AFTER = "after"
+PARAM_CURSOR_BEFORE = "before"
+PARAM_PAGE_SIZE = "page_size"
+PARAM_ORDERING = "ordering"
+PARAM_COUNT = "count"
+IMPORT_USERS_STARTED = "User import started."
+GET_USER_IMPORT_SUCCESS = "User import retrieved successfully."
+USER_IMPORT_DOES_NOT_EXIST = "User import does not exist."
+IMPORT_USERS_MISSING_DATA = "Send the users as a csv file or as a list in users."
+IMPORT_DUPLICATE_USER = "Duplicate user in the import."
+IMPORT_USER_EXISTS = "User already exists."
+PARAM_USERS = "users"
+PARAM_FILE = "file"
 
 # Payments
 PARAM_PAYMENT_INTENT_ID = 'payment_intent'
+PARAM_PAYMENT_INTENT_IDS = 'payment_intents'
+PARAM_STREAM = 'stream'
+PARAM_FIELDS = 'fields'
 PARAM_CARD_ID = "card_id"
 PARAM_SOURCE_ID = "source_id"
 PARAM_CARD_HOLDER_NAME = "name"
 PARAM_EXP_MONTH = "exp_month"
 PARAM_EXP_YEAR = "exp_year"
 PARAM_NO_COUNT = "no_count"
+PARAM_IDEMPOTENCY_KEY = "idempotency_key"
 
 MISSING_PARAM = "Request is missing required parameter {}"
 STRIPE_SHIPPING_ADDRESS = {
@@ -30,10 +52,16 @@ STRIPE_DESCRIPTION = 'Software development services'
 CREATE_PAYMENT_INTENT_SUCCESS = "Payment intent created successfully."
 CREATE_PAYMENT_REFUND_SUCCESS = "Payment is refunded successfully."
 PAYMENT_ALREADY_REFUND = "Payment is already refunded."
+CREATE_BULK_REFUND_SUCCESS = "Bulk refund is processed."
+BULK_REFUND_TOO_MANY = "A bulk refund accepts at most {} payment intents."
+BULK_REFUND_INVALID_ITEMS = "payment_intents must be a list of payment intent ids."
+BULK_REFUND_ITEM_INVALID = "Payment intent can not be refunded, check that it exists and is paid."
+INVALID_STREAM = "Invalid stream, use true or false."
 CANCEL_PAYMENT_INTENT_SUCCESS = "Payment intent is canceled successfully."
 CREATE_PAYMENT_INTENT_FAIL = "Something went wrong could not create Payment intent."
 CREATE_PAYMENT_REFUND_FAIL = "Something went wrong could not create Payment refund."
 CANCEL_PAYMENT_INTENT_FAIL = "Something went wrong could not cancel Payment intent."
+IDEMPOTENCY_KEY_MISMATCH = "Idempotency key was already used with different parameters."
 
 MISSING_CUSTOMER_ID = "User does not have any customer_id,please contact site maintainer."
 GET_ALL_CARD_SUCCESS = "All cards retrieved successfully."
@@ -53,3 +81,6 @@ MIN_AMOUNT = 0.5
 CONVERT_CENT = 100
 DEFAULT_CARD_SUCCESS = "Default card retrieved successfully."
 DEFAULT_CARD_FAIL = "Default card does not retrieved."
+GET_STRIPE_METRICS_SUCCESS = "Stripe client metrics retrieved successfully."
+STRIPE_RATE_LIMITED = "Too many requests to the payment provider, please retry in a few seconds."
+STRIPE_UNAVAILABLE = "The payment provider is unavailable, please retry later."
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class PaymentsConfig(AppConfig):
     name = 'payments'
+
+    def ready(self):
+        """
+        Function is used to set up the shared Stripe transport once per worker process.
+        """
+        from django.conf import settings
+        from stripe_utils.transport import configure_stripe
+        configure_stripe(settings)
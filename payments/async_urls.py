@@ -0,0 +1,10 @@
+from django.urls import path
+from .async_views import *
+
+urlpatterns = [
+    path('create-payment-intent/', AsyncCreatePayment.as_view(), name='async_create_payment'),
+    path('refund-payment-intent/', AsyncCreateRefund.as_view(), name='async_create_refund'),
+    path('cancel-payment-intent/', AsyncCancelPaymentIntent.as_view(), name='async_cancel_intent'),
+    path('card-manage/', AsyncCardManagement.as_view(), name='async_card_management'),
+    path('default-card/', AsyncDefaultCard.as_view(), name='async_default_card'),
+]
@@ -0,0 +1,273 @@
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import QueryDict
+from rest_framework import exceptions, status
+
+import constants
+from response_utils import ApiResponse, get_fields, handle_errors
+from users.authentication import StatelessJWTAuthentication
+from .idempotency import IdempotencyKeyMismatch, get_idempotency_key
+from .services import (aadd_card, acancel_payment_intent, acreate_payment, adefault_card, adelete_card,
+                       aensure_customer, arefund_payment_intent, aset_default_card, aupdate_card, list_cards)
+
+logger = logging.getLogger('django')
+
+
+class AsyncAPIView:
+    """
+    Class is a minimal async counterpart of rest_framework APIView, it authenticates the request, parses the
+    body and dispatches to the async handler of the http method so the Stripe calls never block a worker thread.
+    """
+    authentication_classes = [StatelessJWTAuthentication]
+
+    @classmethod
+    def as_view(cls):
+        """
+        Function is used to build the async view function for the url conf.
+        :return: coroutine function view.
+        """
+        async def view(request, *args, **kwargs):
+            return await cls().dispatch(request, *args, **kwargs)
+        view.csrf_exempt = True
+        view.view_class = cls
+        return view
+
+    def authenticate(self, request):
+        """
+        Function is used to authenticate the request with the configured authentication classes.
+        :param request: django request.
+        :return: authenticated user.
+        """
+        for authentication_class in self.authentication_classes:
+            user_auth_tuple = authentication_class().authenticate(request)
+            if user_auth_tuple is not None:
+                return user_auth_tuple[0]
+        raise exceptions.NotAuthenticated()
+
+    def parse_body(self, request):
+        """
+        Function is used to parse the json or form encoded request body.
+        :param request: django request.
+        :return: dict like request data.
+        """
+        if request.content_type == 'application/json':
+            return json.loads(request.body or b'{}')
+        return QueryDict(request.body)
+
+    async def dispatch(self, request, *args, **kwargs):
+        """
+        Function is used to authenticate the request and call the handler of the http method.
+        :param request: django request.
+        :return: JsonResponse.
+        """
+        handler = getattr(self, request.method.lower(), None)
+        if handler is None:
+            return ApiResponse(status=0, message=exceptions.MethodNotAllowed(request.method).detail,
+                               http_status=status.HTTP_405_METHOD_NOT_ALLOWED).create_json_response()
+        try:
+            request.user = await sync_to_async(self.authenticate)(request)
+            request.data = self.parse_body(request)
+        except exceptions.APIException as e:
+            return ApiResponse(status=0, message=str(e.detail), http_status=e.status_code).create_json_response()
+        except ValueError:
+            return ApiResponse(status=0, message=exceptions.ParseError.default_detail,
+                               http_status=status.HTTP_400_BAD_REQUEST).create_json_response()
+        return await handler(request, *args, **kwargs)
+
+
+class AsyncCreatePayment(AsyncAPIView):
+    """
+    Class is used to Create PaymentIntent.
+    """
+    @handle_errors(constants.CREATE_PAYMENT_INTENT_FAIL)
+    async def post(self, request):
+        """
+        Function is used to create new PaymentIntent object and return status.
+        :param request:request header with required info for creating new PaymentIntent.
+        :return:PaymentIntent details or error message.
+        """
+        no_count = request.data.get(constants.PARAM_NO_COUNT)
+        if not no_count:
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_NO_COUNT),
+                               http_status=status.HTTP_404_NOT_FOUND).create_json_response()
+        try:
+            data, replayed = await acreate_payment(request.user, no_count, get_idempotency_key(request))
+        except IdempotencyKeyMismatch:
+            return ApiResponse(status=0, message=constants.IDEMPOTENCY_KEY_MISMATCH,
+                               http_status=status.HTTP_400_BAD_REQUEST).create_json_response()
+        response = ApiResponse(status=1, data=data,
+                               message=constants.CREATE_PAYMENT_INTENT_SUCCESS,
+                               http_status=status.HTTP_201_CREATED).create_json_response()
+        if replayed:
+            response['Idempotent-Replayed'] = 'true'
+        return response
+
+
+class AsyncCreateRefund(AsyncAPIView):
+    """
+    Class is used to Create PaymentRefund.
+    """
+
+    @handle_errors(constants.CREATE_PAYMENT_REFUND_FAIL)
+    async def post(self, request):
+        """
+        Function is used to create new PaymentRefund object and return the details & the status.
+        :param request:request header with required info for creating new PaymentRefund.
+        :return:PaymentRefund details or error message.
+        """
+        payment_intent = request.data.get(constants.PARAM_PAYMENT_INTENT_ID)
+        if not payment_intent:
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_PAYMENT_INTENT_ID)).create_json_response()
+        refund = await arefund_payment_intent(payment_intent)
+        if refund is None:
+            return ApiResponse(status=0,
+                               message=constants.PAYMENT_ALREADY_REFUND,
+                               http_status=status.HTTP_200_OK).create_json_response()
+        return ApiResponse(status=1, data=refund,
+                           message=constants.CREATE_PAYMENT_REFUND_SUCCESS,
+                           http_status=status.HTTP_200_OK).create_json_response()
+
+
+class AsyncCancelPaymentIntent(AsyncAPIView):
+    """
+    Class is used to Cancel PaymentIntent.
+    """
+
+    @handle_errors(constants.CANCEL_PAYMENT_INTENT_FAIL)
+    async def post(self, request):
+        """
+        Function is used to cancel PaymentIntent with an incomplete status & return the details.
+        :param request:request header with required info for canceling PaymentIntent.
+        :return:PaymentIntent details with cancellation status or error message.
+        """
+        payment_intent = request.data.get(constants.PARAM_PAYMENT_INTENT_ID)
+        if not payment_intent:
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_PAYMENT_INTENT_ID)).create_json_response()
+        intent = await acancel_payment_intent(payment_intent)
+        return ApiResponse(status=1, data={'cancel_intent': intent},
+                           message=constants.CANCEL_PAYMENT_INTENT_SUCCESS,
+                           http_status=status.HTTP_200_OK).create_json_response()
+
+
+class AsyncCardManagement(AsyncAPIView):
+    """
+    Class is used to Create,retrieved,update,delete Card objects.
+    """
+
+    @handle_errors(constants.GET_ALL_CARD_FAIL)
+    async def get(self, request):
+        """
+        Function is used to get all cards details of a user & return the details.
+        :param request: request header with required info.
+        :return: all cards list with json
+        """
+        customer_id = await aensure_customer(request.user)
+        card_list = await sync_to_async(list_cards)(customer_id)
+        return ApiResponse(status=1, data=card_list, fields=get_fields(request),
+                           message=constants.GET_ALL_CARD_SUCCESS,
+                           http_status=status.HTTP_200_OK).create_json_response()
+
+    @handle_errors(constants.CREATE_CARD_FAIL)
+    async def post(self, request):
+        """
+        Function is used to Create Card objects of a user/customer & return the details.
+        :param request: request header with required info.
+        :return: card details with json or error message.
+        """
+        source_id = request.data.get(constants.PARAM_SOURCE_ID)
+        if not source_id:
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_SOURCE_ID),
+                               http_status=status.HTTP_404_NOT_FOUND).create_json_response()
+        new_card = await aadd_card(request.user, source_id)
+        if new_card is None:
+            return ApiResponse(status=0,
+                               message=constants.CARD_ALREADY_EXIST,
+                               http_status=status.HTTP_400_BAD_REQUEST).create_json_response()
+        return ApiResponse(status=1, data=new_card, fields=get_fields(request),
+                           message=constants.CREATE_CARD_SUCCESS,
+                           http_status=status.HTTP_200_OK).create_json_response()
+
+    @handle_errors(constants.UPDATE_CARD_FAIL)
+    async def put(self, request):
+        """
+        Function is used to update Card objects of a user/customer & return the status.
+        :param request: request header with required info.
+        :return: card object with json
+        """
+        card_id = request.data.get(constants.PARAM_CARD_ID)
+        if not card_id:
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_CARD_ID),
+                               http_status=status.HTTP_404_NOT_FOUND).create_json_response()
+        customer_id = await aensure_customer(request.user)
+        card = await aupdate_card(customer_id, card_id, name=request.data.get(constants.PARAM_CARD_HOLDER_NAME),
+                                  exp_month=request.data.get(constants.PARAM_EXP_MONTH),
+                                  exp_year=request.data.get(constants.PARAM_EXP_YEAR))
+        return ApiResponse(status=1, data=card, fields=get_fields(request),
+                           message=constants.UPDATE_CARD_SUCCESS,
+                           http_status=status.HTTP_200_OK).create_json_response()
+
+    @handle_errors(constants.DELETE_CARD_FAIL)
+    async def delete(self, request):
+        """
+        Function is used to delete Card objects of a user/customer & return the status.
+        :param request: request header with required info.
+        :return: card id,object & status with json
+        """
+        card_id = request.data.get(constants.PARAM_CARD_ID)
+        if not card_id:
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_CARD_ID),
+                               http_status=status.HTTP_404_NOT_FOUND).create_json_response()
+        customer_id = await aensure_customer(request.user)
+        return ApiResponse(status=1, data=await adelete_card(customer_id, card_id),
+                           message=constants.DELETE_CARD_SUCCESS,
+                           http_status=status.HTTP_200_OK).create_json_response()
+
+
+class AsyncDefaultCard(AsyncAPIView):
+    """
+    Class is used to Set/Get Default Card objects.
+    """
+
+    @handle_errors(constants.DEFAULT_CARD_FAIL)
+    async def get(self, request):
+        """
+        Function is used to get default card of a customer & return the card id.
+        :param request: request header with required info.
+        :return: card id with json
+        """
+        customer_id = await aensure_customer(request.user)
+        return ApiResponse(status=1, data=await adefault_card(customer_id),
+                           message=constants.DEFAULT_CARD_SUCCESS,
+                           http_status=status.HTTP_200_OK).create_json_response()
+
+    @handle_errors(constants.SET_DEFAULT_CARD_FAIL)
+    async def post(self, request):
+        """
+        Function is used to Set Default Card of a user/customer & return the details.
+        :param request: request header with required info.
+        :return: card details with json
+        """
+        card_id = request.data.get(constants.PARAM_CARD_ID)
+        if not card_id:
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_CARD_ID),
+                               http_status=status.HTTP_404_NOT_FOUND).create_json_response()
+        customer_id = await aensure_customer(request.user)
+        return ApiResponse(status=1, data=await aset_default_card(customer_id, card_id), fields=get_fields(request),
+                           message=constants.SET_DEFAULT_CARD_SUCCESS,
+                           http_status=status.HTTP_200_OK).create_json_response()
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import threading
+import time
+from functools import partial
+
+import stripe
+from django.core.cache import caches
+
+from stripe_card_payment import settings
+from stripe_utils.singleflight import AsyncSingleFlight, SingleFlight
+
+"""
+    This module contains the read-through cache in front of the Stripe read calls of the views.
+"""
+
+logger = logging.getLogger('django')
+
+
+class StripeCache:
+    """
+        This is a class for answering Stripe reads from the Django cache framework.
+
+        Every object type (``customer``, ``token``, ``sources``...) has its own TTL. An entry past its TTL is still
+        served for ``stale_seconds`` while a single caller, elected with ``cache.add``, refreshes it, so a hot key
+        expiring does not send every worker to Stripe at once. Concurrent misses inside a process share one call.
+        Objects are stored as plain dicts, the API key never reaches the cache backend. The async methods do the
+        cache I/O on the default executor, a file or memcached backend would block the event loop.
+
+        Attributes:
+            alias (str): Django cache alias, a file or memcached backend shares the entries between processes.
+            ttls (dict): Object type -> seconds an entry is fresh.
+            stale_seconds (float): Seconds an expired entry is still served while it is refreshed.
+    """
+    LOCK_TIMEOUT = 10
+
+    def __init__(self, alias='default', ttls=None, stale_seconds=30):
+        self.alias = alias
+        self.ttls = ttls or {}
+        self.stale_seconds = stale_seconds
+        self._flights = SingleFlight()
+        self._async_flights = AsyncSingleFlight()
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _count(self, kind, counter):
+        with self._lock:
+            counters = self._counters.setdefault(kind, {'hits': 0, 'stale_hits': 0, 'misses': 0, 'stripe_calls': 0,
+                                                        'writes': 0, 'invalidations': 0})
+            counters[counter] += 1
+
+    def _key(self, kind, key):
+        return 'stripe:{}:{}'.format(kind, key)
+
+    def _set(self, kind, key, obj):
+        ttl = self.ttls.get(kind, 60)
+        entry = {'data': obj.to_dict_recursive(), 'fresh_until': time.time() + ttl}
+        self.cache.set(self._key(kind, key), entry, timeout=ttl + self.stale_seconds)
+
+    def _fetch(self, kind, key, fetch, *args):
+        self._count(kind, 'stripe_calls')
+        obj = fetch(*args)
+        self._set(kind, key, obj)
+        return obj
+
+    def _refresh(self, kind, key, fetch, *args):
+        lock_key = self._key(kind, key) + ':refresh'
+        if not self.cache.add(lock_key, 1, timeout=self.LOCK_TIMEOUT):
+            return None
+        try:
+            return self._fetch(kind, key, fetch, *args)
+        except Exception as e:
+            # The stale entry keeps being served until it is refreshed or expires.
+            logger.warning("Refreshing cached Stripe {} {} failed {}".format(kind, key, e))
+            return None
+        finally:
+            self.cache.delete(lock_key)
+
+    async def _run(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, partial(fn, *args, **kwargs))
+
+    async def _afetch(self, kind, key, fetch, *args):
+        self._count(kind, 'stripe_calls')
+        obj = await fetch(*args)
+        await self._run(self._set, kind, key, obj)
+        return obj
+
+    async def _arefresh(self, kind, key, fetch, *args):
+        lock_key = self._key(kind, key) + ':refresh'
+        if not await self._run(self.cache.add, lock_key, 1, timeout=self.LOCK_TIMEOUT):
+            return None
+        try:
+            return await self._afetch(kind, key, fetch, *args)
+        except Exception as e:
+            # The stale entry keeps being served until it is refreshed or expires.
+            logger.warning("Refreshing cached Stripe {} {} failed {}".format(kind, key, e))
+            return None
+        finally:
+            await self._run(self.cache.delete, lock_key)
+
+    def get(self, kind, key, fetch, *args):
+        """
+        Function is used to read a Stripe object through the cache.
+        :param kind: object type such as ``customer``, it selects the TTL.
+        :param key: id of the object.
+        :param fetch: function called with ``args`` to read the object from Stripe on a miss.
+        :return: stripe object.
+        """
+        entry = self.cache.get(self._key(kind, key))
+        if entry is None:
+            self._count(kind, 'misses')
+            return self._flights.do((kind, key), self._fetch, kind, key, fetch, *args)
+        if entry['fresh_until'] <= time.time():
+            self._count(kind, 'stale_hits')
+            obj = self._refresh(kind, key, fetch, *args)
+            if obj is not None:
+                return obj
+        else:
+            self._count(kind, 'hits')
+        return stripe.util.convert_to_stripe_object(entry['data'], stripe.api_key, stripe.api_version, None)
+
+    async def aget(self, kind, key, fetch, *args):
+        """
+        Function is used by the async views to read a Stripe object through the cache.
+        :param kind: object type such as ``customer``, it selects the TTL.
+        :param key: id of the object.
+        :param fetch: coroutine function called with ``args`` to read the object from Stripe on a miss.
+        :return: stripe object.
+        """
+        entry = await self._run(self.cache.get, self._key(kind, key))
+        if entry is None:
+            self._count(kind, 'misses')
+            return await self._async_flights.do((kind, key), self._afetch, kind, key, fetch, *args)
+        if entry['fresh_until'] <= time.time():
+            self._count(kind, 'stale_hits')
+            obj = await self._arefresh(kind, key, fetch, *args)
+            if obj is not None:
+                return obj
+        else:
+            self._count(kind, 'hits')
+        return stripe.util.convert_to_stripe_object(entry['data'], stripe.api_key, stripe.api_version, None)
+
+    def store(self, kind, key, obj):
+        """
+        Function is used to write an object returned by Stripe through the cache.
+        :param kind: object type such as ``customer``.
+        :param key: id of the object.
+        :param obj: stripe object.
+        """
+        self._count(kind, 'writes')
+        self._set(kind, key, obj)
+
+    async def astore(self, kind, key, obj):
+        """
+        Function is used by the async views to write an object returned by Stripe through the cache.
+        """
+        await self._run(self.store, kind, key, obj)
+
+    def invalidate(self, kind, key):
+        """
+        Function is used by the write paths to drop a cached object after it changed.
+        :param kind: object type such as ``customer``.
+        :param key: id of the object.
+        """
+        self._count(kind, 'invalidations')
+        self.cache.delete(self._key(kind, key))
+
+    def invalidate_customer(self, customer_id):
+        """
+        Function is used to drop a customer and its source list after one of them changed.
+        :param customer_id: stripe customer id.
+        """
+        self.invalidate('customer', customer_id)
+        self.invalidate('sources', customer_id)
+
+    async def ainvalidate_customer(self, customer_id):
+        """
+        Function is used by the async views to drop a customer and its source list after one of them changed.
+        :param customer_id: stripe customer id.
+        """
+        await self._run(self.invalidate_customer, customer_id)
+
+    def metrics(self):
+        """
+        Function is used to report the hit ratio and the Stripe calls saved per object type.
+        :return: dict of object type -> cache counters.
+        """
+        with self._lock:
+            counters = {kind: dict(values) for kind, values in self._counters.items()}
+        for values in counters.values():
+            lookups = values['hits'] + values['stale_hits'] + values['misses']
+            values['hit_ratio'] = round((values['hits'] + values['stale_hits']) / lookups, 4) if lookups else 0.0
+            values['stripe_calls_saved'] = max(lookups - values['stripe_calls'], 0)
+        return counters
+
+
+stripe_cache = StripeCache(alias=settings.STRIPE_CACHE_ALIAS, ttls=settings.STRIPE_CACHE_TTLS,
+                           stale_seconds=settings.STRIPE_CACHE_STALE_SECONDS)
+
+
+def invalidate_for_event(event):
+    """
+    Function is used to drop the cached customer a Stripe event is about.
+    :param event: verified Stripe event.
+    """
+    if not event.type.startswith('customer.'):
+        return
+    obj = event.data.object
+    customer_id = obj.id if obj.object == 'customer' else obj.get('customer')
+    if customer_id:
+        stripe_cache.invalidate_customer(customer_id)
@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import json
+from functools import partial
+
+from django.core.cache import cache
+
+import constants
+from stripe_card_payment import settings
+from stripe_utils.singleflight import AsyncSingleFlight, SingleFlight
+
+"""
+    This module contains the helpers used to make client retries of the payment endpoints idempotent.
+"""
+
+flights = SingleFlight()
+async_flights = AsyncSingleFlight()
+
+
+class IdempotencyKeyMismatch(Exception):
+    """
+    Exception is raised when an idempotency key is replayed with different parameters.
+    """
+
+
+def get_idempotency_key(request):
+    """
+    Function is used to read the client idempotency key from the Idempotency-Key header or the request body.
+    :param request: request with the client data.
+    :return: idempotency key or None.
+    """
+    return request.META.get('HTTP_IDEMPOTENCY_KEY') or request.data.get(constants.PARAM_IDEMPOTENCY_KEY)
+
+
+def scoped_key(scope, user_id, idempotency_key):
+    """
+    Function is used to namespace a client key per endpoint and user, Stripe keys are shared by the whole account.
+    :return: key sent to Stripe and used for the local cache.
+    """
+    return '{}:{}:{}'.format(scope, user_id, idempotency_key)
+
+
+def _params_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def run_idempotent(key, params, fn, *args):
+    """
+    Function is used to run ``fn`` at most once per key: replays are answered from the cache and concurrent
+    identical requests are coalesced into one upstream call.
+    :param key: scoped idempotency key.
+    :param params: request parameters, a replay with other parameters is rejected.
+    :param fn: function doing the Stripe call, called with ``args`` and the key as ``idempotency_key``.
+    :return: tuple of response data and whether it was replayed.
+    """
+    params_hash = _params_hash(params)
+    cache_key = 'idempotency:{}'.format(key)
+
+    def call():
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached, True
+        data = fn(*args, idempotency_key=key)
+        cache.set(cache_key, {'params': params_hash, 'data': data}, settings.IDEMPOTENCY_CACHE_TIMEOUT)
+        return {'params': params_hash, 'data': data}, False
+
+    entry = cache.get(cache_key)
+    replayed = entry is not None
+    if not replayed:
+        entry, replayed = flights.do(cache_key, call)
+    if entry['params'] != params_hash:
+        raise IdempotencyKeyMismatch(key)
+    return entry['data'], replayed
+
+
+async def arun_idempotent(key, params, fn, *args):
+    """
+    Function is used by the async views like ``run_idempotent()``, the cache is read and written on the default
+    executor so the event loop never waits on the cache backend.
+    :param key: scoped idempotency key.
+    :param params: request parameters, a replay with other parameters is rejected.
+    :param fn: coroutine function doing the Stripe call, called with ``args`` and the key as ``idempotency_key``.
+    :return: tuple of response data and whether it was replayed.
+    """
+    params_hash = _params_hash(params)
+    cache_key = 'idempotency:{}'.format(key)
+    loop = asyncio.get_running_loop()
+
+    async def call():
+        cached = await loop.run_in_executor(None, cache.get, cache_key)
+        if cached is not None:
+            return cached, True
+        data = await fn(*args, idempotency_key=key)
+        entry = {'params': params_hash, 'data': data}
+        await loop.run_in_executor(None, partial(cache.set, cache_key, entry, settings.IDEMPOTENCY_CACHE_TIMEOUT))
+        return entry, False
+
+    entry = await loop.run_in_executor(None, cache.get, cache_key)
+    replayed = entry is not None
+    if not replayed:
+        entry, replayed = await async_flights.do(cache_key, call)
+    if entry['params'] != params_hash:
+        raise IdempotencyKeyMismatch(key)
+    return entry['data'], replayed
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.outbox import OutboxDispatcher
+
+
+class Command(BaseCommand):
+    """
+    Command is used to run the dispatcher which sends the Stripe customer calls recorded by the user views.
+    """
+    help = "Send the Stripe customer calls of the outbox in batches on a thread pool."
+
+    def add_arguments(self, parser):
+        """
+        Function is used to register the command line options.
+        :param parser: argparse parser of the command.
+        """
+        parser.add_argument('--workers', type=int, default=settings.OUTBOX_WORKERS,
+                            help="Number of threads sending Stripe calls.")
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE,
+                            help="Number of messages claimed per poll.")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to wait when the outbox is empty.")
+        parser.add_argument('--once', action='store_true', help="Exit once the outbox is drained.")
+
+    def handle(self, *args, **options):
+        """
+        Function is used to start the dispatcher.
+        """
+        dispatcher = OutboxDispatcher(workers=options['workers'], batch_size=options['batch_size'],
+                                      max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+                                      visibility_timeout=settings.OUTBOX_VISIBILITY_TIMEOUT)
+        dispatcher.run(poll_interval=options['poll_interval'], once=options['once'])
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.webhooks import WebhookWorker
+
+
+class Command(BaseCommand):
+    """
+    Command is used to run the worker which handles the Stripe events stored by the webhook view.
+    """
+    help = "Drain the Stripe webhook inbox in batches on a thread pool."
+
+    def add_arguments(self, parser):
+        """
+        Function is used to register the command line options.
+        :param parser: argparse parser of the command.
+        """
+        parser.add_argument('--workers', type=int, default=settings.WEBHOOK_WORKERS,
+                            help="Number of threads handling events.")
+        parser.add_argument('--batch-size', type=int, default=settings.WEBHOOK_BATCH_SIZE,
+                            help="Number of events claimed per poll.")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to wait when the inbox is empty.")
+        parser.add_argument('--once', action='store_true', help="Exit once the inbox is drained.")
+
+    def handle(self, *args, **options):
+        """
+        Function is used to start the worker.
+        """
+        worker = WebhookWorker(workers=options['workers'], batch_size=options['batch_size'],
+                               concurrency_limits=settings.WEBHOOK_CONCURRENCY_LIMITS,
+                               max_attempts=settings.WEBHOOK_MAX_ATTEMPTS,
+                               visibility_timeout=settings.WEBHOOK_VISIBILITY_TIMEOUT)
+        worker.run(poll_interval=options['poll_interval'], once=options['once'])
@@ -0,0 +1,59 @@
+import logging
+
+import stripe
+from django.core.management.base import BaseCommand
+
+from payments.models import Card
+from users.models import User
+
+logger = logging.getLogger('django')
+
+
+class Command(BaseCommand):
+    """
+    Command is used to backfill the local card mirror from Stripe for existing users.
+    """
+    help = "Backfill the local Card mirror from the Stripe sources of every user with a customer_id."
+
+    def add_arguments(self, parser):
+        """
+        Function is used to register the command line options.
+        :param parser: argparse parser of the command.
+        """
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Number of customers fetched per Stripe page and written per DB batch.")
+
+    def fetch_sources(self, customer):
+        """
+        Function is used to get every card of a customer, using the embedded first page when it is complete.
+        :param customer: Stripe customer object.
+        :return: list of Stripe card objects.
+        """
+        sources = customer.get('sources')
+        if sources is not None and not sources.has_more:
+            return list(sources.data)
+        return list(stripe.Customer.list_sources(customer.id, object="card", limit=100).auto_paging_iter())
+
+    def handle(self, *args, **options):
+        """
+        Function is used to walk all Stripe customers page by page and replace the mirror in bulk.
+        """
+        batch_size = options['batch_size']
+        customer_ids = set(User.objects.exclude(customer_id__isnull=True).values_list('customer_id', flat=True))
+        sources_by_customer = {}
+        default_by_customer = {}
+        total_cards = 0
+        for customer in stripe.Customer.list(limit=batch_size).auto_paging_iter():
+            if customer.id not in customer_ids:
+                continue
+            sources_by_customer[customer.id] = self.fetch_sources(customer)
+            default_by_customer[customer.id] = customer.get('default_source')
+            customer_ids.discard(customer.id)
+            if len(sources_by_customer) >= batch_size:
+                total_cards += Card.objects.replace_for_customers(sources_by_customer, default_by_customer)
+                sources_by_customer, default_by_customer = {}, {}
+        if sources_by_customer:
+            total_cards += Card.objects.replace_for_customers(sources_by_customer, default_by_customer)
+        if customer_ids:
+            logger.warning("sync_cards could not find {} customers on Stripe".format(len(customer_ids)))
+        self.stdout.write(self.style.SUCCESS("Mirrored {} cards.".format(total_cards)))
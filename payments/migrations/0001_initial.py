@@ -0,0 +1,35 @@
+# Generated by Django 3.0.8 on 2026-10-18 06:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Card',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('card_id', models.CharField(max_length=50, unique=True)),
+                ('customer_id', models.CharField(db_index=True, max_length=50)),
+                ('fingerprint', models.CharField(blank=True, max_length=50, null=True)),
+                ('brand', models.CharField(blank=True, max_length=20, null=True)),
+                ('last4', models.CharField(blank=True, max_length=4, null=True)),
+                ('exp_month', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('exp_year', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('name', models.CharField(blank=True, max_length=100, null=True)),
+                ('is_default', models.BooleanField(default=False)),
+                ('data', models.TextField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.8 on 2026-10-18 06:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='card',
+            constraint=models.UniqueConstraint(fields=('customer_id', 'fingerprint'), name='unique_customer_card_fingerprint'),
+        ),
+    ]
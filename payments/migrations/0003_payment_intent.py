@@ -0,0 +1,35 @@
+# Generated by Django 3.1.14 on 2026-10-18 06:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('payments', '0002_card_fingerprint_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentIntent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('intent_id', models.CharField(max_length=50, unique=True)),
+                ('customer_id', models.CharField(blank=True, max_length=50, null=True)),
+                ('amount', models.PositiveIntegerField()),
+                ('currency', models.CharField(max_length=3)),
+                ('status', models.CharField(max_length=30)),
+                ('client_secret', models.CharField(blank=True, max_length=100, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_intents', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='paymentintent',
+            index=models.Index(fields=['user', 'status'], name='payment_intent_user_status'),
+        ),
+    ]
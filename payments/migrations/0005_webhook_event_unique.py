@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 06:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_webhook_event'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='webhookevent',
+            name='event_id',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.1.14 on 2026-10-18 06:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('payments', '0005_webhook_event_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Refund',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('refund_id', models.CharField(max_length=50, unique=True)),
+                ('payment_intent_id', models.CharField(blank=True, db_index=True, max_length=50, null=True)),
+                ('charge_id', models.CharField(blank=True, max_length=50, null=True)),
+                ('amount', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(blank=True, max_length=30, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='refunds', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Charge',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('charge_id', models.CharField(max_length=50, unique=True)),
+                ('payment_intent_id', models.CharField(blank=True, db_index=True, max_length=50, null=True)),
+                ('amount', models.PositiveIntegerField(default=0)),
+                ('amount_refunded', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(blank=True, max_length=30, null=True)),
+                ('refunded', models.BooleanField(default=False)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='charges', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
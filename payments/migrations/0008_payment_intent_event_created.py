@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_outbox_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentintent',
+            name='event_created',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
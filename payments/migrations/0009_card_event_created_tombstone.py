@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 07:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0008_payment_intent_event_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='event_created',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='is_deleted',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,3 +1,570 @@
-from django.db import models
+import json
 
-# Create your models here.
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from response_utils import RawJSON
+from users.models import BaseModel
+
+
+def _upsert(manager, defaults, stale=None, **lookup):
+    """
+    Function is used to update a row or insert it when missing. Unlike update_or_create it never reads before
+    writing inside a transaction, which SQLite aborts with "database is locked" under concurrent writers.
+    :param manager: model manager.
+    :param defaults: field values to write.
+    :param stale: Q condition of the existing rows which must be left as they are, such as rows newer than defaults.
+    :param lookup: unique field identifying the row.
+    :return: model object.
+    """
+    defaults = dict(defaults, modified_on=timezone.now())
+    rows = manager.filter(**lookup)
+    fresh = rows.exclude(stale) if stale is not None else rows
+    if fresh.update(**defaults) or (stale is not None and rows.exists()):
+        return manager.get(**lookup)
+    try:
+        with transaction.atomic():
+            return manager.create(**lookup, **defaults)
+    except IntegrityError:
+        # Inserted concurrently, otherwise another unique constraint failed and the error stands.
+        if not fresh.update(**defaults) and not (stale is not None and rows.exists()):
+            raise
+    return manager.get(**lookup)
+
+
+def _card_fields(source):
+    """
+    Function is used to pick the mirrored columns out of a Stripe card object.
+    :param source: Stripe card object (or plain dict) as returned by the API.
+    :return: dict of Card model field values.
+    """
+    return {
+        'customer_id': source.get('customer'),
+        'fingerprint': source.get('fingerprint'),
+        'brand': source.get('brand'),
+        'last4': source.get('last4'),
+        'exp_month': source.get('exp_month'),
+        'exp_year': source.get('exp_year'),
+        'name': source.get('name'),
+        'data': json.dumps(source),
+    }
+
+
+class CardManager(models.Manager):
+    """
+    Manager is used to keep the local card mirror in sync with Stripe.
+    """
+
+    def for_customer(self, customer_id):
+        """
+        Function is used to get all mirrored cards of a customer, newest first like Stripe does.
+        :param customer_id: Stripe customer id.
+        :return: Card queryset.
+        """
+        return self.filter(customer_id=customer_id, is_deleted=False).order_by('-id')
+
+    def upsert_from_stripe(self, source, event_created=None):
+        """
+        Function is used to create or update a mirrored card from a Stripe card object. Like
+        ``replace_for_customers`` it keeps one card per fingerprint, a card with the number of a card already
+        mirrored for the customer is skipped. Webhook events are handled concurrently and may arrive out of order,
+        so a deleted card is never brought back and an event older than the last applied one is ignored.
+        :param source: Stripe card object.
+        :param event_created: creation time of the webhook event carrying the card, None for an API response.
+        :return: Card object, the already mirrored card when the source was skipped as a duplicate, or None if the
+        source is not a card or the card is deleted.
+        """
+        if source.get('object') != 'card' or not source.get('customer'):
+            return None
+        defaults = _card_fields(source)
+        stale = Q(is_deleted=True)
+        if event_created is not None:
+            defaults['event_created'] = event_created
+            stale |= Q(event_created__gt=event_created)
+        try:
+            card = _upsert(self, defaults, stale=stale, card_id=source['id'])
+            return None if card.is_deleted else card
+        except IntegrityError:
+            # Only the fingerprint constraint can fail, a card_id clash is updated by _upsert.
+            duplicate = self.filter(customer_id=source['customer'], fingerprint=source.get('fingerprint')).exclude(
+                card_id=source['id']).first()
+            if duplicate is None:
+                raise
+            return duplicate
+
+    def remove(self, customer_id, card_id):
+        """
+        Function is used to drop a mirrored card once it is deleted on Stripe. The row is kept as a tombstone, so a
+        created or updated event of the card handled after the delete does not bring it back. Stripe never gives a
+        card id again, a tombstone stays deleted.
+        :param customer_id: Stripe customer id.
+        :param card_id: Stripe card id.
+        """
+        _upsert(self, {
+            'customer_id': customer_id,
+            'fingerprint': None,
+            'is_default': False,
+            'is_deleted': True,
+            'data': '{}',
+        }, card_id=card_id)
+
+    def has_fingerprint(self, customer_id, fingerprint):
+        """
+        Function is used to check whether a customer already has a card with the same number.
+        :param customer_id: Stripe customer id.
+        :param fingerprint: Stripe card fingerprint.
+        :return: True if the card already exists.
+        """
+        return self.filter(customer_id=customer_id, fingerprint=fingerprint, is_deleted=False).exists()
+
+    def set_default(self, customer_id, card_id):
+        """
+        Function is used to flag the default card of a customer.
+        :param customer_id: Stripe customer id.
+        :param card_id: Stripe card id which is now the default source.
+        """
+        with transaction.atomic():
+            self.filter(customer_id=customer_id, is_default=True).exclude(card_id=card_id).update(is_default=False)
+            self.filter(customer_id=customer_id, card_id=card_id, is_deleted=False).update(is_default=True)
+
+    def replace_for_customers(self, sources_by_customer, default_by_customer=None):
+        """
+        Function is used to replace the mirror of many customers in bulk.
+        :param sources_by_customer: dict of customer_id -> list of Stripe card objects (newest first).
+        :param default_by_customer: dict of customer_id -> default source id.
+        :return: number of mirrored cards.
+        """
+        default_by_customer = default_by_customer or {}
+        deleted = set(self.filter(customer_id__in=list(sources_by_customer), is_deleted=True).values_list(
+            'card_id', flat=True))
+        cards = []
+        for customer_id, sources in sources_by_customer.items():
+            customer_cards = []
+            fingerprints = set()
+            for source in sources:
+                # Cards added before duplicate detection existed may share a fingerprint, keep the newest one.
+                if source.get('object') != 'card' or source.get('fingerprint') in fingerprints:
+                    continue
+                # Deleted while the sources were listed.
+                if source['id'] in deleted:
+                    continue
+                if source.get('fingerprint'):
+                    fingerprints.add(source['fingerprint'])
+                fields = _card_fields(source)
+                fields['customer_id'] = customer_id
+                fields['is_default'] = source['id'] == default_by_customer.get(customer_id)
+                customer_cards.append(self.model(card_id=source['id'], **fields))
+            # Insert oldest first so that ordering by -id matches the Stripe list order.
+            cards.extend(reversed(customer_cards))
+        with transaction.atomic():
+            self.filter(customer_id__in=list(sources_by_customer), is_deleted=False).delete()
+            self.bulk_create(cards)
+        return len(cards)
+
+
+class Card(BaseModel):
+    """
+    Card class is a local mirror of the card sources attached to a Stripe customer,
+    so card reads do not need a Stripe round trip.
+    :param BaseModel: Base class which has common attribute for the
+    application.
+    """
+    card_id = models.CharField(max_length=50, unique=True)
+    customer_id = models.CharField(max_length=50, db_index=True)
+    fingerprint = models.CharField(max_length=50, blank=True, null=True)
+    brand = models.CharField(max_length=20, blank=True, null=True)
+    last4 = models.CharField(max_length=4, blank=True, null=True)
+    exp_month = models.PositiveSmallIntegerField(blank=True, null=True)
+    exp_year = models.PositiveSmallIntegerField(blank=True, null=True)
+    name = models.CharField(max_length=100, blank=True, null=True)
+    is_default = models.BooleanField(default=False)
+    data = models.TextField()
+    # Creation time of the last webhook event applied, as a unix timestamp.
+    event_created = models.PositiveIntegerField(blank=True, null=True)
+    # Tombstone of a card deleted on Stripe, hidden from the card reads.
+    is_deleted = models.BooleanField(default=False)
+
+    objects = CardManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer_id', 'fingerprint'], name='unique_customer_card_fingerprint'),
+        ]
+
+    def __str__(self):
+        """Default object return value, it will return card id
+        :return self.card_id: Stripe id of the card.
+        """
+        return self.card_id
+
+    def to_stripe(self):
+        """
+        Function is used to return the mirrored Stripe card object.
+        :return: card dict as returned by Stripe.
+        """
+        return json.loads(self.data)
+
+    def to_raw_json(self):
+        """
+        Function is used to return the mirrored Stripe card as stored, the response renderer writes it without
+        parsing it.
+        :return: card JSON.
+        """
+        return RawJSON(self.data)
+
+
+class PaymentIntentManager(models.Manager):
+    """
+    Manager is used to keep the local index of Stripe PaymentIntents.
+    """
+    # Statuses in which an intent can still be confirmed and its amount updated.
+    OPEN_STATUSES = ('requires_payment_method', 'requires_confirmation')
+    # Statuses an intent never leaves.
+    TERMINAL_STATUSES = ('succeeded', 'canceled')
+
+    def open_for_user(self, user_id):
+        """
+        Function is used to get the latest still open intent of a user.
+        :param user_id: id of the user.
+        :return: PaymentIntent object or None.
+        """
+        return self.filter(user_id=user_id, status__in=self.OPEN_STATUSES).order_by('-id').first()
+
+    def record(self, intent, user_id=None, event_created=None):
+        """
+        Function is used to create or update the local copy of a Stripe PaymentIntent. Webhook events are handled
+        concurrently and may arrive out of order, so an intent in a terminal status is never moved back and an
+        event older than the last applied one is ignored.
+        :param intent: Stripe PaymentIntent object.
+        :param user_id: id of the paying user, read from the intent metadata when not given.
+        :param event_created: creation time of the webhook event carrying the intent, None for an API response.
+        :return: PaymentIntent object, unchanged when the intent was stale.
+        """
+        defaults = {
+            'customer_id': intent.get('customer'),
+            'amount': intent.get('amount'),
+            'currency': intent.get('currency'),
+            'status': intent.get('status'),
+        }
+        if intent.get('client_secret'):
+            defaults['client_secret'] = intent['client_secret']
+        user_id = user_id or (intent.get('metadata') or {}).get('user_id')
+        if user_id:
+            defaults['user_id'] = user_id
+        stale = Q(status__in=self.TERMINAL_STATUSES) & ~Q(status=defaults['status'])
+        if event_created is not None:
+            defaults['event_created'] = event_created
+            stale |= Q(event_created__gt=event_created)
+        return _upsert(self, defaults, stale=stale, intent_id=intent['id'])
+
+
+class PaymentIntent(BaseModel):
+    """
+    PaymentIntent class is a local index of the Stripe PaymentIntents created for the users, so an open intent
+    can be reused instead of creating a new one per checkout.
+    :param BaseModel: Base class which has common attribute for the
+    application.
+    """
+    intent_id = models.CharField(max_length=50, unique=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True,
+                             related_name='payment_intents')
+    customer_id = models.CharField(max_length=50, blank=True, null=True)
+    amount = models.PositiveIntegerField()
+    currency = models.CharField(max_length=3)
+    status = models.CharField(max_length=30)
+    client_secret = models.CharField(max_length=100, blank=True, null=True)
+    # Creation time of the last webhook event applied, as a unix timestamp.
+    event_created = models.PositiveIntegerField(blank=True, null=True)
+
+    objects = PaymentIntentManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'status'], name='payment_intent_user_status'),
+        ]
+
+    def __str__(self):
+        """Default object return value, it will return intent id
+        :return self.intent_id: Stripe id of the PaymentIntent.
+        """
+        return self.intent_id
+
+
+def _user_of_intent(payment_intent_id):
+    """
+    Function is used to find the user who paid a PaymentIntent from the local index.
+    :param payment_intent_id: Stripe PaymentIntent id.
+    :return: user id or None.
+    """
+    if not payment_intent_id:
+        return None
+    return PaymentIntent.objects.filter(intent_id=payment_intent_id).values_list('user_id', flat=True).first()
+
+
+class ChargeManager(models.Manager):
+    """
+    Manager is used to keep the charges of the payment ledger.
+    """
+
+    def record(self, charge):
+        """
+        Function is used to create or update the ledger entry of a Stripe charge and of its embedded refunds.
+        :param charge: Stripe Charge object.
+        :return: Charge object.
+        """
+        payment_intent_id = charge.get('payment_intent')
+        entry = _upsert(self, {
+            'payment_intent_id': payment_intent_id,
+            'user_id': _user_of_intent(payment_intent_id),
+            'amount': charge.get('amount') or 0,
+            'amount_refunded': charge.get('amount_refunded') or 0,
+            'status': charge.get('status'),
+            'refunded': bool(charge.get('refunded')),
+        }, charge_id=charge['id'])
+        for refund in (charge.get('refunds') or {}).get('data', []):
+            Refund.objects.record(refund)
+        return entry
+
+
+class RefundManager(models.Manager):
+    """
+    Manager is used to keep the refunds of the payment ledger.
+    """
+    # Refunds in these statuses did not return any money.
+    VOID_STATUSES = ('failed', 'canceled')
+
+    def record(self, refund):
+        """
+        Function is used to create or update the ledger entry of a Stripe refund.
+        :param refund: Stripe Refund object.
+        :return: Refund object.
+        """
+        payment_intent_id = refund.get('payment_intent')
+        return _upsert(self, {
+            'payment_intent_id': payment_intent_id,
+            'charge_id': refund.get('charge'),
+            'user_id': _user_of_intent(payment_intent_id),
+            'amount': refund.get('amount') or 0,
+            'status': refund.get('status'),
+        }, refund_id=refund['id'])
+
+    def is_refunded(self, payment_intent_id):
+        """
+        Function is used to check whether a PaymentIntent already has a refund.
+        :param payment_intent_id: Stripe PaymentIntent id.
+        :return: True if a refund exists.
+        """
+        return self.filter(payment_intent_id=payment_intent_id).exclude(status__in=self.VOID_STATUSES).exists()
+
+
+class Charge(BaseModel):
+    """
+    Charge class is the ledger entry of a Stripe charge made for a PaymentIntent.
+    :param BaseModel: Base class which has common attribute for the
+    application.
+    """
+    charge_id = models.CharField(max_length=50, unique=True)
+    payment_intent_id = models.CharField(max_length=50, blank=True, null=True, db_index=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True,
+                             related_name='charges')
+    amount = models.PositiveIntegerField(default=0)
+    amount_refunded = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=30, blank=True, null=True)
+    refunded = models.BooleanField(default=False)
+
+    objects = ChargeManager()
+
+    def __str__(self):
+        """Default object return value, it will return charge id
+        :return self.charge_id: Stripe id of the charge.
+        """
+        return self.charge_id
+
+
+class Refund(BaseModel):
+    """
+    Refund class is the ledger entry of a Stripe refund, it answers the already refunded check locally.
+    :param BaseModel: Base class which has common attribute for the
+    application.
+    """
+    refund_id = models.CharField(max_length=50, unique=True)
+    payment_intent_id = models.CharField(max_length=50, blank=True, null=True, db_index=True)
+    charge_id = models.CharField(max_length=50, blank=True, null=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True,
+                             related_name='refunds')
+    amount = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=30, blank=True, null=True)
+
+    objects = RefundManager()
+
+    def __str__(self):
+        """Default object return value, it will return refund id
+        :return self.refund_id: Stripe id of the refund.
+        """
+        return self.refund_id
+
+
+def _claim_batch(manager, batch_size, visibility_timeout, max_attempts):
+    """
+    Function is used to claim a batch of rows of a work queue which are due. Rows left in processing by a crashed or
+    hung worker are claimed again once the visibility timeout is over, or marked failed once they used their last
+    attempt. Every claim counts as an attempt.
+    :param manager: manager of a model with the status, attempts, next_attempt_on and last_error fields.
+    :param batch_size: maximum number of rows to claim.
+    :param visibility_timeout: seconds after which a processing row is considered abandoned.
+    :param max_attempts: attempts after which a row is marked failed.
+    :return: list of claimed model objects.
+    """
+    model = manager.model
+    now = timezone.now()
+    abandoned = Q(status=model.PROCESSING, modified_on__lte=now - timedelta(seconds=visibility_timeout))
+    manager.filter(abandoned, attempts__gte=max_attempts).update(
+        status=model.FAILED, modified_on=now, last_error='Abandoned by a crashed or hung worker.')
+    due = Q(status=model.PENDING, next_attempt_on__lte=now) | (abandoned & Q(attempts__lt=max_attempts))
+    claimed = []
+    for row in manager.filter(due).order_by('id')[:batch_size]:
+        # The conditional update makes the claim safe between several worker processes.
+        if manager.filter(pk=row.pk, status=row.status, modified_on=row.modified_on).update(
+                status=model.PROCESSING, modified_on=now, attempts=F('attempts') + 1):
+            row.status = model.PROCESSING
+            row.attempts += 1
+            claimed.append(row)
+    return claimed
+
+
+class WebhookEventManager(models.Manager):
+    """
+    Manager is used to claim the pending Stripe events of the webhook inbox.
+    """
+
+    def claim_batch(self, batch_size, visibility_timeout, max_attempts):
+        """
+        Function is used to claim a batch of events which are due, see ``_claim_batch()``.
+        :param batch_size: maximum number of events to claim.
+        :param visibility_timeout: seconds after which a processing event is considered abandoned.
+        :param max_attempts: attempts after which an event is marked failed.
+        :return: list of claimed WebhookEvent objects.
+        """
+        return _claim_batch(self, batch_size, visibility_timeout, max_attempts)
+
+
+class WebhookEvent(BaseModel):
+    """
+    WebhookEvent class is the durable inbox of verified Stripe events, the webhook view only stores them and the
+    process_webhooks worker handles them.
+    :param BaseModel: Base class which has common attribute for the
+    application.
+    """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    event_id = models.CharField(max_length=50, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_on = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    processed_on = models.DateTimeField(blank=True, null=True)
+
+    objects = WebhookEventManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_on'], name='webhook_event_due'),
+        ]
+
+    def __str__(self):
+        """Default object return value, it will return event id
+        :return self.event_id: Stripe id of the event.
+        """
+        return self.event_id
+
+
+class OutboxMessageManager(models.Manager):
+    """
+    Manager is used to write and claim the Stripe side effects of the outbox.
+    """
+
+    def enqueue(self, operation, user_id, customer_id=None):
+        """
+        Function is used inside the transaction of a user write to record the Stripe call it needs, the call is
+        only sent once the transaction committed.
+        :param operation: one of the OutboxMessage operations.
+        :param user_id: id of the user.
+        :param customer_id: Stripe customer id, required to delete the customer of a deleted user.
+        :return: OutboxMessage object.
+        """
+        return self.create(operation=operation, user_id=user_id, customer_id=customer_id)
+
+    def claim_batch(self, batch_size, visibility_timeout, max_attempts):
+        """
+        Function is used to claim a batch of messages which are due, see ``_claim_batch()``.
+        :param batch_size: maximum number of messages to claim.
+        :param visibility_timeout: seconds after which a processing message is considered abandoned.
+        :param max_attempts: attempts after which a message is marked failed.
+        :return: list of claimed OutboxMessage objects.
+        """
+        return _claim_batch(self, batch_size, visibility_timeout, max_attempts)
+
+
+class OutboxMessage(BaseModel):
+    """
+    OutboxMessage class is the transactional outbox of the Stripe customer calls of the user views, the views
+    write it in the transaction of the user change and the dispatch_outbox worker sends the calls.
+    :param BaseModel: Base class which has common attribute for the
+    application.
+    """
+    CUSTOMER_CREATE = 'customer.create'
+    CUSTOMER_MODIFY = 'customer.modify'
+    CUSTOMER_DELETE = 'customer.delete'
+    OPERATION_CHOICES = (
+        (CUSTOMER_CREATE, 'Create customer'),
+        (CUSTOMER_MODIFY, 'Modify customer'),
+        (CUSTOMER_DELETE, 'Delete customer'),
+    )
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    operation = models.CharField(max_length=20, choices=OPERATION_CHOICES)
+    # Not a foreign key, the message of a deleted user outlives it.
+    user_id = models.IntegerField(db_index=True)
+    customer_id = models.CharField(max_length=50, blank=True, null=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_on = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    processed_on = models.DateTimeField(blank=True, null=True)
+
+    objects = OutboxMessageManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_on'], name='outbox_message_due'),
+        ]
+
+    def __str__(self):
+        """Default object return value, it will return the operation and user
+        :return: operation and user id.
+        """
+        return "{} {}".format(self.operation, self.user_id)
@@ -0,0 +1,133 @@
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import stripe
+from django.db import close_old_connections
+from django.utils import timezone
+
+from users.models import User
+from .caches import stripe_cache
+from .models import OutboxMessage
+from .services import _provision_customer
+
+"""
+    This module contains the dispatcher which sends the Stripe customer calls recorded in the outbox.
+"""
+
+logger = logging.getLogger('django')
+
+
+def create_customer(message):
+    try:
+        _provision_customer(message.user_id)
+    except User.DoesNotExist:
+        # The user was deleted, a customer created meanwhile is deleted through the outbox by save_customer.
+        pass
+
+
+def modify_customer(message):
+    # The current row is sent, so several pending modifications of a user need a single call.
+    user_obj = User.objects.filter(pk=message.user_id).first()
+    if user_obj is None or user_obj.customer_id is None:
+        return
+    stripe.Customer.modify(
+        user_obj.customer_id,
+        name=user_obj.username,
+        email=user_obj.email,
+        phone=user_obj.phone_number,
+    )
+    stripe_cache.invalidate_customer(user_obj.customer_id)
+
+
+def delete_customer(message):
+    try:
+        stripe.Customer.delete(message.customer_id)
+    except stripe.error.InvalidRequestError as e:
+        if e.code != 'resource_missing':
+            raise
+    stripe_cache.invalidate_customer(message.customer_id)
+
+
+HANDLERS = {
+    OutboxMessage.CUSTOMER_CREATE: create_customer,
+    OutboxMessage.CUSTOMER_MODIFY: modify_customer,
+    OutboxMessage.CUSTOMER_DELETE: delete_customer,
+}
+
+
+class OutboxDispatcher:
+    """
+        This is a class for draining the outbox in batches on a thread pool.
+
+        The messages of one user are sent in order by the same thread, the users of a batch are handled
+        concurrently. Failed messages are retried with an exponential backoff.
+
+        Attributes:
+            workers (int): Number of threads sending Stripe calls.
+            batch_size (int): Number of messages claimed per poll.
+            max_attempts (int): Attempts after which a message is marked failed.
+            visibility_timeout (int): Seconds after which a message left in processing is claimed again.
+    """
+
+    def __init__(self, workers=4, batch_size=50, max_attempts=8, visibility_timeout=300):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='outbox')
+
+    def process(self, messages):
+        """
+        Function is used to send the claimed messages of one user in order and record their outcome.
+        :param messages: claimed OutboxMessage objects of a user, oldest first.
+        """
+        modified = False
+        try:
+            for message in messages:
+                try:
+                    if message.operation != OutboxMessage.CUSTOMER_MODIFY or not modified:
+                        HANDLERS[message.operation](message)
+                    modified = modified or message.operation == OutboxMessage.CUSTOMER_MODIFY
+                    OutboxMessage.objects.filter(pk=message.pk).update(
+                        status=OutboxMessage.DONE, processed_on=timezone.now(),
+                        modified_on=timezone.now(), last_error=None)
+                except Exception as e:
+                    logger.exception("OutboxDispatcher process exception {} for {}".format(e, message))
+                    attempts = message.attempts
+                    failed = attempts >= self.max_attempts
+                    OutboxMessage.objects.filter(pk=message.pk).update(
+                        status=OutboxMessage.FAILED if failed else OutboxMessage.PENDING,
+                        next_attempt_on=timezone.now() + timedelta(seconds=min(2 ** attempts, 3600)),
+                        modified_on=timezone.now(), last_error=str(e))
+        finally:
+            close_old_connections()
+
+    def run_once(self):
+        """
+        Function is used to claim and send one batch of messages.
+        :return: number of handled messages.
+        """
+        batch = OutboxMessage.objects.claim_batch(self.batch_size, self.visibility_timeout, self.max_attempts)
+        per_user = OrderedDict()
+        for message in batch:
+            per_user.setdefault(message.user_id, []).append(message)
+        list(self._executor.map(self.process, per_user.values()))
+        return len(batch)
+
+    def run(self, poll_interval=1.0, once=False):
+        """
+        Function is used to keep draining the outbox, sleeping while it is empty.
+        :param poll_interval: seconds to wait when there is nothing to do.
+        :param once: stop as soon as the outbox is drained.
+        """
+        try:
+            while True:
+                if not self.run_once():
+                    if once:
+                        return
+                    time.sleep(poll_interval)
+        finally:
+            self._executor.shutdown()
@@ -0,0 +1,566 @@
+import asyncio
+import contextvars
+import logging
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from functools import partial
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.utils import timezone
+
+import constants
+from stripe_card_payment import settings
+from stripe_utils.circuit import CircuitOpenError
+from stripe_utils.fanout import FanOut
+from stripe_utils.ratelimit import TokenBucket
+from stripe_utils.singleflight import SingleFlight
+from stripe_utils.transport import async_stripe
+from users.models import User
+from .caches import stripe_cache
+from .idempotency import arun_idempotent, run_idempotent, scoped_key
+from .models import Card, OutboxMessage, PaymentIntent, Refund
+
+"""
+    This module contains the Stripe side effects of the views. Every operation has a sync function for the WSGI
+    views and an ``a`` prefixed coroutine function for the async views, which calls Stripe with the asyncio client.
+"""
+
+logger = logging.getLogger('django')
+
+customer_flights = SingleFlight()
+# Seconds between two reads of a user whose Stripe customer is created by another worker.
+CUSTOMER_CLAIM_POLL_INTERVAL = 0.05
+# Pool the views use to send the independent Stripe calls of a request concurrently.
+fanout = FanOut(workers=settings.STRIPE_FANOUT_WORKERS, cleanup=close_old_connections)
+
+
+def customer_idempotency_key(user_id, claim):
+    """
+    Function is used to get the idempotency key of the Stripe customer create claimed for a user. A worker which
+    takes over a claim sends the same key, so Stripe replays the customer a crashed worker may have created.
+    :param user_id: id of the user.
+    :param claim: claim returned by claim_customer.
+    :return: idempotency key.
+    """
+    return 'customer-create:{}:{}'.format(user_id, claim)
+
+
+def claim_customer(user_id):
+    """
+    Function is used to claim the Stripe customer create of a user on its row, before the create is sent. A claim is
+    taken over with its key once it is older than STRIPE_CUSTOMER_CLAIM_TIMEOUT or its call failed without an answer.
+    :param user_id: id of the user.
+    :return: claim, None when the user has a customer or another worker holds the claim.
+    :raises: User.DoesNotExist when the user was deleted.
+    """
+    now = timezone.now()
+    claim = uuid.uuid4().hex
+    if User.objects.filter(pk=user_id, customer_id__isnull=True, customer_claim__isnull=True).update(
+            customer_claim=claim, customer_claimed_on=now):
+        return claim
+    row = User.objects.filter(pk=user_id).values('customer_id', 'customer_claim', 'customer_claimed_on').first()
+    if row is None:
+        raise User.DoesNotExist("User {} does not exist.".format(user_id))
+    if row['customer_id'] is not None or row['customer_claim'] is None:
+        return None
+    claimed_on = row['customer_claimed_on']
+    if claimed_on is not None and claimed_on > now - timedelta(seconds=settings.STRIPE_CUSTOMER_CLAIM_TIMEOUT):
+        return None
+    # Compare and set on the claim time, only one of the workers taking over the claim gets it.
+    taken = User.objects.filter(pk=user_id, customer_id__isnull=True, customer_claim=row['customer_claim'],
+                                customer_claimed_on=claimed_on).update(customer_claimed_on=now)
+    return row['customer_claim'] if taken else None
+
+
+def release_customer(user_id, claim, error):
+    """
+    Function is used to give up the claim of a failed Stripe customer create. When Stripe answered, the next worker
+    claims a new key, Stripe would replay the error for 24 hours. Otherwise the create may have succeeded, the claim is
+    kept with its key and the next worker takes it over at once.
+    :param user_id: id of the user.
+    :param claim: claim returned by claim_customer.
+    :param error: exception raised by the create.
+    :return: None
+    """
+    answered = isinstance(error, CircuitOpenError) or getattr(error, 'http_status', None) is not None
+    update = {'customer_claimed_on': None}
+    if answered:
+        update['customer_claim'] = None
+    User.objects.filter(pk=user_id, customer_id__isnull=True, customer_claim=claim).update(**update)
+
+
+def create_claimed_customer(user_obj, claim):
+    """
+    Function is used to send the Stripe customer create claimed for a user, the claim is released when it fails.
+    :param user_obj: user which needs a Stripe customer.
+    :param claim: claim returned by claim_customer.
+    :return: Stripe customer id.
+    """
+    try:
+        customer = stripe.Customer.create(
+            name=user_obj.username,
+            email=user_obj.email,
+            phone=user_obj.phone_number,
+            idempotency_key=customer_idempotency_key(user_obj.pk, claim),
+        )
+    except Exception as e:
+        release_customer(user_obj.pk, claim, e)
+        raise
+    return customer['id']
+
+
+def save_customer(user_id, customer_id):
+    """
+    Function is used to store the Stripe customer created for a user and drop its claim, unless the user got one
+    meanwhile or was deleted meanwhile. A different customer which is not stored is deleted through the outbox.
+    :param user_id: id of the user.
+    :param customer_id: Stripe customer id just created.
+    :return: Stripe customer id of the user.
+    :raises: User.DoesNotExist when the user was deleted.
+    """
+    saved = User.objects.filter(pk=user_id, customer_id__isnull=True).update(
+        customer_id=customer_id, customer_claim=None, customer_claimed_on=None, modified_on=timezone.now())
+    if saved:
+        return customer_id
+    current = User.objects.filter(pk=user_id).values_list('customer_id', flat=True).first()
+    if current != customer_id:
+        OutboxMessage.objects.enqueue(OutboxMessage.CUSTOMER_DELETE, user_id, customer_id=customer_id)
+    if current is None:
+        raise User.DoesNotExist("User {} does not exist.".format(user_id))
+    return current
+
+
+def _provision_customer(user_id):
+    """
+    Function is used to create the Stripe customer of a user. The create is claimed on the user row first, so one is
+    sent per user whatever the number of worker processes, the others wait for the customer id. No transaction or row
+    lock is held during the Stripe call.
+    :param user_id: id of the user.
+    :return: Stripe customer id.
+    :raises: User.DoesNotExist when the user was deleted.
+    """
+    while True:
+        user_obj = User.objects.get(pk=user_id)
+        if user_obj.customer_id is not None:
+            return user_obj.customer_id
+        claim = claim_customer(user_id)
+        if claim is not None:
+            return save_customer(user_id, create_claimed_customer(user_obj, claim))
+        time.sleep(CUSTOMER_CLAIM_POLL_INTERVAL)
+
+
+def ensure_customer(user_obj):
+    """
+    Function is used to lazily provision the Stripe customer of a user, only one create is sent per user and
+    concurrent requests wait for its result.
+    :param user_obj: user which needs a Stripe customer.
+    :return: Stripe customer id.
+    """
+    if user_obj.customer_id is None:
+        user_obj.customer_id = customer_flights.do(user_obj.pk, _provision_customer, user_obj.pk)
+    return user_obj.customer_id
+
+
+async def aensure_customer(user_obj):
+    """
+    Function is used by the async views to provision the Stripe customer of a user on the fanout pool, the thread
+    sensitive executor of sync_to_async runs the ORM calls of every async view and must not wait on Stripe.
+    :param user_obj: user which needs a Stripe customer.
+    :return: Stripe customer id.
+    """
+    if user_obj.customer_id is None:
+        await asyncio.wrap_future(fanout.submit(partial(ensure_customer, user_obj)))
+    return user_obj.customer_id
+
+
+def calculate_amount(no_count):
+    """
+    Function is used to calculate the amount in dollars of ``no_count`` items, it is never below the minimum amount.
+    :param no_count: number of items.
+    :return: amount in dollars.
+    """
+    amount = int(no_count) * constants.DEFAULT_PRICE
+    return amount if amount >= constants.MIN_AMOUNT else constants.MIN_AMOUNT
+
+
+def _intent_params(user_obj, amount):
+    return {
+        'amount': amount,
+        'currency': 'usd',
+        'customer': user_obj.customer_id,
+        'receipt_email': user_obj.email,
+        'shipping': constants.STRIPE_SHIPPING_ADDRESS,
+        'description': constants.STRIPE_DESCRIPTION,
+        'metadata': {
+            'user_id': user_obj.pk,
+        },
+    }
+
+
+def _intent_data(payment_intent, total_amount):
+    return {'amount': total_amount, 'clientSecret': payment_intent.client_secret,
+            'payment_intent': payment_intent.intent_id, 'stripe_public_key': settings.STRIPE_PUBLIC_KEY}
+
+
+def create_payment_intent(user_obj, total_amount, idempotency_key=None):
+    """
+    Function is used to reuse the open PaymentIntent of the user, updating its amount in place, or create a new one
+    on Stripe and return the response data.
+    :param user_obj: user paying the amount.
+    :param total_amount: amount to charge in dollars.
+    :param idempotency_key: key sent to Stripe so that a retried create returns the same intent.
+    :return: PaymentIntent details for the client.
+    """
+    amount = int(total_amount * constants.CONVERT_CENT)
+    payment_intent = PaymentIntent.objects.open_for_user(user_obj.pk)
+    if payment_intent is not None and payment_intent.amount != amount:
+        try:
+            payment_intent = PaymentIntent.objects.record(stripe.PaymentIntent.modify(
+                payment_intent.intent_id,
+                amount=amount,
+            ))
+        except stripe.error.InvalidRequestError:
+            # The intent moved on before its webhook arrived, sync it and fall back to a new intent.
+            PaymentIntent.objects.record(stripe.PaymentIntent.retrieve(payment_intent.intent_id))
+            payment_intent = None
+    if payment_intent is None:
+        intent = stripe.PaymentIntent.create(idempotency_key=idempotency_key, **_intent_params(user_obj, amount))
+        payment_intent = PaymentIntent.objects.record(intent, user_id=user_obj.pk)
+    return _intent_data(payment_intent, total_amount)
+
+
+async def acreate_payment_intent(user_obj, total_amount, idempotency_key=None):
+    """
+    Function is used by the async views like ``create_payment_intent()``.
+    """
+    amount = int(total_amount * constants.CONVERT_CENT)
+    record = sync_to_async(PaymentIntent.objects.record)
+    payment_intent = await sync_to_async(PaymentIntent.objects.open_for_user)(user_obj.pk)
+    if payment_intent is not None and payment_intent.amount != amount:
+        try:
+            payment_intent = await record(await async_stripe.modify_payment_intent(payment_intent.intent_id,
+                                                                                   amount=amount))
+        except stripe.error.InvalidRequestError:
+            # The intent moved on before its webhook arrived, sync it and fall back to a new intent.
+            await record(await async_stripe.retrieve_payment_intent(payment_intent.intent_id))
+            payment_intent = None
+    if payment_intent is None:
+        intent = await async_stripe.create_payment_intent(idempotency_key=idempotency_key,
+                                                          **_intent_params(user_obj, amount))
+        payment_intent = await record(intent, user_id=user_obj.pk)
+    return _intent_data(payment_intent, total_amount)
+
+
+def create_payment(user_obj, no_count, idempotency_key=None):
+    """
+    Function is used to provision the Stripe customer of the user and create or reuse its PaymentIntent. With a
+    client idempotency key, replays are answered from the cache and concurrent identical requests are coalesced.
+    :param user_obj: user paying the amount.
+    :param no_count: number of items.
+    :param idempotency_key: client idempotency key or None.
+    :return: tuple of the PaymentIntent details for the client and whether they were replayed.
+    :raises: IdempotencyKeyMismatch when the key is replayed with another amount.
+    """
+    ensure_customer(user_obj)
+    total_amount = calculate_amount(no_count)
+    if not idempotency_key:
+        return create_payment_intent(user_obj, total_amount), False
+    key = scoped_key('create-payment-intent', user_obj.pk, idempotency_key)
+    params = {'amount': int(total_amount * constants.CONVERT_CENT)}
+    return run_idempotent(key, params, create_payment_intent, user_obj, total_amount)
+
+
+async def acreate_payment(user_obj, no_count, idempotency_key=None):
+    """
+    Function is used by the async views like ``create_payment()``.
+    """
+    await aensure_customer(user_obj)
+    total_amount = calculate_amount(no_count)
+    if not idempotency_key:
+        return await acreate_payment_intent(user_obj, total_amount), False
+    key = scoped_key('create-payment-intent', user_obj.pk, idempotency_key)
+    params = {'amount': int(total_amount * constants.CONVERT_CENT)}
+    return await arun_idempotent(key, params, acreate_payment_intent, user_obj, total_amount)
+
+
+def cancel_payment_intent(payment_intent):
+    """
+    Function is used to cancel a PaymentIntent with an incomplete status and record it.
+    :param payment_intent: Stripe PaymentIntent id.
+    :return: Stripe PaymentIntent object.
+    """
+    intent = stripe.PaymentIntent.cancel(payment_intent)
+    PaymentIntent.objects.record(intent)
+    return intent
+
+
+async def acancel_payment_intent(payment_intent):
+    """
+    Function is used by the async views like ``cancel_payment_intent()``.
+    """
+    intent = await async_stripe.cancel_payment_intent(payment_intent)
+    await sync_to_async(PaymentIntent.objects.record)(intent)
+    return intent
+
+
+def refund_payment_intent(payment_intent):
+    """
+    Function is used to refund a PaymentIntent unless the ledger or Stripe says it is already refunded.
+    :param payment_intent: Stripe PaymentIntent id.
+    :return: Stripe Refund object, or None if the payment was already refunded.
+    """
+    if Refund.objects.is_refunded(payment_intent):
+        return None
+    try:
+        refund = stripe.Refund.create(
+            payment_intent=payment_intent,
+        )
+    except stripe.error.InvalidRequestError as e:
+        # Refunded outside of the app before its webhook reached the ledger.
+        if e.code != 'charge_already_refunded':
+            raise
+        return None
+    Refund.objects.record(refund)
+    return refund
+
+
+async def arefund_payment_intent(payment_intent):
+    """
+    Function is used by the async views like ``refund_payment_intent()``.
+    """
+    if await sync_to_async(Refund.objects.is_refunded)(payment_intent):
+        return None
+    try:
+        refund = await async_stripe.create_refund(payment_intent=payment_intent)
+    except stripe.error.InvalidRequestError as e:
+        # Refunded outside of the app before its webhook reached the ledger.
+        if e.code != 'charge_already_refunded':
+            raise
+        return None
+    await sync_to_async(Refund.objects.record)(refund)
+    return refund
+
+
+def _refund_error_message(error):
+    """
+    Function is used to describe the failed refund of a batch item to the client without the details of the error.
+    :param error: exception raised by the refund.
+    :return: message from constants.
+    """
+    if isinstance(error, CircuitOpenError):
+        return constants.STRIPE_UNAVAILABLE
+    if isinstance(error, stripe.error.RateLimitError):
+        return constants.STRIPE_RATE_LIMITED
+    if isinstance(error, stripe.error.InvalidRequestError):
+        return constants.BULK_REFUND_ITEM_INVALID
+    return constants.CREATE_PAYMENT_REFUND_FAIL
+
+
+def _refund_item(payment_intent, rate_limiter):
+    """
+    Function is used to refund one PaymentIntent of a batch and describe the outcome.
+    :return: dict with the result of the item.
+    """
+    try:
+        rate_limiter.acquire()
+        refund = refund_payment_intent(payment_intent)
+        if refund is None:
+            return {'payment_intent': payment_intent, 'status': 'already_refunded'}
+        return {'payment_intent': payment_intent, 'status': 'refunded', 'refund': refund.id}
+    except Exception as e:
+        logger.exception("bulk refund of {} failed {}".format(payment_intent, e))
+        return {'payment_intent': payment_intent, 'status': 'failed', 'error': _refund_error_message(e)}
+    finally:
+        close_old_connections()
+
+
+def iter_bulk_refunds(payment_intents, workers, rate):
+    """
+    Function is used to refund many PaymentIntents on a bounded thread pool, paced under the Stripe rate limit.
+    Only a window of ``2 * workers`` items is in flight so huge batches are never held in memory. The refunds run
+    with a copy of the context of the caller, so their Stripe calls are traced with the request even when the
+    results are streamed after the view returned.
+    :param payment_intents: iterable of Stripe PaymentIntent ids.
+    :param workers: number of concurrent Stripe calls.
+    :param rate: maximum refunds per second.
+    :return: generator of item results in completion order.
+    """
+    return _iter_bulk_refunds(payment_intents, workers, TokenBucket(rate), contextvars.copy_context())
+
+
+def _iter_bulk_refunds(payment_intents, workers, rate_limiter, context):
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='refund') as executor:
+        for payment_intent in payment_intents:
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            # A context can only be entered by one thread at a time, every item gets its own copy.
+            pending.add(executor.submit(context.copy().run, _refund_item, payment_intent, rate_limiter))
+        for future in pending:
+            yield future.result()
+
+
+def list_cards(customer_id):
+    """
+    Function is used to list the cards of a customer from the local mirror.
+    :param customer_id: stripe customer id.
+    :return: Stripe list object of the cards.
+    """
+    return {
+        'object': 'list',
+        'data': [card.to_raw_json() for card in Card.objects.for_customer(customer_id)],
+        'has_more': False,
+    }
+
+
+def add_card(user_obj, source_id):
+    """
+    Function is used to attach a card token to the Stripe customer of a user, unless the customer has the card.
+    :param user_obj: user adding the card.
+    :param source_id: Stripe token id of the card.
+    :return: Stripe card object, or None when the customer already has the card.
+    """
+    # The customer and the token do not depend on each other, get them concurrently.
+    customer_id, token_obj = fanout.run(
+        partial(ensure_customer, user_obj),
+        partial(stripe_cache.get, 'token', source_id, stripe.Token.retrieve, source_id),
+    )
+    if Card.objects.has_fingerprint(customer_id, token_obj.card.fingerprint):
+        return None
+    new_card = stripe.Customer.create_source(
+        customer_id,
+        source=source_id,
+    )
+    # The first card of a customer becomes its default source.
+    stripe_cache.invalidate_customer(customer_id)
+    card = Card.objects.upsert_from_stripe(new_card)
+    if card is not None and card.card_id != new_card.id:
+        # A concurrent request attached the same card first, drop this duplicate on Stripe.
+        stripe.Customer.delete_source(customer_id, new_card.id)
+        return None
+    return new_card
+
+
+async def aadd_card(user_obj, source_id):
+    """
+    Function is used by the async views like ``add_card()``.
+    """
+    # The customer and the token do not depend on each other, get them concurrently.
+    customer_id, token_obj = await asyncio.gather(
+        aensure_customer(user_obj),
+        stripe_cache.aget('token', source_id, async_stripe.retrieve_token, source_id),
+    )
+    if await sync_to_async(Card.objects.has_fingerprint)(customer_id, token_obj.card.fingerprint):
+        return None
+    new_card = await async_stripe.create_source(customer_id, source=source_id)
+    # The first card of a customer becomes its default source.
+    await stripe_cache.ainvalidate_customer(customer_id)
+    card = await sync_to_async(Card.objects.upsert_from_stripe)(new_card)
+    if card is not None and card.card_id != new_card.id:
+        # A concurrent request attached the same card first, drop this duplicate on Stripe.
+        await async_stripe.delete_source(customer_id, new_card.id)
+        return None
+    return new_card
+
+
+def update_card(customer_id, card_id, name=None, exp_month=None, exp_year=None):
+    """
+    Function is used to update the holder name and the expiry of a card of a customer.
+    :param customer_id: stripe customer id.
+    :param card_id: stripe card id.
+    :return: Stripe card object.
+    """
+    card = stripe.Customer.modify_source(
+        customer_id,
+        card_id,
+        name=name,
+        exp_month=exp_month,
+        exp_year=exp_year,
+    )
+    Card.objects.upsert_from_stripe(card)
+    return card
+
+
+async def aupdate_card(customer_id, card_id, name=None, exp_month=None, exp_year=None):
+    """
+    Function is used by the async views like ``update_card()``.
+    """
+    card = await async_stripe.modify_source(customer_id, card_id, name=name, exp_month=exp_month,
+                                            exp_year=exp_year)
+    await sync_to_async(Card.objects.upsert_from_stripe)(card)
+    return card
+
+
+def delete_card(customer_id, card_id):
+    """
+    Function is used to delete a card of a customer.
+    :param customer_id: stripe customer id.
+    :param card_id: stripe card id.
+    :return: Stripe deleted card object.
+    """
+    deleted = stripe.Customer.delete_source(
+        customer_id,
+        card_id,
+    )
+    Card.objects.remove(customer_id, card_id)
+    stripe_cache.invalidate_customer(customer_id)
+    return deleted
+
+
+async def adelete_card(customer_id, card_id):
+    """
+    Function is used by the async views like ``delete_card()``.
+    """
+    deleted = await async_stripe.delete_source(customer_id, card_id)
+    await sync_to_async(Card.objects.remove)(customer_id, card_id)
+    await stripe_cache.ainvalidate_customer(customer_id)
+    return deleted
+
+
+def default_card(customer_id):
+    """
+    Function is used to get the default card of a customer through the Stripe read cache.
+    :param customer_id: stripe customer id.
+    :return: stripe card id or None.
+    """
+    return stripe_cache.get('customer', customer_id, stripe.Customer.retrieve, customer_id).default_source
+
+
+async def adefault_card(customer_id):
+    """
+    Function is used by the async views like ``default_card()``.
+    """
+    customer = await stripe_cache.aget('customer', customer_id, async_stripe.retrieve_customer, customer_id)
+    return customer.default_source
+
+
+def set_default_card(customer_id, card_id):
+    """
+    Function is used to make a card the default source of a customer.
+    :param customer_id: stripe customer id.
+    :param card_id: stripe card id.
+    :return: Stripe customer object.
+    """
+    customer = stripe.Customer.modify(
+        customer_id,
+        default_source=card_id,
+    )
+    stripe_cache.store('customer', customer_id, customer)
+    Card.objects.set_default(customer_id, card_id)
+    return customer
+
+
+async def aset_default_card(customer_id, card_id):
+    """
+    Function is used by the async views like ``set_default_card()``.
+    """
+    customer = await async_stripe.modify_customer(customer_id, default_source=card_id)
+    await stripe_cache.astore('customer', customer_id, customer)
+    await sync_to_async(Card.objects.set_default)(customer_id, card_id)
+    return customer
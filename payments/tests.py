@@ -1,3 +1,760 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import stripe
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+import constants
+from benchmarks.stripe_stub import StripeStub
+from payments import services
+from payments.models import Card, Charge, OutboxMessage, PaymentIntent, WebhookEvent
+from payments.outbox import OutboxDispatcher
+from payments.webhooks import EventDeduplicator, WebhookWorker, handle_event
+from response_utils import ApiJSONRenderer, ApiResponse, RawJSON, project_fields
+from stripe_card_payment import settings
+from stripe_utils.async_client import AsyncStripeClient
+from stripe_utils.circuit import CircuitBreaker, CircuitBreakers, CircuitOpenError
+from stripe_utils.ratelimit import SharedRateLimiter
+from stripe_utils.tracing import tracer
+from stripe_utils.transport import PooledRequestsClient
+from users.models import User
+
+
+class StripeStubMixin:
+    """
+        Class is used to run the tests of a case against one local Stripe stand-in, the stripe module and the tested
+        code send their calls there.
+    """
+    latency = 0
+
+    @classmethod
+    def setUpClass(cls):
+        super(StripeStubMixin, cls).setUpClass()
+        cls.stub = StripeStub(latency=cls.latency)
+        cls.stub.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.stop()
+        super(StripeStubMixin, cls).tearDownClass()
+
+    def use_stub(self, client=None):
+        """
+        Function is used to send the calls of the stripe module of one test to the stand-in.
+        :param client: http client of the stripe module, a new pooled client by default.
+        """
+        self.stub.clear_faults()
+        self.stub.requests.clear()
+        patcher = mock.patch.multiple(stripe, api_key='sk_test_stub', api_base=self.stub.url, max_network_retries=0,
+                                      default_http_client=client or PooledRequestsClient())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stub_calls(self, method, path):
+        """
+        Function is used to count the calls of one Stripe route the stand-in served during the test.
+        """
+        return sum(1 for call in self.stub.requests if call == (method, path))
+
+
+class CircuitBreakerTests(StripeStubMixin, SimpleTestCase):
+    """
+        Class is used to drive the circuit breaker of the shared transport against the local Stripe stand-in.
+    """
+    reset_timeout = 0.2
+
+    def setUp(self):
+        self.breakers = CircuitBreakers(failure_threshold=2, reset_timeout=self.reset_timeout)
+        self.client = PooledRequestsClient(breakers=self.breakers)
+        self.async_client = AsyncStripeClient(api_key='sk_test_stub', api_base=self.stub.url, breakers=self.breakers)
+        self.use_stub(self.client)
+
+    def state(self):
+        return self.breakers.stats()['customers']['state']
+
+    def open_circuit(self):
+        self.stub.inject(status=500, path_prefix='/v1/customers')
+        for _ in range(2):
+            with self.assertRaises(stripe.error.APIError):
+                stripe.Customer.create(email='open@example.com')
+        self.assertEqual(self.state(), CircuitBreaker.OPEN)
+
+    def test_open_circuit_fails_fast(self):
+        self.open_circuit()
+        calls = self.stub.calls
+        with self.assertRaises(CircuitOpenError):
+            stripe.Customer.create(email='fast@example.com')
+        self.assertEqual(self.stub.calls, calls)
+        self.assertEqual(self.breakers.stats()['customers']['rejected'], 1)
+
+    def test_successful_probe_closes_circuit(self):
+        self.open_circuit()
+        self.stub.clear_faults()
+        time.sleep(self.reset_timeout)
+        self.assertTrue(stripe.Customer.create(email='probe@example.com').id.startswith('cus_'))
+        self.assertEqual(self.state(), CircuitBreaker.CLOSED)
+
+    def test_failed_probe_opens_circuit_again(self):
+        self.open_circuit()
+        time.sleep(self.reset_timeout)
+        with self.assertRaises(stripe.error.APIError):
+            stripe.Customer.create(email='probe@example.com')
+        self.assertEqual(self.state(), CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            stripe.Customer.create(email='fast@example.com')
+
+    def test_half_open_rejects_calls_beyond_the_probe(self):
+        breaker = self.breakers.for_url('/v1/customers')
+        self.open_circuit()
+        time.sleep(self.reset_timeout)
+        breaker.allow()
+        with self.assertRaises(CircuitOpenError):
+            stripe.Customer.create(email='second@example.com')
+        self.assertEqual(self.state(), CircuitBreaker.HALF_OPEN)
+
+    def test_aborted_probe_gives_back_its_slot(self):
+        self.open_circuit()
+        self.stub.clear_faults()
+        time.sleep(self.reset_timeout)
+        with mock.patch.object(self.client, 'request', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                stripe.Customer.create(email='aborted@example.com')
+        self.assertEqual(self.state(), CircuitBreaker.OPEN)
+        time.sleep(self.reset_timeout)
+        stripe.Customer.create(email='probe@example.com')
+        self.assertEqual(self.state(), CircuitBreaker.CLOSED)
+
+    def test_cancelled_async_probe_gives_back_its_slot(self):
+        self.open_circuit()
+        self.stub.clear_faults()
+        self.stub.inject(status=None, path_prefix='/v1/customers', delay=1)
+        time.sleep(self.reset_timeout)
+
+        async def cancel_probe():
+            task = asyncio.ensure_future(self.async_client.request('post', '/v1/customers'))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await self.async_client.close()
+
+        asyncio.run(cancel_probe())
+        self.assertEqual(self.state(), CircuitBreaker.OPEN)
+        self.stub.clear_faults()
+        time.sleep(self.reset_timeout)
+        stripe.Customer.create(email='probe@example.com')
+        self.assertEqual(self.state(), CircuitBreaker.CLOSED)
+
+
+class StripePathTests(StripeStubMixin, SimpleTestCase):
+    """
+        Class is used to check that client supplied ids never reach another Stripe object than the one they name.
+    """
+
+    def setUp(self):
+        self.client = PooledRequestsClient()
+        self.async_client = AsyncStripeClient(api_key='sk_test_stub', api_base=self.stub.url)
+        self.use_stub(self.client)
+
+    def run_async(self, call, *args):
+        async def main():
+            try:
+                return await call(*args)
+            finally:
+                await self.async_client.close()
+        return asyncio.run(main())
+
+    def test_async_traversal_id_stays_one_segment(self):
+        self.run_async(self.async_client.delete_source, 'cus_owner', '../../cus_victim')
+        self.assertEqual(self.stub.requests[-1], ('DELETE', '/v1/customers/cus_owner/sources/..%2F..%2Fcus_victim'))
+
+    def test_async_dot_id_is_rejected(self):
+        calls = self.stub.calls
+        for card_id in ('..', '.', ''):
+            with self.assertRaises(stripe.error.InvalidRequestError):
+                self.run_async(self.async_client.modify_source, 'cus_owner', card_id)
+        self.assertEqual(self.stub.calls, calls)
+
+    def test_sync_traversal_id_stays_one_segment(self):
+        stripe.Customer.delete_source('cus_owner', '../../cus_victim')
+        self.assertEqual(self.stub.requests[-1], ('DELETE', '/v1/customers/cus_owner/sources/..%2F..%2Fcus_victim'))
+
+    def test_sync_dot_id_is_rejected(self):
+        calls = self.stub.calls
+        with self.assertRaises(stripe.error.InvalidRequestError):
+            stripe.Customer.delete_source('cus_owner', '..')
+        self.assertEqual(self.stub.calls, calls)
+
+
+class SharedRateLimiterTests(SimpleTestCase):
+    """
+        Class is used to check that a failed transaction of the shared rate limiter raises its own error and leaves
+        the budgets usable.
+    """
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'ratelimit.sqlite3')
+        self.limiter = SharedRateLimiter(self.path, {'read': 10, 'write': 10})
+        self.connection = self.limiter._connection()
+
+    def tokens(self):
+        return self.connection.execute("SELECT tokens FROM bucket WHERE name = 'write'").fetchone()[0]
+
+    def test_failed_begin_raises_its_error(self):
+        self.connection.execute('PRAGMA busy_timeout = 0')
+        other = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(other.close)
+        other.execute('BEGIN IMMEDIATE')
+        with self.assertRaisesRegex(sqlite3.OperationalError, 'locked'):
+            self.limiter.try_acquire('write')
+        other.execute('ROLLBACK')
+        self.assertEqual(self.limiter.try_acquire('write'), 0.0)
+
+    def test_failed_update_is_rolled_back(self):
+        tokens = self.tokens()
+
+        def refill(connection, name):
+            connection.execute("UPDATE bucket SET tokens = 0 WHERE name = 'write'")
+            raise RuntimeError('refill failed')
+
+        with mock.patch.object(self.limiter, '_refill', side_effect=refill):
+            with self.assertRaises(RuntimeError):
+                self.limiter.try_acquire('write')
+            with self.assertRaises(RuntimeError):
+                self.limiter.throttled('write')
+        self.assertFalse(self.connection.in_transaction)
+        self.assertEqual(self.tokens(), tokens)
+        self.assertEqual(self.limiter.try_acquire('write'), 0.0)
+
+    def test_transaction_ended_by_sqlite_raises_its_error(self):
+        def refill(connection, name):
+            # SQLite rolls back by itself on some errors, a disk full one for example.
+            connection.execute('ROLLBACK')
+            raise sqlite3.OperationalError('database or disk is full')
+
+        with mock.patch.object(self.limiter, '_refill', side_effect=refill):
+            with self.assertRaisesRegex(sqlite3.OperationalError, 'disk is full'):
+                self.limiter.try_acquire('write')
+        self.assertEqual(self.limiter.try_acquire('write'), 0.0)
+
+
+def card_event(event_type, created, card_id='card_1', name='Alice', fingerprint='fp_1'):
+    return stripe.Event.construct_from({
+        'id': 'evt_%s_%s' % (card_id, created),
+        'type': event_type,
+        'created': created,
+        'data': {'object': {'id': card_id, 'object': 'card', 'customer': 'cus_alice', 'fingerprint': fingerprint,
+                            'brand': 'Visa', 'last4': '4242', 'exp_month': 12, 'exp_year': 2030, 'name': name}},
+    }, 'sk_test_stub')
+
+
+class CardMirrorTests(TestCase):
+    """
+        Class is used to check that the card mirror ends in the Stripe state whatever the order of the events.
+    """
+
+    def names(self):
+        return [card.name for card in Card.objects.for_customer('cus_alice')]
+
+    def test_created_after_deleted_does_not_bring_the_card_back(self):
+        handle_event(card_event('customer.source.deleted', 200))
+        handle_event(card_event('customer.source.created', 100))
+        self.assertEqual(self.names(), [])
+        self.assertFalse(Card.objects.has_fingerprint('cus_alice', 'fp_1'))
+
+    def test_event_pending_during_delete_does_not_bring_the_card_back(self):
+        handle_event(card_event('customer.source.created', 100))
+        with mock.patch.object(stripe.Customer, 'delete_source', return_value={'id': 'card_1', 'deleted': True}):
+            services.delete_card('cus_alice', 'card_1')
+        handle_event(card_event('customer.source.updated', 150, name='Bob'))
+        self.assertEqual(self.names(), [])
+
+    def test_older_update_is_ignored(self):
+        handle_event(card_event('customer.source.updated', 200, name='Bob'))
+        handle_event(card_event('customer.source.created', 100))
+        self.assertEqual(self.names(), ['Bob'])
+        handle_event(card_event('customer.source.updated', 300, name='Carol'))
+        self.assertEqual(self.names(), ['Carol'])
+
+    def test_same_number_can_be_added_again(self):
+        handle_event(card_event('customer.source.created', 100))
+        handle_event(card_event('customer.source.deleted', 200))
+        handle_event(card_event('customer.source.created', 300, card_id='card_2', name='Bob'))
+        self.assertEqual(self.names(), ['Bob'])
+
+
+class BulkRefundTests(StripeStubMixin, TransactionTestCase):
+    """
+        Class is used to check the results, the error messages and the tracing of the bulk refunds.
+    """
+    path = '/api/payments/bulk-refund-payment-intent/'
+
+    def setUp(self):
+        self.use_stub()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='admin', email='admin@example.com',
+                                                                password='admin', is_staff=True))
+
+    def refund(self, payment_intents, stream=False):
+        return self.client.post(self.path, {'payment_intents': payment_intents, 'stream': stream}, format='json')
+
+    def test_refund_calls_are_traced_with_the_request(self):
+        response = self.refund(['pi_1', 'pi_2', 'pi_3'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.json()['data']['results']], ['refunded'] * 3)
+        self.assertEqual(response['X-Stripe-Calls'], '3')
+
+    def test_failed_item_gets_a_message_without_the_details(self):
+        self.stub.inject(status=404, path_prefix='/v1/refunds')
+        with self.assertLogs('django', 'ERROR'):
+            response = self.refund(['pi_missing'])
+        self.assertEqual(response.json()['data']['results'], [
+            {'payment_intent': 'pi_missing', 'status': 'failed', 'error': constants.BULK_REFUND_ITEM_INVALID}])
+
+    def test_streamed_refund_calls_are_traced_with_the_endpoint(self):
+        key = ('api/payments/bulk-refund-payment-intent/', 'POST /v1/refunds')
+
+        def count():
+            histogram = tracer._calls.get(key)
+            return histogram.count if histogram is not None else 0
+
+        calls = count()
+        response = self.refund(['pi_1', 'pi_2'], stream=True)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(lines[-1], {'summary': {'refunded': 2, 'already_refunded': 0, 'failed': 0}})
+        self.assertEqual(count(), calls + 2)
+
+    def test_stream_failure_ends_with_an_error_line(self):
+        with mock.patch('payments.services._refund_item', side_effect=RuntimeError('secret detail')):
+            with self.assertLogs('django', 'ERROR'):
+                response = self.refund(['pi_1'], stream=True)
+                lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(lines, [{'error': constants.CREATE_PAYMENT_REFUND_FAIL,
+                                  'summary': {'refunded': 0, 'already_refunded': 0, 'failed': 0}}])
+
+
+class OutboxTests(StripeStubMixin, TransactionTestCase):
+    """
+        Class is used to check that the Stripe customer calls of the outbox are sent, retried and given up, and that
+        the card endpoints serve a user whose customer the dispatcher did not create yet.
+    """
+
+    def setUp(self):
+        self.use_stub()
+        self.dispatcher = OutboxDispatcher(workers=2, max_attempts=2)
+        self.addCleanup(self.dispatcher._executor.shutdown)
+        self.user = User.objects.create_user(username='carol', email='carol@example.com', password='carol')
+        self.message = OutboxMessage.objects.enqueue(OutboxMessage.CUSTOMER_CREATE, self.user.pk)
+
+    def make_due(self):
+        OutboxMessage.objects.filter(pk=self.message.pk).update(next_attempt_on=timezone.now())
+
+    def test_dispatch_creates_the_customer(self):
+        self.assertEqual(self.dispatcher.run_once(), 1)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.customer_id.startswith('cus_'))
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, OutboxMessage.DONE)
+
+    def test_failed_call_is_retried_later(self):
+        self.stub.inject(status=500, path_prefix='/v1/customers')
+        with self.assertLogs('django', 'ERROR'):
+            self.dispatcher.run_once()
+        self.message.refresh_from_db()
+        self.assertEqual((self.message.status, self.message.attempts), (OutboxMessage.PENDING, 1))
+        self.assertGreater(self.message.next_attempt_on, timezone.now())
+        self.assertEqual(self.dispatcher.run_once(), 0)
+        self.stub.clear_faults()
+        self.make_due()
+        self.assertEqual(self.dispatcher.run_once(), 1)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, OutboxMessage.DONE)
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.customer_id)
+
+    def test_message_fails_after_the_last_attempt(self):
+        self.stub.inject(status=500, path_prefix='/v1/customers')
+        with self.assertLogs('django', 'ERROR'):
+            self.dispatcher.run_once()
+            self.make_due()
+            self.dispatcher.run_once()
+        self.message.refresh_from_db()
+        self.assertEqual((self.message.status, self.message.attempts), (OutboxMessage.FAILED, 2))
+
+    def test_card_reads_create_the_missing_customer(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for path in ('/api/payments/card-manage/', '/api/payments/default-card/'):
+            response = client.get(path)
+            self.assertEqual(response.status_code, 200, path)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.customer_id.startswith('cus_'))
+        self.assertEqual(self.dispatcher.run_once(), 1)
+        self.assertEqual(User.objects.get(pk=self.user.pk).customer_id, self.user.customer_id)
+
+
+class CustomerClaimTests(StripeStubMixin, TransactionTestCase):
+    """
+        Class is used to check that the Stripe customer of a user is created once by concurrent worker processes, and
+        which idempotency key is sent again after a failed create.
+    """
+    latency = 0.2
+
+    def setUp(self):
+        self.use_stub()
+        self.user = User.objects.create_user(username='dave', email='dave@example.com', password='dave')
+        create = mock.patch.object(stripe.Customer, 'create', wraps=stripe.Customer.create)
+        self.create = create.start()
+        self.addCleanup(create.stop)
+
+    def provision(self):
+        # Every thread stands for a worker process, the single flight of ensure_customer is not shared.
+        try:
+            return services._provision_customer(self.user.pk)
+        finally:
+            connection.close()
+
+    def sent_keys(self):
+        return [call.kwargs['idempotency_key'] for call in self.create.call_args_list]
+
+    def test_concurrent_workers_create_one_customer(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            customer_ids = set(executor.map(lambda _: self.provision(), range(4)))
+        self.assertEqual(self.stub_calls('POST', '/v1/customers'), 1)
+        self.assertEqual(customer_ids, {User.objects.get(pk=self.user.pk).customer_id})
+        self.assertFalse(OutboxMessage.objects.filter(operation=OutboxMessage.CUSTOMER_DELETE).exists())
+
+    def test_answered_failure_gets_a_new_key(self):
+        self.stub.inject(status=500, path_prefix='/v1/customers')
+        with self.assertRaises(stripe.error.APIError):
+            self.provision()
+        self.assertIsNone(User.objects.get(pk=self.user.pk).customer_claim)
+        self.stub.clear_faults()
+        self.provision()
+        first, second = self.sent_keys()
+        self.assertNotEqual(first, second)
+
+    def test_lost_answer_is_sent_again_with_its_key(self):
+        self.create.side_effect = [stripe.error.APIConnectionError('connection reset'), mock.DEFAULT]
+        with self.assertRaises(stripe.error.APIConnectionError):
+            self.provision()
+        self.assertIsNotNone(User.objects.get(pk=self.user.pk).customer_claim)
+        self.provision()
+        first, second = self.sent_keys()
+        self.assertEqual(first, second)
+
+    def test_stale_claim_is_taken_over_with_its_key(self):
+        claim = services.claim_customer(self.user.pk)
+        self.assertIsNone(services.claim_customer(self.user.pk))
+        stale = timezone.now() - timedelta(seconds=settings.STRIPE_CUSTOMER_CLAIM_TIMEOUT + 1)
+        User.objects.filter(pk=self.user.pk).update(customer_claimed_on=stale)
+        self.provision()
+        self.assertEqual(self.sent_keys(), [services.customer_idempotency_key(self.user.pk, claim)])
+        self.assertIsNone(User.objects.get(pk=self.user.pk).customer_claim)
+
+
+class IdempotentPaymentTests(StripeStubMixin, TransactionTestCase):
+    """
+        Class is used to check that a client retry of create-payment-intent with the same idempotency key is answered
+        without a new PaymentIntent.
+    """
+    path = '/api/payments/create-payment-intent/'
+    latency = 0.05
+
+    def setUp(self):
+        self.use_stub()
+        cache.clear()
+        self.user = User.objects.create_user(username='dave', email='dave@example.com', password='dave',
+                                             customer_id='cus_dave')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create(self, no_count, key):
+        return self.client.post(self.path, {'no_count': no_count}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replay_returns_the_first_response(self):
+        first = self.create(2, 'order-1')
+        replay = self.create(2, 'order-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(replay.json()['data'], first.json()['data'])
+        self.assertEqual(self.stub_calls('POST', '/v1/payment_intents'), 1)
+
+    def test_replay_with_other_parameters_is_rejected(self):
+        self.create(2, 'order-1')
+        response = self.create(3, 'order-1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], constants.IDEMPOTENCY_KEY_MISMATCH)
+
+    def test_keys_are_scoped_per_user(self):
+        self.create(2, 'order-1')
+        other = User.objects.create_user(username='erin', email='erin@example.com', password='erin',
+                                         customer_id='cus_erin')
+        self.client.force_authenticate(other)
+        response = self.create(3, 'order-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_concurrent_retries_send_one_create(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: services.create_payment(self.user, 2, 'order-1'), range(4)))
+        self.assertEqual(len({data['payment_intent'] for data, _ in results}), 1)
+        self.assertEqual(self.stub_calls('POST', '/v1/payment_intents'), 1)
+
+
+class OpenPaymentIntentTests(StripeStubMixin, TestCase):
+    """
+        Class is used to check that a checkout reuses the open PaymentIntent of the user and that late events never
+        move an intent back.
+    """
+
+    def setUp(self):
+        self.use_stub()
+        self.user = User.objects.create_user(username='frank', email='frank@example.com', password='frank',
+                                             customer_id='cus_frank')
+
+    def intent(self, status, amount=100):
+        return {'id': 'pi_frank', 'object': 'payment_intent', 'customer': 'cus_frank', 'amount': amount,
+                'currency': 'usd', 'status': status, 'metadata': {'user_id': self.user.pk}}
+
+    def test_open_intent_is_reused(self):
+        first, _ = services.create_payment(self.user, 2)
+        second, _ = services.create_payment(self.user, 2)
+        self.assertEqual(second['payment_intent'], first['payment_intent'])
+        self.assertEqual(self.stub_calls('POST', '/v1/payment_intents'), 1)
+
+    def test_open_intent_gets_the_new_amount(self):
+        first, _ = services.create_payment(self.user, 2)
+        second, _ = services.create_payment(self.user, 3)
+        self.assertEqual(second['payment_intent'], first['payment_intent'])
+        self.assertEqual(self.stub_calls('POST', '/v1/payment_intents/%s' % first['payment_intent']), 1)
+        self.assertEqual(PaymentIntent.objects.get(intent_id=first['payment_intent']).amount, 150)
+
+    def test_paid_intent_is_not_reused(self):
+        first, _ = services.create_payment(self.user, 2)
+        PaymentIntent.objects.filter(intent_id=first['payment_intent']).update(status='succeeded')
+        second, _ = services.create_payment(self.user, 2)
+        self.assertNotEqual(second['payment_intent'], first['payment_intent'])
+
+    def test_older_event_is_ignored(self):
+        PaymentIntent.objects.record(self.intent('requires_confirmation', 200), event_created=200)
+        PaymentIntent.objects.record(self.intent('requires_payment_method', 100), event_created=100)
+        intent = PaymentIntent.objects.get(intent_id='pi_frank')
+        self.assertEqual((intent.status, intent.amount), ('requires_confirmation', 200))
+
+    def test_terminal_status_is_never_left(self):
+        PaymentIntent.objects.record(self.intent('succeeded'), event_created=100)
+        PaymentIntent.objects.record(self.intent('requires_payment_method'), event_created=200)
+        PaymentIntent.objects.record(self.intent('requires_payment_method'))
+        self.assertEqual(PaymentIntent.objects.get(intent_id='pi_frank').status, 'succeeded')
+        self.assertIsNone(PaymentIntent.objects.open_for_user(self.user.pk))
+
+
+def post_event(client, event, secret=settings.STRIPE_WEBHOOK_SECRET):
+    """
+    Function is used to deliver a Stripe event to the webhook view with a valid signature.
+    :return: response of the view.
+    """
+    payload = json.dumps(event)
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), '{}.{}'.format(timestamp, payload).encode(), hashlib.sha256).hexdigest()
+    return client.post('/api/payments/webhook/', payload, content_type='application/json',
+                       HTTP_STRIPE_SIGNATURE='t={},v1={}'.format(timestamp, signature))
+
+
+class WebhookInboxTests(TransactionTestCase):
+    """
+        Class is used to check that the webhook view only stores the events and that the worker handles, retries and
+        gives up on them.
+    """
+
+    def setUp(self):
+        patcher = mock.patch('payments.views.webhook_dedupe', EventDeduplicator())
+        self.dedupe = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.worker = WebhookWorker(workers=2, max_attempts=2, visibility_timeout=60)
+        self.addCleanup(self.worker._executor.shutdown)
+
+    def deliver(self, created=100):
+        event = card_event('customer.source.created', created)
+        self.assertEqual(post_event(Client(), event.to_dict_recursive()).status_code, 200)
+        return WebhookEvent.objects.get(event_id=event.id)
+
+    def test_event_is_stored_then_handled_by_the_worker(self):
+        webhook_event = self.deliver()
+        self.assertEqual(webhook_event.status, WebhookEvent.PENDING)
+        self.assertFalse(Card.objects.filter(card_id='card_1').exists())
+        self.assertEqual(self.worker.run_once(), 1)
+        webhook_event.refresh_from_db()
+        self.assertEqual((webhook_event.status, webhook_event.attempts), (WebhookEvent.DONE, 1))
+        self.assertTrue(Card.objects.filter(card_id='card_1').exists())
+
+    def test_invalid_signature_is_refused(self):
+        with self.assertLogs('django', 'ERROR'):
+            response = post_event(Client(), card_event('customer.source.created', 100).to_dict_recursive(),
+                                  secret='whsec_other')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_failed_event_is_retried_then_failed(self):
+        webhook_event = self.deliver()
+        with mock.patch('payments.webhooks.handle_event', side_effect=RuntimeError('boom')):
+            with self.assertLogs('django', 'ERROR'):
+                self.worker.run_once()
+            webhook_event.refresh_from_db()
+            self.assertEqual((webhook_event.status, webhook_event.last_error), (WebhookEvent.PENDING, 'boom'))
+            self.assertEqual(self.worker.run_once(), 0)
+            WebhookEvent.objects.filter(pk=webhook_event.pk).update(next_attempt_on=timezone.now())
+            with self.assertLogs('django', 'ERROR'):
+                self.worker.run_once()
+        webhook_event.refresh_from_db()
+        self.assertEqual((webhook_event.status, webhook_event.attempts), (WebhookEvent.FAILED, 2))
+
+    def test_claimed_event_is_not_claimed_twice(self):
+        self.deliver()
+        self.assertEqual(len(WebhookEvent.objects.claim_batch(10, 60, 2)), 1)
+        self.assertEqual(WebhookEvent.objects.claim_batch(10, 60, 2), [])
+
+    def test_abandoned_event_is_claimed_again(self):
+        webhook_event = self.deliver()
+        WebhookEvent.objects.claim_batch(10, 60, 2)
+        WebhookEvent.objects.filter(pk=webhook_event.pk).update(modified_on=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(self.worker.run_once(), 1)
+        webhook_event.refresh_from_db()
+        self.assertEqual((webhook_event.status, webhook_event.attempts), (WebhookEvent.DONE, 2))
+
+
+class WebhookDeduplicationTests(TransactionTestCase):
+    """
+        Class is used to check that a redelivered event is acknowledged without being stored or handled again.
+    """
+
+    def setUp(self):
+        patcher = mock.patch('payments.views.webhook_dedupe', EventDeduplicator())
+        self.dedupe = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.event = card_event('customer.source.created', 100).to_dict_recursive()
+
+    def test_redelivery_is_acknowledged_once_stored(self):
+        for _ in range(3):
+            self.assertEqual(post_event(Client(), self.event).status_code, 200)
+        self.assertEqual(WebhookEvent.objects.filter(event_id=self.event['id']).count(), 1)
+        self.assertEqual((self.dedupe.events, self.dedupe.duplicates, self.dedupe.memory_duplicates), (3, 2, 2))
+
+    def test_redelivery_to_another_process_is_recognised_by_the_inbox(self):
+        post_event(Client(), self.event)
+        other_process = EventDeduplicator()
+        with mock.patch('payments.views.webhook_dedupe', other_process):
+            self.assertEqual(post_event(Client(), self.event).status_code, 200)
+        self.assertEqual((other_process.duplicates, other_process.memory_duplicates), (1, 0))
+        self.assertEqual(WebhookEvent.objects.filter(event_id=self.event['id']).count(), 1)
+
+    def test_handled_event_is_not_handled_again(self):
+        post_event(Client(), self.event)
+        WebhookWorker(workers=1).run(once=True)
+        post_event(Client(), self.event)
+        self.assertEqual(WebhookEvent.objects.get(event_id=self.event['id']).status, WebhookEvent.DONE)
+        self.assertEqual(WebhookEvent.objects.claim_batch(10, 60, 2), [])
+
+
+class LedgerRefundTests(StripeStubMixin, TestCase):
+    """
+        Class is used to check that the already refunded check is answered by the payment ledger.
+    """
+    path = '/api/payments/refund-payment-intent/'
+
+    def setUp(self):
+        self.use_stub()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='grace', email='grace@example.com',
+                                                                password='grace', customer_id='cus_grace'))
+
+    def refund(self, payment_intent='pi_grace'):
+        return self.client.post(self.path, {'payment_intent': payment_intent}, format='json').json()
+
+    def charge(self, refund_status):
+        return {'id': 'ch_grace', 'object': 'charge', 'payment_intent': 'pi_grace', 'amount': 100,
+                'amount_refunded': 100, 'status': 'succeeded', 'refunded': refund_status == 'succeeded',
+                'refunds': {'object': 'list', 'data': [
+                    {'id': 're_grace', 'object': 'refund', 'payment_intent': 'pi_grace', 'charge': 'ch_grace',
+                     'amount': 100, 'status': refund_status}]}}
+
+    def test_second_refund_is_answered_by_the_ledger(self):
+        self.assertEqual(self.refund()['status'], 1)
+        self.assertEqual(self.refund()['message'], constants.PAYMENT_ALREADY_REFUND)
+        self.assertEqual(self.stub_calls('POST', '/v1/refunds'), 1)
+        self.assertEqual(self.stub_calls('GET', '/v1/refunds'), 0)
+
+    def test_refund_of_a_charge_event_is_in_the_ledger(self):
+        Charge.objects.record(self.charge('succeeded'))
+        self.assertEqual(self.refund()['message'], constants.PAYMENT_ALREADY_REFUND)
+        self.assertEqual(self.stub_calls('POST', '/v1/refunds'), 0)
+
+    def test_failed_refund_does_not_count(self):
+        Charge.objects.record(self.charge('failed'))
+        self.assertEqual(self.refund()['status'], 1)
+        self.assertEqual(self.stub_calls('POST', '/v1/refunds'), 1)
+
+    def test_refund_made_outside_the_app_is_already_refunded(self):
+        error = stripe.error.InvalidRequestError('Charge already refunded.', None, code='charge_already_refunded')
+        with mock.patch.object(stripe.Refund, 'create', side_effect=error):
+            self.assertEqual(self.refund()['message'], constants.PAYMENT_ALREADY_REFUND)
+
+
+class ApiJSONRendererTests(SimpleTestCase):
+    """
+        Class is used to check that the fast path renderer writes the same JSON as the rest_framework renderer, with
+        the mirrored cards spliced in as stored.
+    """
+    card = {'id': 'card_1', 'object': 'card', 'brand': 'Visa', 'last4': '4242', 'name': 'Zo\u00eb \u2028'}
+
+    def envelope(self, data):
+        return ApiResponse(status=1, message=constants.GET_ALL_CARD_SUCCESS, data=data).build()
+
+    def test_plain_envelope_matches_the_rest_framework_renderer(self):
+        envelope = self.envelope({'object': 'list', 'data': [self.card, 3, None, 1.5, True], 'has_more': False})
+        self.assertEqual(ApiJSONRenderer().render(envelope), JSONRenderer().render(envelope))
+
+    def test_raw_json_is_spliced_as_stored(self):
+        raw = json.dumps(self.card, indent=1)
+        rendered = ApiJSONRenderer().render(self.envelope({'object': 'list', 'data': [RawJSON(raw)]})).decode()
+        self.assertIn(raw.replace('\u2028', '\\u2028'), rendered)
+        self.assertEqual(json.loads(rendered)['data']['data'], [self.card])
+
+    def test_stripe_objects_are_rendered_whole(self):
+        card = stripe.Card.construct_from(self.card, 'sk_test_stub')
+        rendered = json.loads(ApiJSONRenderer().render(self.envelope({'card': card, 'raw': RawJSON('{"a":1}')})))
+        self.assertEqual(rendered['data'], {'card': self.card, 'raw': {'a': 1}})
+
+    def test_line_separators_are_escaped(self):
+        rendered = ApiJSONRenderer().render(self.envelope(RawJSON(json.dumps(self.card, ensure_ascii=False))))
+        self.assertNotIn('\u2028'.encode(), rendered)
+        self.assertEqual(json.loads(rendered)['data'], self.card)
+
+    def test_indented_output_keeps_the_rest_framework_rendering(self):
+        envelope = self.envelope({'cards': [RawJSON(json.dumps(self.card))]})
+        rendered = ApiJSONRenderer().render(envelope, 'application/json; indent=2')
+        self.assertEqual(json.loads(rendered), json.loads(ApiJSONRenderer().render(envelope)))
+        self.assertIn(b'\n  ', rendered)
+
+    def test_fields_are_kept_from_raw_json(self):
+        projected = project_fields({'object': 'list', 'data': [RawJSON(json.dumps(self.card))]}, ['id', 'last4'])
+        self.assertEqual(projected['data'], [{'id': 'card_1', 'last4': '4242'}])
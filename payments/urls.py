@@ -4,8 +4,10 @@ from .views import *
 urlpatterns = [
     path('create-payment-intent/', CreatePayment.as_view(), name='create_payment'),
     path('refund-payment-intent/', CreateRefund.as_view(), name='create_refund'),
+    path('bulk-refund-payment-intent/', BulkRefund.as_view(), name='bulk_refund'),
     path('cancel-payment-intent/', CancelPaymentIntent.as_view(), name='cancel_intent'),
     path('card-manage/', CardManagement.as_view(), name='card_management'),
     path('default-card/', DefaultCard.as_view(), name='default_card'),
     path('webhook/', WebhookView.as_view(), name='webhook_view'),
+    path('stripe-metrics/', StripeMetrics.as_view(), name='stripe_metrics'),
 ]
@@ -1,18 +1,26 @@
+import json
 import logging
 
 import stripe
-from django.http import HttpResponse
-from rest_framework import status
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework import permissions, serializers, status
 from rest_framework.views import APIView
 
 import constants
 from stripe_card_payment import settings
-from response_utils import ApiResponse
+from response_utils import ApiResponse, get_fields, handle_errors
+from stripe_utils.tracing import tracer
+from stripe_utils.transport import circuit_metrics, rate_limit_metrics, transport_metrics
+from .caches import invalidate_for_event, stripe_cache
+from .idempotency import IdempotencyKeyMismatch, get_idempotency_key
+from .services import (add_card, cancel_payment_intent, create_payment, default_card, delete_card, ensure_customer,
+                       iter_bulk_refunds, list_cards, refund_payment_intent, set_default_card, update_card)
+from .webhooks import EventDeduplicator
 
 logger = logging.getLogger('django')
-stripe.api_key = settings.STRIPE_SECRET_KEY
-stripe_public_key = settings.STRIPE_PUBLIC_KEY
 stripe_webhook_secret = settings.STRIPE_WEBHOOK_SECRET
+webhook_dedupe = EventDeduplicator(maxsize=settings.WEBHOOK_DEDUPE_CACHE_SIZE)
 
 
 class CreatePayment(APIView):
@@ -20,71 +28,31 @@ class CreatePayment(APIView):
     Class is used to Create PaymentIntent.
     """
 
-    def calculate_amount(self, no_count, default_price):
-        """
-        Function is used to calculate the total amount and return the total amount.
-        :param no_count:No of count based on that calculate the total amount.
-        :param default_price: based on that calculate the total amount.
-        :return:amount .
-        """
-        min_amount = constants.MIN_AMOUNT
-        per_no_price = default_price
-        no_count = int(no_count)
-        amount = (no_count * per_no_price) if (no_count * per_no_price) >= min_amount else min_amount
-        return amount
-
+    @handle_errors(constants.CREATE_PAYMENT_INTENT_FAIL)
     def post(self, request):
         """
         Function is used to create new PaymentIntent object and return status.
         :param request:request header with required info for creating new PaymentIntent.
         :return:PaymentIntent details or error message.
         """
+        no_count = request.data.get(constants.PARAM_NO_COUNT)
+        if not no_count:
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_NO_COUNT),
+                               http_status=status.HTTP_404_NOT_FOUND).create_response()
         try:
-            default_price = constants.DEFAULT_PRICE
-            no_count = request.data.get(constants.PARAM_NO_COUNT)
-            if not no_count:
-                return ApiResponse(status=0,
-                                   message=constants.MISSING_PARAM.format(
-                                       constants.PARAM_NO_COUNT),
-                                   http_status=status.HTTP_404_NOT_FOUND).create_response()
-            user_obj = request.user
-            user_id = user_obj.pk
-            user_mail = user_obj.email
-            if user_obj.customer_id is None:
-                customer = stripe.Customer.create(
-                    name=user_obj.username,
-                    email=user_obj.email,
-                    phone=user_obj.phone_number,
-                )
-                user_obj.customer_id = customer['id']
-                user_obj.save()
-            user_customer_id = user_obj.customer_id
-            total_amount = self.calculate_amount(no_count, default_price)
-            amount = int(total_amount * constants.CONVERT_CENT)
-            # Create a PaymentIntent with the order amount and currency
-            intent = stripe.PaymentIntent.create(
-                amount=amount,
-                currency='usd',
-                customer=user_customer_id,
-                receipt_email=user_mail,
-                shipping=constants.STRIPE_SHIPPING_ADDRESS,
-                description=constants.STRIPE_DESCRIPTION,
-                metadata={
-                    'user_id': user_id,
-                }
-            )
-            data = {'amount': total_amount, 'clientSecret': intent.client_secret, 'payment_intent': intent.id,
-                    'stripe_public_key': stripe_public_key}
-            api_response = ApiResponse(status=1, data=data,
-                                       message=constants.CREATE_PAYMENT_INTENT_SUCCESS,
-                                       http_status=status.HTTP_201_CREATED)
-            return api_response.create_response()
-
-        except Exception as e:
-            logger.exception("CreatePayment post exception {}".format(e))
-            api_response = ApiResponse(status=0, message=constants.CREATE_PAYMENT_INTENT_FAIL,
-                                       http_status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            return api_response.create_response()
+            data, replayed = create_payment(request.user, no_count, get_idempotency_key(request))
+        except IdempotencyKeyMismatch:
+            return ApiResponse(status=0, message=constants.IDEMPOTENCY_KEY_MISMATCH,
+                               http_status=status.HTTP_400_BAD_REQUEST).create_response()
+        api_response = ApiResponse(status=1, data=data,
+                                   message=constants.CREATE_PAYMENT_INTENT_SUCCESS,
+                                   http_status=status.HTTP_201_CREATED)
+        response = api_response.create_response()
+        if replayed:
+            response['Idempotent-Replayed'] = 'true'
+        return response
 
 
 class CreateRefund(APIView):
@@ -92,36 +60,89 @@ class CreateRefund(APIView):
     Class is used to Create PaymentRefund.
     """
 
+    @handle_errors(constants.CREATE_PAYMENT_REFUND_FAIL)
     def post(self, request):
         """
         Function is used to create new PaymentRefund object and return the details & the status.
         :param request:request header with required info for creating new PaymentRefund.
         :return:PaymentRefund details or error message.
         """
-        try:
-            payment_intent = request.data.get(constants.PARAM_PAYMENT_INTENT_ID)
-            if not payment_intent:
-                return ApiResponse(status=0,
-                                   message=constants.MISSING_PARAM.format(
-                                       constants.PARAM_PAYMENT_INTENT_ID)).create_response()
-            refund_list = stripe.Refund.list(payment_intent=payment_intent)
-            if refund_list.data:
-                api_response = ApiResponse(status=0,
-                                           message=constants.PAYMENT_ALREADY_REFUND,
-                                           http_status=status.HTTP_200_OK)
-                return api_response.create_response()
-            refund = stripe.Refund.create(
-                payment_intent=payment_intent,
-            )
-            api_response = ApiResponse(status=1, data=refund,
-                                       message=constants.CREATE_PAYMENT_REFUND_SUCCESS,
+        payment_intent = request.data.get(constants.PARAM_PAYMENT_INTENT_ID)
+        if not payment_intent:
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_PAYMENT_INTENT_ID)).create_response()
+        refund = refund_payment_intent(payment_intent)
+        if refund is None:
+            api_response = ApiResponse(status=0,
+                                       message=constants.PAYMENT_ALREADY_REFUND,
                                        http_status=status.HTTP_200_OK)
             return api_response.create_response()
+        api_response = ApiResponse(status=1, data=refund,
+                                   message=constants.CREATE_PAYMENT_REFUND_SUCCESS,
+                                   http_status=status.HTTP_200_OK)
+        return api_response.create_response()
+
+
+class BulkRefund(APIView):
+    """
+    Class is used to Create PaymentRefunds for a batch of PaymentIntents.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def stream(self, results):
+        """
+        Function is used to stream one json line per refunded item followed by a summary line.
+        :param results: generator of item results.
+        :return: generator of json lines.
+        """
+        summary = {'refunded': 0, 'already_refunded': 0, 'failed': 0}
+        try:
+            for result in results:
+                summary[result['status']] += 1
+                yield json.dumps(result) + '\n'
         except Exception as e:
-            logger.exception("CreateRefund post exception {}".format(e))
-            api_response = ApiResponse(status=0, message=constants.CREATE_PAYMENT_REFUND_FAIL,
-                                       http_status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            return api_response.create_response()
+            # The status line is already sent, report the failure as the last line instead of a 500.
+            logger.exception("BulkRefund stream exception {}".format(e))
+            yield json.dumps({'error': constants.CREATE_PAYMENT_REFUND_FAIL, 'summary': summary}) + '\n'
+            return
+        yield json.dumps({'summary': summary}) + '\n'
+
+    @handle_errors(constants.CREATE_PAYMENT_REFUND_FAIL)
+    def post(self, request):
+        """
+        Function is used to refund a list of PaymentIntents concurrently and return the result of every item.
+        :param request:request header with the list of PaymentIntent ids and the optional stream flag.
+        :return:per item refund results or error message.
+        """
+        payment_intents = request.data.get(constants.PARAM_PAYMENT_INTENT_IDS)
+        if not payment_intents or not isinstance(payment_intents, list):
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_PAYMENT_INTENT_IDS),
+                               http_status=status.HTTP_400_BAD_REQUEST).create_response()
+        if len(payment_intents) > settings.BULK_REFUND_MAX_ITEMS:
+            return ApiResponse(status=0,
+                               message=constants.BULK_REFUND_TOO_MANY.format(settings.BULK_REFUND_MAX_ITEMS),
+                               http_status=status.HTTP_400_BAD_REQUEST).create_response()
+        if not all(isinstance(payment_intent, str) and payment_intent for payment_intent in payment_intents):
+            return ApiResponse(status=0, message=constants.BULK_REFUND_INVALID_ITEMS,
+                               http_status=status.HTTP_400_BAD_REQUEST).create_response()
+        try:
+            stream = serializers.BooleanField().to_internal_value(request.data.get(constants.PARAM_STREAM, False))
+        except serializers.ValidationError:
+            return ApiResponse(status=0, message=constants.INVALID_STREAM,
+                               http_status=status.HTTP_400_BAD_REQUEST).create_response()
+        payment_intents = list(dict.fromkeys(payment_intents))
+        results = iter_bulk_refunds(payment_intents, settings.BULK_REFUND_WORKERS, settings.BULK_REFUND_RATE)
+        if stream:
+            return StreamingHttpResponse(self.stream(results), content_type='application/x-ndjson')
+        position = {payment_intent: index for index, payment_intent in enumerate(payment_intents)}
+        results = sorted(results, key=lambda result: position[result['payment_intent']])
+        api_response = ApiResponse(status=1, data={'results': results},
+                                   message=constants.CREATE_BULK_REFUND_SUCCESS,
+                                   http_status=status.HTTP_200_OK, length=len(results))
+        return api_response.create_response()
 
 
 class CancelPaymentIntent(APIView):
@@ -129,29 +150,23 @@ class CancelPaymentIntent(APIView):
     Class is used to Cancel PaymentIntent.
     """
 
+    @handle_errors(constants.CANCEL_PAYMENT_INTENT_FAIL)
     def post(self, request):
         """
         Function is used to cancel PaymentIntent with an incomplete status & return the details.
         :param request:request header with required info for canceling PaymentIntent.
         :return:PaymentIntent details with cancellation status or error message.
         """
-        try:
-            payment_intent = request.data.get(constants.PARAM_PAYMENT_INTENT_ID)
-            if not payment_intent:
-                return ApiResponse(status=0,
-                                   message=constants.MISSING_PARAM.format(
-                                       constants.PARAM_PAYMENT_INTENT_ID)).create_response()
-            intent = stripe.PaymentIntent.cancel(payment_intent)
-            data = {'cancel_intent': intent}
-            api_response = ApiResponse(status=1, data=data,
-                                       message=constants.CANCEL_PAYMENT_INTENT_SUCCESS,
-                                       http_status=status.HTTP_200_OK)
-            return api_response.create_response()
-        except Exception as e:
-            logger.exception("CancelPaymentIntent post exception {}".format(e))
-            api_response = ApiResponse(status=0, message=constants.CANCEL_PAYMENT_INTENT_FAIL,
-                                       http_status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            return api_response.create_response()
+        payment_intent = request.data.get(constants.PARAM_PAYMENT_INTENT_ID)
+        if not payment_intent:
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_PAYMENT_INTENT_ID)).create_response()
+        data = {'cancel_intent': cancel_payment_intent(payment_intent)}
+        api_response = ApiResponse(status=1, data=data,
+                                   message=constants.CANCEL_PAYMENT_INTENT_SUCCESS,
+                                   http_status=status.HTTP_200_OK)
+        return api_response.create_response()
 
 
 class CardManagement(APIView):
@@ -159,152 +174,84 @@ class CardManagement(APIView):
     Class is used to Create,retrieved,update,delete Card objects.
     """
 
+    @handle_errors(constants.GET_ALL_CARD_FAIL)
     def get(self, request):
         """
         Function is used to get all cards details of a user & return the details.
         :param request: request header with required info.
         :return: all cards list with json
         """
-        try:
-            customer_id = request.user.customer_id
-            if customer_id is None:
-                return ApiResponse(status=0,
-                                   message=constants.MISSING_CUSTOMER_ID,
-                                   http_status=status.HTTP_404_NOT_FOUND).create_response()
-            card_list = stripe.Customer.list_sources(
-                customer_id,
-                object="card",
-            )
-            api_response = ApiResponse(status=1, data=card_list,
-                                       message=constants.GET_ALL_CARD_SUCCESS,
-                                       http_status=status.HTTP_200_OK)
-            return api_response.create_response()
-        except Exception as e:
-            logger.exception("CardManagement get exception {}".format(e))
-            api_response = ApiResponse(status=0, message=constants.GET_ALL_CARD_FAIL,
-                                       http_status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            return api_response.create_response()
+        customer_id = ensure_customer(request.user)
+        api_response = ApiResponse(status=1, data=list_cards(customer_id), fields=get_fields(request),
+                                   message=constants.GET_ALL_CARD_SUCCESS,
+                                   http_status=status.HTTP_200_OK)
+        return api_response.create_response()
 
+    @handle_errors(constants.CREATE_CARD_FAIL)
     def post(self, request):
         """
         Function is used to Create Card objects of a user/customer & return the details.
         :param request: request header with required info.
         :return: card details with json or error message.
         """
-        try:
-            user_obj = request.user
-            source_id = request.data.get(constants.PARAM_SOURCE_ID)
-            if not source_id:
-                return ApiResponse(status=0,
-                                   message=constants.MISSING_PARAM.format(
-                                       constants.PARAM_SOURCE_ID),
-                                   http_status=status.HTTP_404_NOT_FOUND).create_response()
-            if user_obj.customer_id is None:
-                customer = stripe.Customer.create(
-                    name=user_obj.username,
-                    email=user_obj.email,
-                    phone=user_obj.phone_number,
-                )
-                user_obj.customer_id = customer['id']
-                user_obj.save()
-            customer_id = user_obj.customer_id
-            token_obj = stripe.Token.retrieve(
-                source_id,
-            )
-            fingerprint = token_obj.card.fingerprint
-            card_list = stripe.Customer.list_sources(
-                customer_id,
-                object="card",
-            )
-            for card in card_list:
-                if fingerprint == card.fingerprint:
-                    api_response = ApiResponse(status=0,
-                                               message=constants.CARD_ALREADY_EXIST,
-                                               http_status=status.HTTP_400_BAD_REQUEST)
-                    return api_response.create_response()
-            new_card = stripe.Customer.create_source(
-                customer_id,
-                source=source_id,
-            )
-            api_response = ApiResponse(status=1, data=new_card,
-                                       message=constants.CREATE_CARD_SUCCESS,
-                                       http_status=status.HTTP_200_OK)
-            return api_response.create_response()
-        except Exception as e:
-            logger.exception("CardManagement post exception {}".format(e))
-            api_response = ApiResponse(status=0, message=constants.CREATE_CARD_FAIL,
-                                       http_status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        source_id = request.data.get(constants.PARAM_SOURCE_ID)
+        if not source_id:
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_SOURCE_ID),
+                               http_status=status.HTTP_404_NOT_FOUND).create_response()
+        new_card = add_card(request.user, source_id)
+        if new_card is None:
+            api_response = ApiResponse(status=0,
+                                       message=constants.CARD_ALREADY_EXIST,
+                                       http_status=status.HTTP_400_BAD_REQUEST)
             return api_response.create_response()
+        api_response = ApiResponse(status=1, data=new_card, fields=get_fields(request),
+                                   message=constants.CREATE_CARD_SUCCESS,
+                                   http_status=status.HTTP_200_OK)
+        return api_response.create_response()
 
+    @handle_errors(constants.UPDATE_CARD_FAIL)
     def put(self, request):
         """
         Function is used to update Card objects of a user/customer & return the status.
         :param request: request header with required info.
         :return: card object with json
         """
-        try:
-            customer_id = request.user.customer_id
-            card_id = request.data.get(constants.PARAM_CARD_ID)
-            card_holder_name = request.data.get(constants.PARAM_CARD_HOLDER_NAME)
-            exp_month = request.data.get(constants.PARAM_EXP_MONTH)
-            exp_year = request.data.get(constants.PARAM_EXP_YEAR)
-            if customer_id is None:
-                return ApiResponse(status=0,
-                                   message=constants.MISSING_CUSTOMER_ID,
-                                   http_status=status.HTTP_404_NOT_FOUND).create_response()
-            if not card_id:
-                return ApiResponse(status=0,
-                                   message=constants.MISSING_PARAM.format(
-                                       constants.PARAM_CARD_ID),
-                                   http_status=status.HTTP_404_NOT_FOUND).create_response()
-            update_card = stripe.Customer.modify_source(
-                customer_id,
-                card_id,
-                name=card_holder_name,
-                exp_month=exp_month,
-                exp_year=exp_year,
-            )
-            api_response = ApiResponse(status=1, data=update_card,
-                                       message=constants.UPDATE_CARD_SUCCESS,
-                                       http_status=status.HTTP_200_OK)
-            return api_response.create_response()
-        except Exception as e:
-            logger.exception("CardManagement put exception {}".format(e))
-            api_response = ApiResponse(status=0, message=constants.UPDATE_CARD_FAIL,
-                                       http_status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            return api_response.create_response()
-
+        card_id = request.data.get(constants.PARAM_CARD_ID)
+        card_holder_name = request.data.get(constants.PARAM_CARD_HOLDER_NAME)
+        exp_month = request.data.get(constants.PARAM_EXP_MONTH)
+        exp_year = request.data.get(constants.PARAM_EXP_YEAR)
+        if not card_id:
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_CARD_ID),
+                               http_status=status.HTTP_404_NOT_FOUND).create_response()
+        customer_id = ensure_customer(request.user)
+        card = update_card(customer_id, card_id, name=card_holder_name, exp_month=exp_month, exp_year=exp_year)
+        api_response = ApiResponse(status=1, data=card, fields=get_fields(request),
+                                   message=constants.UPDATE_CARD_SUCCESS,
+                                   http_status=status.HTTP_200_OK)
+        return api_response.create_response()
+
+    @handle_errors(constants.DELETE_CARD_FAIL)
     def delete(self, request):
         """
         Function is used to delete Card objects of a user/customer & return the status.
         :param request: request header with required info.
         :return: card id,object & status with json
         """
-        try:
-            customer_id = request.user.customer_id
-            card_id = request.data.get(constants.PARAM_CARD_ID)
-            if customer_id is None:
-                return ApiResponse(status=0,
-                                   message=constants.MISSING_CUSTOMER_ID,
-                                   http_status=status.HTTP_404_NOT_FOUND).create_response()
-            if not card_id:
-                return ApiResponse(status=0,
-                                   message=constants.MISSING_PARAM.format(
-                                       constants.PARAM_CARD_ID),
-                                   http_status=status.HTTP_404_NOT_FOUND).create_response()
-            delete_card = stripe.Customer.delete_source(
-                customer_id,
-                card_id,
-            )
-            api_response = ApiResponse(status=1, data=delete_card,
-                                       message=constants.DELETE_CARD_SUCCESS,
-                                       http_status=status.HTTP_200_OK)
-            return api_response.create_response()
-        except Exception as e:
-            logger.exception("CardManagement delete exception {}".format(e))
-            api_response = ApiResponse(status=0, message=constants.DELETE_CARD_FAIL,
-                                       http_status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            return api_response.create_response()
+        card_id = request.data.get(constants.PARAM_CARD_ID)
+        if not card_id:
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_CARD_ID),
+                               http_status=status.HTTP_404_NOT_FOUND).create_response()
+        customer_id = ensure_customer(request.user)
+        api_response = ApiResponse(status=1, data=delete_card(customer_id, card_id),
+                                   message=constants.DELETE_CARD_SUCCESS,
+                                   http_status=status.HTTP_200_OK)
+        return api_response.create_response()
 
 
 class DefaultCard(APIView):
@@ -312,62 +259,37 @@ class DefaultCard(APIView):
     Class is used to Set/Get Default Card objects.
     """
 
+    @handle_errors(constants.DEFAULT_CARD_FAIL)
     def get(self, request):
         """
         Function is used to get default card of a customer & return the card id.
         :param request: request header with required info.
         :return: card id with json
         """
-        try:
-            customer_id = request.user.customer_id
-            if customer_id is None:
-                return ApiResponse(status=0,
-                                   message=constants.MISSING_CUSTOMER_ID,
-                                   http_status=status.HTTP_404_NOT_FOUND).create_response()
-            default_card = stripe.Customer.retrieve(
-                customer_id
-            )
-            api_response = ApiResponse(status=1, data=default_card.default_source,
-                                       message=constants.DEFAULT_CARD_SUCCESS,
-                                       http_status=status.HTTP_200_OK)
-            return api_response.create_response()
-        except Exception as e:
-            logger.exception("DefaultCard get exception {}".format(e))
-            api_response = ApiResponse(status=0, message=constants.DEFAULT_CARD_FAIL,
-                                       http_status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            return api_response.create_response()
+        customer_id = ensure_customer(request.user)
+        api_response = ApiResponse(status=1, data=default_card(customer_id),
+                                   message=constants.DEFAULT_CARD_SUCCESS,
+                                   http_status=status.HTTP_200_OK)
+        return api_response.create_response()
 
+    @handle_errors(constants.SET_DEFAULT_CARD_FAIL)
     def post(self, request):
         """
         Function is used to Set Default Card of a user/customer & return the details.
         :param request: request header with required info.
         :return: card details with json
         """
-        try:
-            customer_id = request.user.customer_id
-            card_id = request.data.get(constants.PARAM_CARD_ID)
-            if not card_id:
-                return ApiResponse(status=0,
-                                   message=constants.MISSING_PARAM.format(
-                                       constants.PARAM_CARD_ID),
-                                   http_status=status.HTTP_404_NOT_FOUND).create_response()
-            if customer_id is None:
-                return ApiResponse(status=0,
-                                   message=constants.MISSING_CUSTOMER_ID,
-                                   http_status=status.HTTP_404_NOT_FOUND).create_response()
-            set_default_card = stripe.Customer.modify(
-                customer_id,
-                default_source=card_id,
-            )
-            api_response = ApiResponse(status=1, data=set_default_card,
-                                       message=constants.SET_DEFAULT_CARD_SUCCESS,
-                                       http_status=status.HTTP_200_OK)
-            return api_response.create_response()
-        except Exception as e:
-            logger.exception("DefaultCard post exception {}".format(e))
-            api_response = ApiResponse(status=0, message=constants.SET_DEFAULT_CARD_FAIL,
-                                       http_status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            return api_response.create_response()
+        card_id = request.data.get(constants.PARAM_CARD_ID)
+        if not card_id:
+            return ApiResponse(status=0,
+                               message=constants.MISSING_PARAM.format(
+                                   constants.PARAM_CARD_ID),
+                               http_status=status.HTTP_404_NOT_FOUND).create_response()
+        customer_id = ensure_customer(request.user)
+        api_response = ApiResponse(status=1, data=set_default_card(customer_id, card_id), fields=get_fields(request),
+                                   message=constants.SET_DEFAULT_CARD_SUCCESS,
+                                   http_status=status.HTTP_200_OK)
+        return api_response.create_response()
 
 
 class WebhookView(APIView):
@@ -379,7 +301,7 @@ class WebhookView(APIView):
 
     def post(self, request):
         """
-        Function is used to handle the events and return status.
+        Function is used to verify the events, store them in the inbox and return status.
         :param request:request header with required info.
         :return:Success message with status or error message.
         """
@@ -400,21 +322,47 @@ class WebhookView(APIView):
                 # Invalid signature
                 logger.exception("WebhookView post SignatureVerificationError exception {}".format(e))
                 return HttpResponse(status=400)
-            # Handle the event
-            if event.type == 'payment_intent.succeeded':
-                payment_intent_success = event.data.object
-
-            elif event.type == 'payment_intent.payment_failed':
-                payment_intent_fail = event.data.object
-
-            elif event.type == 'charge.refunded':
-                refund_update = event.data.object
-
-            elif event.type == 'charge.refund.updated':
-                refund_update = event.data.object
-
+            # Store the event, the process_webhooks worker handles it. Redelivered events are only acknowledged.
+            webhook_dedupe.store(event, payload.decode('utf-8'))
+            invalidate_for_event(event)
             return HttpResponse(status=200)
 
         except Exception as e:
             logger.exception("WebhookView post exception {}".format(e))
             return HttpResponse(status=400)
+
+
+class StripeMetrics(APIView):
+    """
+    Class is used to expose the instrumentation of the Stripe client to the site maintainers.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        """
+        Function is used to get the counters of the Stripe transport, rate limiter, circuit breakers, read
+        cache and webhook de-duplication.
+        :param request: request header with required info.
+        :return: Stripe client counters with json
+        """
+        data = {'transport': transport_metrics(), 'rate_limit': rate_limit_metrics(),
+                'circuit_breakers': circuit_metrics(), 'stripe_cache': stripe_cache.metrics(),
+                'webhook_dedupe': webhook_dedupe.metrics()}
+        api_response = ApiResponse(status=1, data=data, message=constants.GET_STRIPE_METRICS_SUCCESS,
+                                   http_status=status.HTTP_200_OK)
+        return api_response.create_response()
+
+
+class PrometheusMetrics(View):
+    """
+    Class is used to expose the Stripe call histograms of the worker process in the Prometheus text format. It needs
+    no credentials so a scraper can read it, restrict it at the proxy if it is reachable from outside.
+    """
+
+    def get(self, request):
+        """
+        Function is used to get the Stripe call latency histograms and error counters.
+        :param request: request header with required info.
+        :return: Prometheus text exposition.
+        """
+        return HttpResponse(tracer.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
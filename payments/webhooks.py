@@ -0,0 +1,183 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import stripe
+from django.db import IntegrityError, close_old_connections
+from django.utils import timezone
+
+from stripe_utils.lru import LRUCache
+from .models import Card, Charge, PaymentIntent, Refund, WebhookEvent
+
+"""
+    This module contains the handlers of the Stripe events and the worker which drains the webhook inbox.
+"""
+
+logger = logging.getLogger('django')
+
+
+class EventDeduplicator:
+    """
+        This is a class for recognising Stripe events which were already delivered, Stripe delivers at least once.
+
+        Recently seen event ids are answered from an in-process LRU, the others with one lookup on the unique
+        event id index of the inbox.
+
+        Attributes:
+            events (int): Number of verified events checked.
+            duplicates (int): Number of events recognised as redelivered.
+            memory_duplicates (int): Number of duplicates answered by the LRU without a query.
+    """
+
+    def __init__(self, maxsize=10000):
+        self._seen = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self.events = 0
+        self.duplicates = 0
+        self.memory_duplicates = 0
+
+    def _count(self, duplicate, from_memory=False):
+        with self._lock:
+            self.events += 1
+            self.duplicates += duplicate
+            self.memory_duplicates += from_memory
+        return duplicate
+
+    def store(self, event, payload):
+        """
+        Function is used to insert an event in the inbox unless it was already delivered.
+        :param event: verified Stripe event.
+        :param payload: raw request body of the event.
+        :return: True if the event is a duplicate and was not stored.
+        """
+        if event.id in self._seen:
+            return self._count(True, from_memory=True)
+        duplicate = WebhookEvent.objects.filter(event_id=event.id).exists()
+        if not duplicate:
+            try:
+                WebhookEvent.objects.create(event_id=event.id, type=event.type, payload=payload)
+            except IntegrityError:
+                # A concurrent delivery of the same event was stored first.
+                duplicate = True
+        self._seen.set(event.id, True)
+        return self._count(duplicate)
+
+    def metrics(self):
+        """
+        Function is used to report the de-duplication counters.
+        :return: dict of counters.
+        """
+        return {
+            'events': self.events,
+            'duplicates': self.duplicates,
+            'memory_duplicates': self.memory_duplicates,
+            'hit_rate': round(self.duplicates / self.events, 4) if self.events else 0.0,
+            'memory': self._seen.stats(),
+        }
+
+
+def handle_event(event):
+    """
+    Function is used to apply a Stripe event to the local tables.
+    :param event: Stripe event object.
+    """
+    if event.type.startswith('payment_intent.'):
+        PaymentIntent.objects.record(event.data.object, event_created=event.get('created'))
+        for charge in (event.data.object.get('charges') or {}).get('data', []):
+            Charge.objects.record(charge)
+
+    elif event.type == 'charge.refund.updated':
+        Refund.objects.record(event.data.object)
+
+    elif event.type.startswith('charge.') and event.data.object.get('object') == 'charge':
+        Charge.objects.record(event.data.object)
+
+    elif event.type == 'customer.source.deleted':
+        if event.data.object.get('customer'):
+            Card.objects.remove(event.data.object.customer, event.data.object.id)
+
+    elif event.type.startswith('customer.source.'):
+        Card.objects.upsert_from_stripe(event.data.object, event_created=event.get('created'))
+
+
+class WebhookWorker:
+    """
+        This is a class for draining the webhook inbox in batches on a thread pool.
+
+        Attributes:
+            workers (int): Number of threads handling events.
+            batch_size (int): Number of events claimed per poll.
+            concurrency_limits (dict): Event type prefix -> maximum number of such events handled at once.
+            max_attempts (int): Attempts after which an event is marked failed.
+            visibility_timeout (int): Seconds after which an event left in processing is claimed again.
+    """
+
+    def __init__(self, workers=4, batch_size=50, concurrency_limits=None, max_attempts=8, visibility_timeout=300):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self._limits = {prefix: threading.BoundedSemaphore(limit)
+                        for prefix, limit in (concurrency_limits or {}).items()}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='webhook')
+
+    def _limit_for(self, event_type):
+        for prefix, semaphore in self._limits.items():
+            if event_type.startswith(prefix):
+                return semaphore
+        return None
+
+    def process(self, webhook_event):
+        """
+        Function is used to handle one claimed event and record the outcome, failed events are retried with an
+        exponential backoff.
+        :param webhook_event: claimed WebhookEvent object.
+        """
+        semaphore = self._limit_for(webhook_event.type)
+        if semaphore is not None:
+            semaphore.acquire()
+        try:
+            event = stripe.Event.construct_from(json.loads(webhook_event.payload), stripe.api_key)
+            handle_event(event)
+            WebhookEvent.objects.filter(pk=webhook_event.pk).update(
+                status=WebhookEvent.DONE, processed_on=timezone.now(),
+                modified_on=timezone.now(), last_error=None)
+        except Exception as e:
+            logger.exception("WebhookWorker process exception {} for {}".format(e, webhook_event.event_id))
+            attempts = webhook_event.attempts
+            failed = attempts >= self.max_attempts
+            WebhookEvent.objects.filter(pk=webhook_event.pk).update(
+                status=WebhookEvent.FAILED if failed else WebhookEvent.PENDING,
+                next_attempt_on=timezone.now() + timedelta(seconds=min(2 ** attempts, 3600)),
+                modified_on=timezone.now(), last_error=str(e))
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+            close_old_connections()
+
+    def run_once(self):
+        """
+        Function is used to claim and handle one batch of events.
+        :return: number of handled events.
+        """
+        batch = WebhookEvent.objects.claim_batch(self.batch_size, self.visibility_timeout, self.max_attempts)
+        list(self._executor.map(self.process, batch))
+        return len(batch)
+
+    def run(self, poll_interval=1.0, once=False):
+        """
+        Function is used to keep draining the inbox, sleeping while it is empty.
+        :param poll_interval: seconds to wait when there is nothing to do.
+        :param once: stop as soon as the inbox is drained.
+        """
+        try:
+            while True:
+                if not self.run_once():
+                    if once:
+                        return
+                    time.sleep(poll_interval)
+        finally:
+            self._executor.shutdown()
@@ -1,5 +1,19 @@
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+import asyncio
+import functools
+import json
 import logging
+import math
+
+import stripe
+
+import constants
+from stripe_utils.circuit import CircuitOpenError
 
 """
     This module contains class to prepare a proper server response and return it.
@@ -7,6 +21,69 @@ import logging
 
 logger = logging.getLogger('django')
 
+# Same output options as the rest_framework JSONRenderer, the encoder is stateless and shared by every response.
+_encoder = JSONEncoder(ensure_ascii=not api_settings.UNICODE_JSON, allow_nan=not api_settings.STRICT_JSON,
+                       separators=(',', ':'))
+
+
+class RawJSON(str):
+    """
+    Class is used to mark a string holding an already serialized JSON value, such as a mirrored Stripe card, it is
+    written to the response as is instead of being parsed and serialized again.
+    """
+
+
+def _encode(obj, parts):
+    if isinstance(obj, RawJSON):
+        parts.append(obj)
+    elif type(obj) is dict and all(type(key) is str for key in obj):
+        parts.append('{')
+        for index, (key, value) in enumerate(obj.items()):
+            parts.append(',' if index else '')
+            parts.append(_encoder.encode(key))
+            parts.append(':')
+            _encode(value, parts)
+        parts.append('}')
+    elif type(obj) is list:
+        parts.append('[')
+        for index, value in enumerate(obj):
+            parts.append(',' if index else '')
+            _encode(value, parts)
+        parts.append(']')
+    else:
+        # Stripe objects, serializer data and scalars are serialized by the C encoder in one call.
+        parts.append(_encoder.encode(obj))
+
+
+def encode_json(obj):
+    """
+    Function is used to serialize a response envelope in one pass. Only the plain dicts and lists built by the views
+    are walked in python, Stripe objects are handed whole to the C encoder without being copied to dicts first and
+    RawJSON values are spliced in.
+    :param obj: response envelope.
+    :return: utf-8 encoded JSON.
+    """
+    parts = []
+    _encode(obj, parts)
+    # Same escaping as the rest_framework JSONRenderer, for JSON embedded in javascript.
+    return ''.join(parts).replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+
+class ApiJSONRenderer(JSONRenderer):
+    """
+    Class is used to render the ApiResponse envelopes with ``encode_json()``, indented output requested by the
+    browsable API keeps the rest_framework rendering.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        content = encode_json(data)
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is None:
+            return content
+        return super(ApiJSONRenderer, self).render(json.loads(content), accepted_media_type, renderer_context)
+
 
 class ApiResponse:
     """
@@ -21,13 +98,14 @@ class ApiResponse:
         """
 
     def __init__(self, status: int, message: str, data: dict = None, http_status=None, length=None,
-                 count=None, total_page=None, next=None, previous=None):
+                 count=None, total_page=None, next=None, previous=None, fields=None):
         """
 
         :param status:  Status to be sent in response.
         :param message: message to be sent with response.
         :param data:    Data to be sent in api, if not specified returns empty dict
         :param http_status: HTTP_STATUS of api, if not specified explicitly then handled by restframework
+        :param fields:  Fields of data to keep, see ``get_fields()``, all of them if not specified.
         """
         self.response = {}
 
@@ -39,15 +117,15 @@ class ApiResponse:
         self.total_page = total_page
         self.next = next
         self.previous = previous
+        self.fields = fields
 
         self.data = data if data else dict()
 
-    def create_response(self):
+    def build(self):
         """
-        Creates a Response class object and returns it.
+        Builds the common response envelope.
 
-        :py:class:: `rest_framework.response.Response`
-        :return: Returns the Response of rest_framework api.
+        :return: Returns the response dict.
         """
         if self.count is not None:
             self.response['count'] = self.count
@@ -61,16 +139,125 @@ class ApiResponse:
         self.response['message'] = self.message
         if self.length:
             self.response['length'] = self.length
-        self.response['data'] = self.data
+        self.response['data'] = project_fields(self.data, self.fields) if self.fields else self.data
+        return self.response
+
+    def create_response(self):
+        """
+        Creates a Response class object and returns it.
+
+        :py:class:: `rest_framework.response.Response`
+        :return: Returns the Response of rest_framework api.
+        """
+        self.build()
 
         if self.http_status:
             return Response(self.response, status=self.http_status)
         else:
             return Response(self.response)
 
+    def create_json_response(self):
+        """
+        Creates a json HttpResponse class object and returns it, used by the async views which bypass the
+        rest_framework rendering.
+
+        :py:class:: `django.http.HttpResponse`
+        :return: Returns the HttpResponse of django.
+        """
+        self.build()
+        return HttpResponse(encode_json(self.response), status=self.http_status or 200,
+                            content_type='application/json')
+
+
+def get_fields(request):
+    """
+    Function is used to read the ``fields`` query parameter which selects the fields of the returned objects,
+    for example ``?fields=id,brand,last4,exp_year``.
+    :param request: rest_framework or django request.
+    :return: list of field names or None to return every field.
+    """
+    fields = [field.strip() for field in request.GET.get(constants.PARAM_FIELDS, '').split(',') if field.strip()]
+    return fields or None
+
+
+def project_fields(data, fields):
+    """
+    Function is used to keep only the requested fields of an object, or of every object of a Stripe list.
+    :param data: Stripe object, list object or RawJSON.
+    :param fields: field names to keep.
+    :return: projected data, values which are not objects are returned as they are.
+    """
+    if isinstance(data, RawJSON):
+        data = json.loads(data)
+    if not isinstance(data, dict):
+        return data
+    if data.get('object') == 'list' and isinstance(data.get('data'), list):
+        return {key: [project_fields(item, fields) for item in value] if key == 'data' else value
+                for key, value in data.items()}
+    return {field: data[field] for field in fields if field in data}
+
 
 def get_error_message(serializer):
     logger.error(serializer.errors)
     errors = list(serializer.errors.values())
     logger.error(errors)
     return errors[0][0]
+
+
+def stripe_unavailable_response(error, json_response=False):
+    """
+    Function is used to answer a request whose Stripe call was rate limited or rejected by an open circuit, instead
+    of a generic 500.
+    :param error: stripe.error.RateLimitError or CircuitOpenError.
+    :param json_response: True to build a django JsonResponse for the async views.
+    :return: 503 response when the circuit is open, otherwise 429, with a Retry-After header.
+    """
+    if isinstance(error, CircuitOpenError):
+        api_response = ApiResponse(status=0, message=constants.STRIPE_UNAVAILABLE,
+                                   http_status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        retry_after = math.ceil(error.retry_after)
+    else:
+        api_response = ApiResponse(status=0, message=constants.STRIPE_RATE_LIMITED,
+                                   http_status=status.HTTP_429_TOO_MANY_REQUESTS)
+        retry_after = 1
+    response = api_response.create_json_response() if json_response else api_response.create_response()
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def _error_response(name, error, fail_message, json_response=False):
+    if isinstance(error, (stripe.error.RateLimitError, CircuitOpenError)):
+        logger.warning("{} Stripe unavailable {}".format(name, error))
+        return stripe_unavailable_response(error, json_response=json_response)
+    logger.exception("{} exception {}".format(name, error))
+    api_response = ApiResponse(status=0, message=fail_message, http_status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return api_response.create_json_response() if json_response else api_response.create_response()
+
+
+def handle_errors(fail_message):
+    """
+    Function is used to decorate the methods of the views instead of repeating the same except blocks: a Stripe call
+    rate limited or rejected by an open circuit is answered by ``stripe_unavailable_response()``, any other exception
+    is logged and answered with a 500. The methods of the async views get django responses.
+    :param fail_message: message of the 500 response.
+    :return: decorator.
+    """
+    def decorator(method):
+        name = method.__qualname__.replace('.', ' ')
+        if asyncio.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await method(*args, **kwargs)
+                except Exception as e:
+                    return _error_response(name, e, fail_message, json_response=True)
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                return _error_response(name, e, fail_message)
+        return wrapper
+    return decorator
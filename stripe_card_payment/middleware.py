@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+from django.middleware.gzip import GZipMiddleware
+from django.utils.deprecation import MiddlewareMixin
+
+from stripe_card_payment import settings
+from stripe_utils.tracing import tracer
+
+"""
+    This module contains the middlewares of the project.
+"""
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Class is used to gzip the responses of the clients which accept it, only above RESPONSE_COMPRESSION_MIN_SIZE
+    bytes since smaller payloads cost more to compress than they save. Streamed responses such as the bulk refund
+    progress are sent as they are produced.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming or len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE:
+            return response
+        return super(CompressionMiddleware, self).process_response(request, response)
+
+
+class StripeTracingMiddleware(MiddlewareMixin):
+    """
+    Class is used to trace the Stripe calls of every request. It adds the milliseconds spent in Stripe and the number of
+    calls to the response headers and the request to the histograms of ``/metrics``. The calls made in the request
+    context while a streamed response is sent, such as the bulk refunds, happen after the headers are sent: they
+    are added to the histograms of the endpoint only.
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        token = tracer.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            trace = tracer.finish(token, _endpoint(request), time.perf_counter() - start)
+        return _add_headers(response, trace)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        token = tracer.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            trace = tracer.finish(token, _endpoint(request), time.perf_counter() - start)
+        return _add_headers(response, trace)
+
+
+def _endpoint(request):
+    # The route keeps the label count bounded, unknown urls share one label.
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match is not None else 'unmatched'
+
+
+def _add_headers(response, trace):
+    response['X-Stripe-Time'] = '{:.3f}'.format(trace.stripe_seconds * 1000)
+    response['X-Stripe-Calls'] = str(len(trace.calls))
+    return response
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 from datetime import timedelta
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -37,12 +38,14 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
-    'payments',
-    'users',
+    'payments.apps.PaymentsConfig',
+    'users.apps.UsersConfig',
 ]
 
 MIDDLEWARE = [
+    'stripe_card_payment.middleware.StripeTracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'stripe_card_payment.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -78,6 +81,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # The tests write from worker threads, an in-memory SQLite database fails them at once instead of waiting.
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'stripe_card_payment_test.sqlite3')},
     }
 }
 
@@ -154,12 +159,72 @@ LOGGING = {
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.StatelessJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'response_utils.ApiJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
+# Directory of the Stripe read cache, set it to share the cached Stripe objects between the worker processes.
+STRIPE_CACHE_LOCATION = os.environ.get("STRIPE_CACHE_LOCATION")
+
+# Cache of the user versions which revoke the claims of the JWT access tokens, every worker process must read the
+# same one: a directory (the default) shares it between the workers of one host, use memcached or the database
+# cache for several hosts. An in-process cache is refused by the system checks.
+JWT_VERSION_CACHE_BACKEND = os.environ.get("JWT_VERSION_CACHE_BACKEND",
+                                           'django.core.cache.backends.filebased.FileBasedCache')
+JWT_VERSION_CACHE_LOCATION = os.environ.get("JWT_VERSION_CACHE_LOCATION",
+                                            os.path.join(tempfile.gettempdir(), 'stripe_card_payment_jwt_versions'))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'stripe': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache' if STRIPE_CACHE_LOCATION
+        else 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': STRIPE_CACHE_LOCATION or 'stripe',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'jwt_versions': {
+        'BACKEND': JWT_VERSION_CACHE_BACKEND,
+        'LOCATION': JWT_VERSION_CACHE_LOCATION,
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
+# Default and maximum page size of the user listing, and how it counts the users: exact, approximate or none.
+USERS_LIST_PAGE_SIZE = int(os.environ.get("USERS_LIST_PAGE_SIZE", 50))
+USERS_LIST_MAX_PAGE_SIZE = int(os.environ.get("USERS_LIST_MAX_PAGE_SIZE", 500))
+USERS_LIST_COUNT = os.environ.get("USERS_LIST_COUNT", 'exact')
+
+# Users inserted per bulk insert, concurrent Customer.create calls and calls per second of a bulk user import.
+USER_IMPORT_CHUNK_SIZE = int(os.environ.get("USER_IMPORT_CHUNK_SIZE", 500))
+USER_IMPORT_WORKERS = int(os.environ.get("USER_IMPORT_WORKERS", 8))
+USER_IMPORT_RATE = float(os.environ.get("USER_IMPORT_RATE", 10))
+
+# Seconds the serialized details of a user are cached, every write of the user replaces the entry.
+USER_DETAILS_CACHE_TIMEOUT = int(os.environ.get("USER_DETAILS_CACHE_TIMEOUT", 300))
+
+# Responses of at least this many bytes are gzipped for the clients which send Accept-Encoding: gzip.
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.environ.get("RESPONSE_COMPRESSION_MIN_SIZE", 1024))
+
+# Users cached per process for the access tokens which do not carry the user claims, and their seconds to live.
+JWT_USER_CACHE_SIZE = int(os.environ.get("JWT_USER_CACHE_SIZE", 10000))
+JWT_USER_CACHE_TTL = float(os.environ.get("JWT_USER_CACHE_TTL", 60))
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
 }
@@ -170,3 +235,76 @@ STRIPE_PUBLIC_KEY = os.environ.get("STRIPE_PUBLIC_KEY", 'pk_test_key')
 STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY", 'sk_test_key')
 STRIPE_LIVE_MODE = False
 STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET", 'whsec_secret_key')
+STRIPE_API_BASE = os.environ.get("STRIPE_API_BASE", 'https://api.stripe.com')
+# Kept alive connections per worker process, size it to the number of threads of a worker.
+STRIPE_HTTP_POOL_SIZE = int(os.environ.get("STRIPE_HTTP_POOL_SIZE", 10))
+STRIPE_HTTP_CONNECT_TIMEOUT = float(os.environ.get("STRIPE_HTTP_CONNECT_TIMEOUT", 5))
+STRIPE_HTTP_READ_TIMEOUT = float(os.environ.get("STRIPE_HTTP_READ_TIMEOUT", 30))
+STRIPE_MAX_NETWORK_RETRIES = int(os.environ.get("STRIPE_MAX_NETWORK_RETRIES", 0))
+# Seconds after which the claim of a Stripe customer create is taken over, keep it above the read timeout.
+STRIPE_CUSTOMER_CLAIM_TIMEOUT = float(os.environ.get("STRIPE_CUSTOMER_CLAIM_TIMEOUT", 60))
+# Seconds a response to an idempotent retry is replayed from the cache, Stripe keeps keys for 24 hours.
+IDEMPOTENCY_CACHE_TIMEOUT = int(os.environ.get("IDEMPOTENCY_CACHE_TIMEOUT", 24 * 60 * 60))
+# Concurrent Stripe calls, refunds per second and size limit of a bulk refund request.
+BULK_REFUND_WORKERS = int(os.environ.get("BULK_REFUND_WORKERS", 8))
+BULK_REFUND_RATE = float(os.environ.get("BULK_REFUND_RATE", 20))
+BULK_REFUND_MAX_ITEMS = int(os.environ.get("BULK_REFUND_MAX_ITEMS", 5000))
+# Threads shared by the requests to send their independent Stripe calls concurrently.
+STRIPE_FANOUT_WORKERS = int(os.environ.get("STRIPE_FANOUT_WORKERS", 16))
+# Connections per event loop used by the async views.
+STRIPE_ASYNC_MAX_CONNECTIONS = int(os.environ.get("STRIPE_ASYNC_MAX_CONNECTIONS", 100))
+
+# STRIPE READ CACHE
+
+STRIPE_CACHE_ALIAS = 'stripe'
+# Object type -> seconds a Stripe read is served from the cache, tokens never change once created.
+STRIPE_CACHE_TTLS = {
+    'customer': int(os.environ.get("STRIPE_CACHE_CUSTOMER_TTL", 300)),
+    'sources': int(os.environ.get("STRIPE_CACHE_SOURCES_TTL", 60)),
+    'token': int(os.environ.get("STRIPE_CACHE_TOKEN_TTL", 3600)),
+}
+# Seconds an expired entry is still served while a single caller refreshes it.
+STRIPE_CACHE_STALE_SECONDS = int(os.environ.get("STRIPE_CACHE_STALE_SECONDS", 30))
+
+# STRIPE RATE LIMITER
+
+# Calls per second shared by every worker process of the host, Stripe allows 100 in live mode and 25 in test mode.
+STRIPE_RATE_LIMIT_ENABLED = os.environ.get("STRIPE_RATE_LIMIT_ENABLED", 'true').lower() == 'true'
+STRIPE_RATE_LIMIT_READ = float(os.environ.get("STRIPE_RATE_LIMIT_READ", 80 if STRIPE_LIVE_MODE else 20))
+STRIPE_RATE_LIMIT_WRITE = float(os.environ.get("STRIPE_RATE_LIMIT_WRITE", 80 if STRIPE_LIVE_MODE else 20))
+# Times a call rate limited by Stripe is sent again after backing off.
+STRIPE_RATE_LIMIT_RETRIES = int(os.environ.get("STRIPE_RATE_LIMIT_RETRIES", 2))
+# SQLite file holding the shared buckets, it must be on a local disk seen by every worker process.
+STRIPE_RATE_LIMIT_PATH = os.environ.get("STRIPE_RATE_LIMIT_PATH",
+                                        os.path.join(tempfile.gettempdir(), 'stripe_card_payment_ratelimit.sqlite3'))
+
+# STRIPE CIRCUIT BREAKER
+
+# Consecutive failures of an operation family (customers, sources, payment_intents...) that open its circuit.
+STRIPE_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("STRIPE_CIRCUIT_FAILURE_THRESHOLD", 5))
+# Seconds an open circuit fails fast before letting a probe call through.
+STRIPE_CIRCUIT_RESET_TIMEOUT = float(os.environ.get("STRIPE_CIRCUIT_RESET_TIMEOUT", 30))
+# Times a failed read is retried with a jittered backoff.
+STRIPE_READ_RETRIES = int(os.environ.get("STRIPE_READ_RETRIES", 2))
+
+# STRIPE WEBHOOK WORKER
+
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", 4))
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", 50))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", 8))
+WEBHOOK_VISIBILITY_TIMEOUT = int(os.environ.get("WEBHOOK_VISIBILITY_TIMEOUT", 300))
+# Recently seen event ids kept in memory by every web worker to acknowledge redeliveries without a query.
+WEBHOOK_DEDUPE_CACHE_SIZE = int(os.environ.get("WEBHOOK_DEDUPE_CACHE_SIZE", 10000))
+# Event type prefix -> maximum number of such events handled at once by a worker.
+WEBHOOK_CONCURRENCY_LIMITS = {
+    'customer.source.': 2,
+    'payment_intent.': 4,
+    'charge.': 4,
+}
+
+# STRIPE OUTBOX DISPATCHER
+
+OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS", 4))
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 50))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_VISIBILITY_TIMEOUT = int(os.environ.get("OUTBOX_VISIBILITY_TIMEOUT", 300))
@@ -21,12 +21,19 @@ from rest_framework_simplejwt.views import (
 from django.contrib import admin
 from django.urls import path, include
 
+from payments.views import PrometheusMetrics
+from users.authentication import ClaimsTokenObtainPairSerializer, ClaimsTokenRefreshSerializer
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('api/token/', TokenObtainPairView.as_view(serializer_class=ClaimsTokenObtainPairSerializer),
+         name='token_obtain_pair'),
     path('api/token/verify/', TokenVerifyView.as_view(), name='token_verify'),
-    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/token/refresh/', TokenRefreshView.as_view(serializer_class=ClaimsTokenRefreshSerializer),
+         name='token_refresh'),
     path('api/payments/', include('payments.urls')),
+    path('api/async/payments/', include('payments.async_urls')),
     path('api/users/', include('users.urls')),
+    path('metrics', PrometheusMetrics.as_view(), name='metrics'),
 ]
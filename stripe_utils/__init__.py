@@ -0,0 +1,3 @@
+"""
+    This package contains the shared plumbing used by the views to talk to Stripe.
+"""
@@ -0,0 +1,235 @@
+import asyncio
+import time
+import weakref
+from urllib.parse import quote, urlencode, urlsplit
+
+import httpx
+import stripe
+from stripe.api_requestor import APIRequestor, _api_encode
+from stripe.version import VERSION
+
+from .circuit import backoff_seconds, is_failure
+from .ratelimit import budget_for
+from .tracing import tracer
+
+"""
+    This module contains a minimal asyncio Stripe client used by the async views.
+"""
+
+
+def path_segment(object_id):
+    """
+    Function is used to encode an object id as exactly one segment of a Stripe path. A ``/`` in a client supplied
+    id is escaped and a dot segment is rejected, the http clients would otherwise resolve it to another object.
+    :param object_id: id such as a card id sent by the client.
+    :return: encoded path segment.
+    :raises: stripe.error.InvalidRequestError for an empty or dot id.
+    """
+    segment = quote(str(object_id), safe='')
+    if segment in ('', '.', '..'):
+        raise stripe.error.InvalidRequestError("Invalid object id: '%s'." % object_id, None)
+    return segment
+
+
+def check_path(url):
+    """
+    Function is used before sending a Stripe call built by the stripe bindings, which escape ``/`` in the ids but
+    leave dot segments, so a call never reaches another object than the one its ids name.
+    :param url: absolute url or api path.
+    :raises: stripe.error.InvalidRequestError when the path has a dot segment.
+    """
+    if any(segment in ('.', '..') for segment in urlsplit(url).path.split('/')):
+        raise stripe.error.InvalidRequestError("Invalid Stripe path: '%s'." % url, None)
+
+
+class AsyncStripeClient:
+    """
+        This is a class for issuing Stripe API calls without blocking a worker thread.
+
+        Requests are encoded and responses are decoded exactly like the official bindings do, so the views get
+        back the same ``StripeObject`` trees and ``stripe.error`` exceptions as with the sync client.
+
+        Attributes:
+            api_key (str): Secret key used for the calls, defaults to ``stripe.api_key``.
+            api_base (str): Base url of the Stripe API, defaults to ``stripe.api_base``.
+            timeout (float): Read timeout in seconds of a single call.
+            connect_timeout (float): Seconds to wait for a connection.
+            max_connections (int): Size of the connection pool of every event loop.
+            limiter (SharedRateLimiter): Rate limiter shared with the sync transport, None to disable it.
+            breakers (CircuitBreakers): Circuit breakers shared with the sync transport, None to disable them.
+            read_retries (int): Times a failed GET call is retried.
+    """
+
+    def __init__(self, api_key=None, api_base=None, timeout=80, connect_timeout=5, max_connections=100,
+                 limiter=None, breakers=None, read_retries=0):
+        # httpx connections are bound to the event loop that opened them, so keep one pool per loop.
+        self._clients = weakref.WeakKeyDictionary()
+        self.configure(api_key, api_base, timeout, connect_timeout, max_connections, limiter, breakers, read_retries)
+
+    def configure(self, api_key=None, api_base=None, timeout=80, connect_timeout=5, max_connections=100,
+                  limiter=None, breakers=None, read_retries=0):
+        """
+        Function is used to (re)configure the client, pools opened with the previous settings are dropped.
+        """
+        self.api_key = api_key
+        self.api_base = api_base
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self.limiter = limiter
+        self.breakers = breakers
+        self.read_retries = read_retries
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _get_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            timeout = httpx.Timeout(self.timeout, connect=self.connect_timeout)
+            client = httpx.AsyncClient(timeout=timeout, limits=limits)
+            self._clients[loop] = client
+        return client
+
+    async def request(self, method, url, params=None, idempotency_key=None):
+        """
+        Function is used to call a Stripe endpoint and convert the response to Stripe objects.
+        :param method: http method, one of get, post or delete.
+        :param url: api path such as ``/v1/customers``.
+        :param params: request parameters.
+        :param idempotency_key: Idempotency-Key header for post requests.
+        :return: StripeObject of the response.
+        """
+        check_path(url)
+        api_key = self.api_key or stripe.api_key
+        encoded_params = urlencode(list(_api_encode(params or {}))).replace("%5B", "[").replace("%5D", "]")
+        abs_url = "%s%s" % (self.api_base or stripe.api_base, url)
+        headers = {
+            "Authorization": "Bearer %s" % (api_key,),
+            "User-Agent": "Stripe/v1 PythonBindings/%s async" % (VERSION,),
+        }
+        if stripe.api_version:
+            headers["Stripe-Version"] = stripe.api_version
+        content = None
+        if method == "post":
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+            if idempotency_key:
+                headers["Idempotency-Key"] = idempotency_key
+            content = encoded_params
+        elif encoded_params:
+            abs_url = "%s?%s" % (abs_url, encoded_params)
+        breaker = self.breakers.for_url(url) if self.breakers is not None else None
+        retries = self.read_retries if method == "get" else 0
+        num_retries = 0
+        start = time.perf_counter()
+        while True:
+            if breaker is not None:
+                breaker.allow()
+            try:
+                response = await self._send(method, abs_url, headers, content)
+                connection_error = None
+            except stripe.error.APIConnectionError as e:
+                response, connection_error = None, e
+            except BaseException:
+                # Such as CancelledError when the request is dropped, the probe slot must not leak.
+                if breaker is not None:
+                    breaker.abort()
+                raise
+            failed = connection_error is not None or is_failure(response.status_code)
+            if breaker is not None:
+                breaker.record(not failed)
+            if num_retries < retries and failed:
+                num_retries += 1
+                await asyncio.sleep(backoff_seconds(num_retries))
+            elif connection_error is not None:
+                tracer.record(method, url, 0, time.perf_counter() - start)
+                raise connection_error
+            else:
+                tracer.record(method, url, response.status_code, time.perf_counter() - start)
+                break
+        requestor = APIRequestor(key=api_key, client=stripe.default_http_client)
+        resp = requestor.interpret_response(response.content, response.status_code, response.headers)
+        return stripe.util.convert_to_stripe_object(resp, api_key, stripe.api_version, None)
+
+    async def _send(self, method, abs_url, headers, content):
+        budget = budget_for(method)
+        throttled = 0
+        # The shared limiter is a SQLite transaction which can wait on the other processes, keep it off the loop.
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.limiter is not None:
+                waited = 0.0
+                delay = await loop.run_in_executor(None, self.limiter.try_acquire, budget)
+                while delay:
+                    await asyncio.sleep(delay)
+                    waited += delay
+                    delay = await loop.run_in_executor(None, self.limiter.try_acquire, budget)
+                self.limiter.record_wait(budget, waited)
+            try:
+                response = await self._get_client().request(method.upper(), abs_url, headers=headers,
+                                                            content=content)
+            except httpx.HTTPError as e:
+                raise stripe.error.APIConnectionError("Error communicating with Stripe: %s" % (e,))
+            if response.status_code != 429 or self.limiter is None or throttled >= self.limiter.retries:
+                return response
+            await loop.run_in_executor(None, self.limiter.throttled, budget)
+            throttled += 1
+
+    async def close(self):
+        """
+        Function is used to close the connection pool of the running event loop.
+        """
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    # Customers
+
+    async def create_customer(self, **params):
+        return await self.request("post", "/v1/customers", params)
+
+    async def retrieve_customer(self, customer_id):
+        return await self.request("get", "/v1/customers/%s" % path_segment(customer_id))
+
+    async def modify_customer(self, customer_id, **params):
+        return await self.request("post", "/v1/customers/%s" % path_segment(customer_id), params)
+
+    # Sources
+
+    async def list_sources(self, customer_id, **params):
+        return await self.request("get", "/v1/customers/%s/sources" % path_segment(customer_id), params)
+
+    async def create_source(self, customer_id, **params):
+        return await self.request("post", "/v1/customers/%s/sources" % path_segment(customer_id), params)
+
+    async def modify_source(self, customer_id, source_id, **params):
+        path = "/v1/customers/%s/sources/%s" % (path_segment(customer_id), path_segment(source_id))
+        return await self.request("post", path, params)
+
+    async def delete_source(self, customer_id, source_id):
+        path = "/v1/customers/%s/sources/%s" % (path_segment(customer_id), path_segment(source_id))
+        return await self.request("delete", path)
+
+    async def retrieve_token(self, token_id):
+        return await self.request("get", "/v1/tokens/%s" % path_segment(token_id))
+
+    # Payments
+
+    async def create_payment_intent(self, idempotency_key=None, **params):
+        return await self.request("post", "/v1/payment_intents", params, idempotency_key=idempotency_key)
+
+    async def retrieve_payment_intent(self, payment_intent_id):
+        return await self.request("get", "/v1/payment_intents/%s" % path_segment(payment_intent_id))
+
+    async def modify_payment_intent(self, payment_intent_id, **params):
+        return await self.request("post", "/v1/payment_intents/%s" % path_segment(payment_intent_id), params)
+
+    async def cancel_payment_intent(self, payment_intent_id, **params):
+        return await self.request("post", "/v1/payment_intents/%s/cancel" % path_segment(payment_intent_id), params)
+
+    async def list_refunds(self, **params):
+        return await self.request("get", "/v1/refunds", params)
+
+    async def create_refund(self, idempotency_key=None, **params):
+        return await self.request("post", "/v1/refunds", params, idempotency_key=idempotency_key)
@@ -0,0 +1,173 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import stripe
+
+"""
+    This module contains the circuit breakers that stop calling Stripe while an operation family is failing.
+"""
+
+
+class CircuitOpenError(stripe.error.APIConnectionError):
+    """
+    Class is used to reject a Stripe call without sending it while the circuit of its operation family is open.
+    """
+
+    def __init__(self, family, retry_after):
+        super(CircuitOpenError, self).__init__("Stripe %s calls are failing, not calling Stripe for %.0f seconds."
+                                               % (family, retry_after))
+        self.family = family
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+        This is a class for failing fast once the calls of one Stripe operation family keep failing.
+
+        The circuit opens after ``failure_threshold`` consecutive failures, rejects every call for ``reset_timeout``
+        seconds, then lets ``half_open_calls`` probe calls through. A successful probe closes the circuit and a
+        failed one opens it again.
+
+        Attributes:
+            family (str): Operation family such as ``customers`` or ``payment_intents``.
+            failure_threshold (int): Consecutive failures that open the circuit.
+            reset_timeout (float): Seconds the circuit stays open before probing.
+            half_open_calls (int): Probe calls allowed at once while half open.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, family, failure_threshold=5, reset_timeout=30, half_open_calls=1):
+        self.family = family
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._counters = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    def allow(self):
+        """
+        Function is used before every call, it raises ``CircuitOpenError`` when the call must not be sent.
+        """
+        with self._lock:
+            if self._state == self.OPEN:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self._counters['rejected'] += 1
+                    raise CircuitOpenError(self.family, remaining)
+                self._state = self.HALF_OPEN
+                self._probes = 0
+            if self._state == self.HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self._counters['rejected'] += 1
+                    raise CircuitOpenError(self.family, self.reset_timeout)
+                self._probes += 1
+            self._counters['calls'] += 1
+
+    def record(self, success):
+        """
+        Function is used after every call to move the circuit according to its outcome.
+        :param success: False when Stripe could not be reached or answered with a server error.
+        """
+        with self._lock:
+            if success:
+                self._failures = 0
+                self._state = self.CLOSED
+                return
+            self._fail()
+
+    def abort(self):
+        """
+        Function is used when a call ends without an outcome, such as a cancelled task or an unexpected exception.
+        A probe counts as failed so its half open slot is given back, other calls are not counted.
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._fail()
+
+    def _fail(self):
+        self._counters['failures'] += 1
+        self._failures += 1
+        if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                self._counters['opened'] += 1
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self):
+        """
+        Function is used to report the state and counters of the circuit.
+        :return: dict of circuit state and counters.
+        """
+        with self._lock:
+            return dict(self._counters, state=self._state, consecutive_failures=self._failures)
+
+
+class CircuitBreakers:
+    """
+        This is a class for keeping one circuit breaker per Stripe operation family, created on first use.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, half_open_calls=1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def for_url(self, url):
+        """
+        Function is used to get the circuit breaker guarding a Stripe url.
+        :param url: absolute or relative url of the call.
+        :return: CircuitBreaker of the operation family.
+        """
+        family = operation_family(url)
+        breaker = self._breakers.get(family)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(family, CircuitBreaker(family, self.failure_threshold,
+                                                                           self.reset_timeout, self.half_open_calls))
+        return breaker
+
+    def stats(self):
+        """
+        Function is used to report the circuits of every operation family called so far.
+        :return: dict of family -> circuit state and counters.
+        """
+        return {family: breaker.stats() for family, breaker in sorted(self._breakers.items())}
+
+
+def operation_family(url):
+    """
+    Function is used to group a Stripe url into its operation family, sources are apart from their customer.
+    :param url: absolute or relative url of the call.
+    :return: family name such as ``customers``, ``sources`` or ``payment_intents``.
+    """
+    segments = [segment for segment in urlsplit(url).path.split('/') if segment and segment != 'v1']
+    if len(segments) >= 3 and segments[0] == 'customers':
+        return segments[2]
+    return segments[0] if segments else 'unknown'
+
+
+def is_failure(status_code):
+    """
+    Function is used to tell whether a Stripe answer counts against the circuit, only server errors do.
+    """
+    return status_code >= 500
+
+
+def backoff_seconds(retry, base=0.5, cap=2.0):
+    """
+    Function is used to get the jittered exponential wait before retrying a read.
+    :param retry: number of the retry, starting at 1.
+    :return: seconds to wait, between half and all of the exponential delay.
+    """
+    delay = min(base * (2 ** (retry - 1)), cap)
+    return delay * (0.5 + random.random() / 2)
@@ -0,0 +1,64 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+
+"""
+    This module contains a helper to run the independent Stripe calls of a request concurrently.
+"""
+
+
+class FanOut:
+    """
+        This is a class for issuing independent calls of a request in parallel and joining on their results.
+
+        The first call runs on the request thread, the others on a thread pool shared by the worker process. They
+        run with a copy of the request context, so their Stripe calls are traced with the request. They do not
+        share the database transaction of the request.
+
+        Attributes:
+            workers (int): Threads of the shared pool.
+            cleanup (function): Called on the pool thread after every call, such as ``close_old_connections``.
+    """
+
+    def __init__(self, workers=16, cleanup=None):
+        self.workers = workers
+        self.cleanup = cleanup
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fanout')
+
+    def _call(self, call):
+        try:
+            return call()
+        finally:
+            if self.cleanup is not None:
+                self.cleanup()
+
+    def submit(self, call):
+        """
+        Function is used to run one call on the pool with a copy of the current context, such as a blocking call of
+        an async view.
+        :param call: function taking no argument.
+        :return: concurrent.futures.Future of the result.
+        """
+        return self._executor.submit(contextvars.copy_context().run, self._call, call)
+
+    def run(self, *calls):
+        """
+        Function is used to run calls concurrently, the request waits for the slowest one.
+        :param calls: functions taking no argument, such as ``functools.partial`` objects.
+        :return: list of the results in the order of the calls.
+        :raises: the exception of the first failed call, once every call is done.
+        """
+        futures = [self.submit(call) for call in calls[1:]]
+        results = []
+        error = None
+        try:
+            results.append(calls[0]())
+        except Exception as e:
+            error = e
+        wait(futures)
+        for future in futures:
+            if future.exception() is not None and error is None:
+                error = future.exception()
+            results.append(None if future.exception() is not None else future.result())
+        if error is not None:
+            raise error
+        return results
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+
+"""
+    This module contains a small thread safe in-process LRU cache with an optional time to live.
+"""
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+        This is a class for keeping the most recently used entries in memory.
+
+        Attributes:
+            maxsize (int): Maximum number of entries, the least recently used one is evicted first.
+            ttl (float): Seconds an entry stays valid, None keeps entries until they are evicted.
+            hits (int): Number of lookups answered from the cache.
+            misses (int): Number of lookups which were not in the cache.
+            evictions (int): Number of entries dropped to respect ``maxsize``.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Function is used to get a cached value.
+        :param key: cache key.
+        :param default: value returned on a miss.
+        :return: cached value or default.
+        """
+        with self._lock:
+            value, expires = self._data.get(key, (_MISSING, None))
+            if value is not _MISSING and expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                value = _MISSING
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def set(self, key, value):
+        """
+        Function is used to cache a value and evict the least recently used entries above ``maxsize``.
+        :param key: cache key.
+        :param value: value to cache.
+        """
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """
+        Function is used to drop a cached value.
+        :param key: cache key.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """
+        Function is used to report the cache counters.
+        :return: dict of cache counters.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
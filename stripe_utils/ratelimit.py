@@ -0,0 +1,189 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+"""
+    This module contains the rate limiters used to stay under the Stripe API rate limits.
+"""
+
+
+class TokenBucket:
+    """
+        This is a class for pacing calls inside the worker process with a token bucket.
+
+        Attributes:
+            rate (float): Tokens added per second.
+            capacity (float): Maximum number of tokens, the allowed burst.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Function is used to wait until ``tokens`` are available and take them.
+        :param tokens: number of tokens to take.
+        :return: seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class SharedRateLimiter:
+    """
+        This is a class for keeping all the worker processes of a host under the Stripe rate limits.
+
+        Every budget (``read`` for GET calls, ``write`` for the others) is a token bucket stored in a small SQLite
+        file, so the processes share it. A 429 from Stripe halves the rate of the budget for everybody and the
+        rate then recovers gradually to its configured value.
+
+        Attributes:
+            path (str): SQLite file holding the buckets.
+            rates (dict): Budget name -> maximum calls per second.
+            retries (int): Times a call answered with 429 is sent again after backing off.
+    """
+    BACKOFF = 0.5
+    MIN_RATE_RATIO = 0.1
+    # Share of the configured rate recovered per second after a backoff.
+    RECOVERY_PER_SECOND = 0.05
+
+    def __init__(self, path, rates, retries=2):
+        self.path = path
+        self.rates = dict(rates)
+        self.retries = retries
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {name: {'calls': 0, 'waits': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+                              'throttled': 0} for name in self.rates}
+
+    def _connection(self):
+        # One connection per thread and process, a connection must not be shared across a fork.
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS bucket (name TEXT PRIMARY KEY, tokens REAL, rate REAL, '
+                               'updated REAL)')
+            for name, rate in self.rates.items():
+                connection.execute('INSERT OR IGNORE INTO bucket VALUES (?, ?, ?, ?)', (name, rate, rate, time.time()))
+            self._local.connection = connection
+            self._local.pid = pid
+        return self._local.connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        # Outside the try, a BEGIN which failed has nothing to end and its error is raised as is.
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+            connection.execute('COMMIT')
+        except BaseException:
+            # A transaction left open would fail every later BEGIN of this thread.
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+
+    def _refill(self, connection, name):
+        tokens, rate, updated = connection.execute('SELECT tokens, rate, updated FROM bucket WHERE name = ?',
+                                                   (name,)).fetchone()
+        now = time.time()
+        elapsed = max(now - updated, 0.0)
+        max_rate = self.rates[name]
+        rate = min(max_rate, rate + max_rate * self.RECOVERY_PER_SECOND * elapsed)
+        tokens = min(rate, tokens + elapsed * rate)
+        return tokens, rate, now
+
+    def try_acquire(self, name):
+        """
+        Function is used to take a token of a budget without waiting.
+        :param name: budget name, ``read`` or ``write``.
+        :return: 0 when the token was taken, otherwise the seconds to wait before trying again.
+        """
+        with self._transaction() as connection:
+            tokens, rate, now = self._refill(connection, name)
+            delay = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if not delay:
+                tokens -= 1
+            connection.execute('UPDATE bucket SET tokens = ?, rate = ?, updated = ? WHERE name = ?',
+                               (tokens, rate, now, name))
+        return delay
+
+    def acquire(self, name):
+        """
+        Function is used to wait for a token of a budget.
+        :param name: budget name, ``read`` or ``write``.
+        :return: seconds spent waiting.
+        """
+        waited = 0.0
+        delay = self.try_acquire(name)
+        while delay:
+            time.sleep(delay)
+            waited += delay
+            delay = self.try_acquire(name)
+        self.record_wait(name, waited)
+        return waited
+
+    def record_wait(self, name, waited):
+        """
+        Function is used to account the time a call waited for its token.
+        """
+        with self._stats_lock:
+            stats = self._stats[name]
+            stats['calls'] += 1
+            if waited:
+                stats['waits'] += 1
+                stats['wait_seconds'] += waited
+                stats['max_wait_seconds'] = max(stats['max_wait_seconds'], waited)
+
+    def throttled(self, name):
+        """
+        Function is used to back off a budget for every process after Stripe answered 429.
+        :param name: budget name, ``read`` or ``write``.
+        """
+        with self._transaction() as connection:
+            _, rate, now = self._refill(connection, name)
+            rate = max(self.rates[name] * self.MIN_RATE_RATIO, rate * self.BACKOFF)
+            connection.execute('UPDATE bucket SET tokens = 0, rate = ?, updated = ? WHERE name = ?',
+                               (rate, now, name))
+        with self._stats_lock:
+            self._stats[name]['throttled'] += 1
+
+    def stats(self):
+        """
+        Function is used to report the wait times of this process and the current shared rates.
+        :return: dict of budget name -> counters.
+        """
+        connection = self._connection()
+        current = dict(connection.execute('SELECT name, rate FROM bucket').fetchall())
+        with self._stats_lock:
+            return {name: dict(stats, max_rate=self.rates[name], current_rate=round(current.get(name, 0.0), 2),
+                               mean_wait_seconds=round(stats['wait_seconds'] / stats['calls'], 6)
+                               if stats['calls'] else 0.0)
+                    for name, stats in self._stats.items()}
+
+
+def budget_for(method):
+    """
+    Function is used to pick the budget of a Stripe call from its http method.
+    :param method: http method of the call.
+    :return: ``read`` or ``write``.
+    """
+    return 'read' if method.lower() == 'get' else 'write'
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from functools import partial
+
+"""
+    This module contains helpers to collapse concurrent identical calls into a single upstream call.
+"""
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+        This is a class for making sure only one call per key is in flight inside the worker process.
+
+        The first caller of a key runs the function, every concurrent caller of the same key waits for it and gets
+        the same result or exception.
+
+        Attributes:
+            calls (int): Number of calls which reached the function.
+            shared (int): Number of calls answered with the result of an in flight call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Function is used to run ``fn`` once for all concurrent callers of ``key``.
+        :param key: hashable key identifying identical calls.
+        :param fn: function to run.
+        :return: result of ``fn``.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class AsyncSingleFlight:
+    """
+        This is a class for making sure only one call per key is in flight on an event loop, the async
+        counterpart of ``SingleFlight``.
+
+        The first caller of a key starts the coroutine as a task, every concurrent caller of the same key awaits
+        the same task. A cancelled caller does not cancel the task the other callers wait for.
+
+        Attributes:
+            calls (int): Number of calls which reached the function.
+            shared (int): Number of calls answered with the result of an in flight call.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, fn, *args, **kwargs):
+        """
+        Function is used to run ``fn`` once for all concurrent callers of ``key`` on the running event loop.
+        :param key: hashable key identifying identical calls.
+        :param fn: coroutine function to run.
+        :return: result of ``fn``.
+        """
+        # Tasks are bound to their event loop, callers on another loop start their own call.
+        task_key = (asyncio.get_running_loop(), key)
+        task = self._tasks.get(task_key)
+        if task is None:
+            task = self._tasks[task_key] = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(partial(self._done, task_key))
+            self.calls += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _done(self, task_key, task):
+        del self._tasks[task_key]
+        if not task.cancelled():
+            # Retrieve the error so a call whose callers were all cancelled is not reported as never retrieved.
+            task.exception()
@@ -0,0 +1,200 @@
+import contextvars
+import threading
+from bisect import bisect_left
+from urllib.parse import urlsplit
+
+"""
+    This module contains the tracing of the Stripe calls: per request totals and in-process latency histograms
+    per endpoint and Stripe operation, exported in the Prometheus text format.
+"""
+
+# Upper bounds in seconds of the latency buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Endpoint label of the calls made outside of a request, by the workers and the management commands.
+BACKGROUND = 'background'
+
+_current = contextvars.ContextVar('stripe_trace', default=None)
+
+
+def operation_name(method, url):
+    """
+    Function is used to name a Stripe operation after its method and path, with the object ids replaced.
+    :param method: http method.
+    :param url: absolute url or api path such as ``/v1/customers/cus_123/sources``.
+    :return: operation such as ``GET /v1/customers/{id}/sources``.
+    """
+    parts = urlsplit(url).path.split('/')
+    # Stripe paths alternate collections and ids: /v1/<collection>/<id>/<collection or action>/<id>.
+    for index in range(3, len(parts), 2):
+        parts[index] = '{id}'
+    return '{} {}'.format(method.upper(), '/'.join(parts))
+
+
+class Histogram:
+    """
+        This is a class for counting observations in fixed latency buckets.
+
+        Attributes:
+            counts (list): Observations per bucket, the last one counts the values above every bound.
+            sum (float): Sum of the observed values.
+            count (int): Number of observations.
+    """
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestTrace:
+    """
+        This is a class for collecting the Stripe calls of one request.
+
+        The calls of a request can run on FanOut threads, they are appended to ``calls`` and the time is summed
+        when it is read. Once the request is finished its endpoint is set, the calls made later in its context,
+        such as those of a streamed response, go straight to the histograms of the endpoint.
+
+        Attributes:
+            calls (list): (operation, status code, seconds) of every call, status 0 for a connection error.
+            endpoint (str): Route of the finished request, None while the request runs.
+    """
+    __slots__ = ('calls', 'endpoint')
+
+    def __init__(self):
+        self.calls = []
+        self.endpoint = None
+
+    @property
+    def stripe_seconds(self):
+        """
+        Function is used to get the time spent in Stripe calls, concurrent calls are added up.
+        """
+        return sum(seconds for _, _, seconds in self.calls)
+
+
+class StripeTracer:
+    """
+        This is a class for recording the latency of the Stripe calls.
+
+        The calls of a request are collected on its ``RequestTrace`` and merged into the histograms under the lock
+        once the request is done, when its endpoint is known. The histograms are kept per process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._errors = {}
+        self._stripe_time = {}
+        self._request_time = {}
+
+    def start(self):
+        """
+        Function is used to start collecting the Stripe calls of the current request or task.
+        :return: token to pass to ``finish()``.
+        """
+        return _current.set(RequestTrace())
+
+    def record(self, method, url, status_code, seconds):
+        """
+        Function is used by the Stripe clients to record a call.
+        :param method: http method.
+        :param url: url or api path of the call.
+        :param status_code: http status of the response, 0 when no response was received.
+        :param seconds: duration of the call, retries included.
+        """
+        operation = operation_name(method, url)
+        trace = _current.get()
+        with self._lock:
+            if trace is None or trace.endpoint is not None:
+                self._observe(BACKGROUND if trace is None else trace.endpoint, operation, status_code, seconds)
+            else:
+                trace.calls.append((operation, status_code, seconds))
+
+    def _observe(self, endpoint, operation, status_code, seconds):
+        key = (endpoint, operation)
+        histogram = self._calls.get(key)
+        if histogram is None:
+            histogram = self._calls[key] = Histogram()
+        histogram.observe(seconds)
+        if status_code == 0 or status_code >= 400:
+            error_key = (endpoint, operation, str(status_code))
+            self._errors[error_key] = self._errors.get(error_key, 0) + 1
+
+    def finish(self, token, endpoint, seconds):
+        """
+        Function is used to stop collecting the calls of a request and add them to the histograms.
+        :param token: token returned by ``start()``.
+        :param endpoint: route of the request.
+        :param seconds: duration of the whole request.
+        :return: RequestTrace of the request.
+        """
+        trace = _current.get()
+        _current.reset(token)
+        with self._lock:
+            trace.endpoint = endpoint
+            for operation, status_code, call_seconds in trace.calls:
+                self._observe(endpoint, operation, status_code, call_seconds)
+            for histograms, value in ((self._stripe_time, trace.stripe_seconds), (self._request_time, seconds)):
+                histogram = histograms.get(endpoint)
+                if histogram is None:
+                    histogram = histograms[endpoint] = Histogram()
+                histogram.observe(value)
+        return trace
+
+    def prometheus(self):
+        """
+        Function is used to export the histograms and counters in the Prometheus text format.
+        :return: text exposition.
+        """
+        with self._lock:
+            calls = [(key, list(h.counts), h.sum, h.count) for key, h in self._calls.items()]
+            stripe_time = [((key,), list(h.counts), h.sum, h.count) for key, h in self._stripe_time.items()]
+            request_time = [((key,), list(h.counts), h.sum, h.count) for key, h in self._request_time.items()]
+            errors = list(self._errors.items())
+        lines = []
+        _histogram_lines(lines, 'stripe_call_duration_seconds', 'Duration of the Stripe calls, retries included.',
+                         ('endpoint', 'operation'), calls)
+        _histogram_lines(lines, 'stripe_request_duration_seconds', 'Time a request spent in Stripe calls.',
+                         ('endpoint',), stripe_time)
+        _histogram_lines(lines, 'http_request_duration_seconds', 'Duration of the requests.', ('endpoint',),
+                         request_time)
+        lines.append('# HELP stripe_call_errors_total Stripe calls answered with an error or without response.')
+        lines.append('# TYPE stripe_call_errors_total counter')
+        for key, value in sorted(errors):
+            lines.append('stripe_call_errors_total{} {}'.format(
+                _labels(('endpoint', 'operation', 'status'), key), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}'
+
+
+def _histogram_lines(lines, name, help_text, label_names, rows):
+    lines.append('# HELP {} {}'.format(name, help_text))
+    lines.append('# TYPE {} histogram'.format(name))
+    for key, counts, total, count in sorted(rows):
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS + ('+Inf',), counts):
+            cumulative += bucket_count
+            labels = _labels(label_names, key, 'le="{}"'.format(bound))
+            lines.append('{}_bucket{} {}'.format(name, labels, cumulative))
+        lines.append('{}_sum{} {}'.format(name, _labels(label_names, key), total))
+        lines.append('{}_count{} {}'.format(name, _labels(label_names, key), count))
+
+
+tracer = StripeTracer()
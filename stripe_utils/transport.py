@@ -0,0 +1,180 @@
+import logging
+import time
+
+import requests
+import stripe
+from requests.adapters import HTTPAdapter
+from stripe.http_client import RequestsClient, _now_ms
+
+from .async_client import AsyncStripeClient, check_path
+from .circuit import CircuitBreakers, backoff_seconds, is_failure
+from .ratelimit import SharedRateLimiter, budget_for
+from .tracing import tracer
+
+"""
+    This module contains the shared HTTP transport used by every Stripe call of the project.
+"""
+
+logger = logging.getLogger('django')
+
+# Shared asyncio client of the async views, configured together with the sync transport.
+async_stripe = AsyncStripeClient()
+
+
+class PooledRequestsClient(RequestsClient):
+    """
+        This is a class for sending the Stripe calls over one keep-alive connection pool per worker process.
+
+        The stock client opens one ``requests.Session`` per thread, so every new thread pays a TLS handshake.
+        This client shares a single session whose pool is sized to the threads of the worker.
+
+        Attributes:
+            pool_size (int): Maximum number of kept alive connections to Stripe.
+            connect_timeout (float): Seconds to wait for a connection.
+            read_timeout (float): Seconds to wait for a response.
+            limiter (SharedRateLimiter): Rate limiter every call waits on, None to disable it.
+            breakers (CircuitBreakers): Circuit breakers of the operation families, None to disable them.
+            read_retries (int): Times a failed GET call is retried, other calls follow ``stripe.max_network_retries``.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=5, read_timeout=30, limiter=None, breakers=None,
+                 read_retries=0, **kwargs):
+        self.pool_size = pool_size
+        self.limiter = limiter
+        self.breakers = breakers
+        self.read_retries = read_retries
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        session = requests.Session()
+        session.mount('https://', self._adapter)
+        session.mount('http://', self._adapter)
+        super(PooledRequestsClient, self).__init__(timeout=(connect_timeout, read_timeout), session=session,
+                                                   **kwargs)
+
+    def request_with_retries(self, method, url, headers, post_data=None):
+        check_path(url)
+        breaker = self.breakers.for_url(url) if self.breakers is not None else None
+        retries = self._max_network_retries()
+        if method == 'get':
+            retries = max(retries, self.read_retries)
+        self._add_telemetry_header(headers)
+        num_retries = 0
+        start = time.perf_counter()
+        while True:
+            if breaker is not None:
+                breaker.allow()
+            request_start = _now_ms()
+            try:
+                response = self.request(method, url, headers, post_data)
+                connection_error = None
+            except stripe.error.APIConnectionError as e:
+                response, connection_error = None, e
+            except BaseException:
+                if breaker is not None:
+                    breaker.abort()
+                raise
+            failed = connection_error is not None or is_failure(response[1])
+            if breaker is not None:
+                breaker.record(not failed)
+            if num_retries < retries and (failed or response[1] == 409):
+                num_retries += 1
+                sleep_time = backoff_seconds(num_retries)
+                logger.warning("Retrying Stripe {} {} in {:.2f} seconds".format(method.upper(), url, sleep_time))
+                time.sleep(sleep_time)
+            elif connection_error is not None:
+                tracer.record(method, url, 0, time.perf_counter() - start)
+                raise connection_error
+            else:
+                tracer.record(method, url, response[1], time.perf_counter() - start)
+                self._record_request_metrics(response, request_start)
+                return response
+
+    def request(self, method, url, headers, post_data=None):
+        if self.limiter is None:
+            return super(PooledRequestsClient, self).request(method, url, headers, post_data)
+        budget = budget_for(method)
+        throttled = 0
+        while True:
+            self.limiter.acquire(budget)
+            response = super(PooledRequestsClient, self).request(method, url, headers, post_data)
+            if response[1] != 429 or throttled >= self.limiter.retries:
+                return response
+            # Stripe does not process a rate limited call, so sending it again is safe.
+            self.limiter.throttled(budget)
+            throttled += 1
+            logger.warning("Stripe rate limited a {} call, backing off the {} budget".format(method.upper(), budget))
+
+    def metrics(self):
+        """
+        Function is used to report how well the pooled connections are reused.
+        :return: dict of transport counters.
+        """
+        manager = self._adapter.poolmanager
+        pools = [manager.pools[key] for key in manager.pools.keys()]
+        sent = sum(pool.num_requests for pool in pools)
+        opened = sum(pool.num_connections for pool in pools)
+        return {
+            'pool_size': self.pool_size,
+            'requests': sent,
+            'connections_opened': opened,
+            'connections_reused': max(sent - opened, 0),
+            'reuse_ratio': round((sent - opened) / sent, 4) if sent else 0.0,
+            'idle_connections': sum(pool.pool.qsize() for pool in pools if pool.pool is not None),
+        }
+
+
+def configure_stripe(settings):
+    """
+    Function is used once at app startup to point the Stripe bindings and the async client at the shared transport.
+    :param settings: django settings.
+    :return: PooledRequestsClient installed as ``stripe.default_http_client``.
+    """
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.api_base = settings.STRIPE_API_BASE
+    stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+    limiter = None
+    if settings.STRIPE_RATE_LIMIT_ENABLED:
+        rates = {'read': settings.STRIPE_RATE_LIMIT_READ, 'write': settings.STRIPE_RATE_LIMIT_WRITE}
+        limiter = SharedRateLimiter(settings.STRIPE_RATE_LIMIT_PATH, rates, retries=settings.STRIPE_RATE_LIMIT_RETRIES)
+    breakers = CircuitBreakers(failure_threshold=settings.STRIPE_CIRCUIT_FAILURE_THRESHOLD,
+                               reset_timeout=settings.STRIPE_CIRCUIT_RESET_TIMEOUT)
+    client = PooledRequestsClient(pool_size=settings.STRIPE_HTTP_POOL_SIZE,
+                                  connect_timeout=settings.STRIPE_HTTP_CONNECT_TIMEOUT,
+                                  read_timeout=settings.STRIPE_HTTP_READ_TIMEOUT, limiter=limiter,
+                                  breakers=breakers, read_retries=settings.STRIPE_READ_RETRIES)
+    stripe.default_http_client = client
+    async_stripe.configure(api_key=settings.STRIPE_SECRET_KEY, api_base=settings.STRIPE_API_BASE,
+                           timeout=settings.STRIPE_HTTP_READ_TIMEOUT,
+                           connect_timeout=settings.STRIPE_HTTP_CONNECT_TIMEOUT,
+                           max_connections=settings.STRIPE_ASYNC_MAX_CONNECTIONS, limiter=limiter,
+                           breakers=breakers, read_retries=settings.STRIPE_READ_RETRIES)
+    logger.info("Stripe transport configured with a pool of {} connections".format(client.pool_size))
+    return client
+
+
+def transport_metrics():
+    """
+    Function is used to get the counters of the shared transport.
+    :return: dict of transport counters or empty dict before startup.
+    """
+    client = stripe.default_http_client
+    return client.metrics() if isinstance(client, PooledRequestsClient) else {}
+
+
+def rate_limit_metrics():
+    """
+    Function is used to get the wait times and current rates of the Stripe rate limiter.
+    :return: dict of budget counters or empty dict when the limiter is disabled.
+    """
+    limiter = getattr(stripe.default_http_client, 'limiter', None)
+    return limiter.stats() if limiter is not None else {}
+
+
+def circuit_metrics():
+    """
+    Function is used to get the state of the circuit breakers of the Stripe operation families.
+    :return: dict of family -> circuit state or empty dict when the breakers are disabled.
+    """
+    breakers = getattr(stripe.default_http_client, 'breakers', None)
+    return breakers.stats() if breakers is not None else {}
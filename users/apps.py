@@ -3,3 +3,15 @@ from django.apps import AppConfig
 
 class UsersConfig(AppConfig):
     name = 'users'
+
+    def ready(self):
+        """
+        Function is used to invalidate the tokens of a user on every change of the user, including the admin and the
+        shell, and to check that the user versions are shared by the worker processes.
+        """
+        from django.core import checks
+        from django.db.models.signals import post_delete, post_save
+        from .authentication import check_version_cache, user_changed
+        checks.register(check_version_cache, checks.Tags.caches)
+        post_save.connect(user_changed, sender=self.get_model('User'))
+        post_delete.connect(user_changed, sender=self.get_model('User'))
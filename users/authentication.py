@@ -0,0 +1,202 @@
+import uuid
+
+from django.core import checks
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from stripe_card_payment import settings
+from stripe_utils.lru import LRUCache
+from .models import User
+
+"""
+    This module contains the stateless JWT authentication: the access token carries the user fields the views
+    read, so authenticating a request needs one read of the user versions cache instead of a database query. Every
+    worker process reads the same versions cache, so a change of the user revokes the claims of its tokens in all of
+    them at once.
+"""
+
+# Alias of the cache holding the user versions, see ``JWT_VERSION_CACHE_BACKEND``.
+VERSION_CACHE = 'jwt_versions'
+
+# Cache backends which keep their entries per process and can not hold the user versions.
+PROCESS_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# User fields copied into the tokens, every view reads its user from them.
+USER_CLAIMS = ('username', 'email', 'phone_number', 'customer_id', 'is_staff')
+
+# Claim holding the version of the user the token was issued at, see ``user_version()``.
+VERSION_CLAIM = 'user_version'
+
+# Users loaded for tokens without usable claims, such as tokens issued before the claims or before the Stripe
+# customer of the user was created, with the version they were loaded at.
+user_cache = LRUCache(maxsize=settings.JWT_USER_CACHE_SIZE, ttl=settings.JWT_USER_CACHE_TTL)
+
+
+def add_user_claims(token, user):
+    """
+    Function is used to copy the user fields read by the views into a token.
+    :param token: simplejwt token.
+    :param user: user the token is issued for.
+    :return: token.
+    """
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    token[VERSION_CLAIM] = user_version(user.pk)
+    return token
+
+
+def _version_key(pk):
+    return 'user-version:{}'.format(pk)
+
+
+def user_version(pk):
+    """
+    Function is used to get the version of a user from the versions cache, every change of the user replaces it.
+    A user without a version, never changed or evicted from the cache, gets a new one: a version is never given
+    again, so the tokens issued before an eviction fall back to loading the user instead of trusting their claims.
+    :param pk: id of the user.
+    :return: version.
+    """
+    cache = caches[VERSION_CACHE]
+    key = _version_key(pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_user(pk):
+    """
+    Function is used to drop a cached user and stop trusting the claims of its tokens: the tokens issued before load
+    the user again, so a deleted or deactivated user is refused and a changed one gets its new fields.
+    :param pk: id of the user.
+    """
+    caches[VERSION_CACHE].set(_version_key(pk), uuid.uuid4().hex)
+    user_cache.delete(pk)
+
+
+def check_version_cache(app_configs, **kwargs):
+    """
+    Function is used as a system check refusing a versions cache kept per process, a user changed in one worker
+    process would keep the claims of its tokens trusted by the others.
+    :return: list of errors.
+    """
+    backend = settings.CACHES.get(VERSION_CACHE, {}).get('BACKEND')
+    if backend is None:
+        return [checks.Error("The '%s' cache is not configured." % VERSION_CACHE,
+                             hint="Set JWT_VERSION_CACHE_BACKEND and JWT_VERSION_CACHE_LOCATION.", id='users.E001')]
+    if backend in PROCESS_CACHE_BACKENDS:
+        return [checks.Error("The '%s' cache must be shared by the worker processes, %s is not." %
+                             (VERSION_CACHE, backend),
+                             hint="Use a file based, memcached or database cache.", id='users.E002')]
+    return []
+
+
+def user_changed(sender, instance, **kwargs):
+    """
+    Function is used as the post_save and post_delete receiver of the User model, it invalidates the user once the
+    change is committed so the user is not loaded again before the change is visible.
+    """
+    pk = instance.pk
+    transaction.on_commit(lambda: invalidate_user(pk))
+
+
+class TokenClaimsUser:
+    """
+        This is a class for the user of a request built from the claims of its access token.
+
+        Attributes:
+            pk (int): Id of the user, also available as ``id``.
+            username (str): Username of the user.
+            email (str): Email of the user.
+            phone_number (str): Phone number of the user.
+            customer_id (str): Stripe customer id of the user.
+            is_staff (bool): Whether the user is a site maintainer.
+    """
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+    is_superuser = False
+
+    def __init__(self, token):
+        self.pk = self.id = token[api_settings.USER_ID_CLAIM]
+        for claim in USER_CLAIMS:
+            setattr(self, claim, token[claim])
+
+    def __str__(self):
+        return self.username
+
+    def __eq__(self, other):
+        return getattr(other, 'pk', None) == self.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    Class is used to authenticate a request with the claims of its access token instead of loading the user.
+    Tokens without the claims, issued before the user had a Stripe customer or before the last change of the user,
+    fall back to a bounded in-process cache of users so they cost at most one query per user and
+    ``JWT_USER_CACHE_TTL``. Staff users are always loaded, a revoked maintainer loses access at once.
+    """
+
+    def get_user(self, validated_token):
+        """
+        Function is used to build the user of a validated access token.
+        :param validated_token: decoded access token.
+        :return: TokenClaimsUser, or the User when the token has no usable claims or is issued for a staff user.
+        """
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        if validated_token.get('is_staff'):
+            return super(StatelessJWTAuthentication, self).get_user(validated_token)
+        version = user_version(user_id)
+        claims = all(claim in validated_token for claim in USER_CLAIMS + (VERSION_CLAIM,))
+        if claims and validated_token.get('customer_id') and validated_token[VERSION_CLAIM] == version:
+            return TokenClaimsUser(validated_token)
+        cached = user_cache.get(user_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        user = super(StatelessJWTAuthentication, self).get_user(validated_token)
+        user_cache.set(user_id, (version, user))
+        return user
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    serializer to issue token pairs carrying the user claims
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super(ClaimsTokenObtainPairSerializer, cls).get_token(user), user)
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    serializer to refresh access tokens with the current user claims, a refresh picks up the changes of the user
+    """
+
+    def validate(self, attrs):
+        user_id = RefreshToken(attrs['refresh']).get(api_settings.USER_ID_CLAIM)
+        data = super(ClaimsTokenRefreshSerializer, self).validate(attrs)
+        user = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is None or not user.is_active:
+            raise InvalidToken(_('User not found'))
+        data['access'] = str(add_user_claims(AccessToken(data['access']), user))
+        if 'refresh' in data:
+            data['refresh'] = str(add_user_claims(RefreshToken(data['refresh']), user))
+        return data
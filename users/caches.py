@@ -0,0 +1,48 @@
+from django.core.cache import cache
+
+from stripe_card_payment import settings
+
+"""
+    This module contains the cache of the serialized user details and their ETags.
+"""
+
+
+def user_etag(pk, modified_on):
+    """
+    Function is used to build the ETag of a user, every save of the user moves ``modified_on``.
+    :param pk: id of the user.
+    :param modified_on: last modification time of the user.
+    :return: quoted ETag.
+    """
+    return '"user-{}-{}"'.format(pk, int(modified_on.timestamp() * 1000000))
+
+
+def _key(pk):
+    return 'user-details:{}'.format(pk)
+
+
+def get_cached_details(pk, etag):
+    """
+    Function is used to get the serialized details of a user if they were cached for this ETag.
+    :param pk: id of the user.
+    :param etag: current ETag of the user.
+    :return: serialized user or None.
+    """
+    cached = cache.get(_key(pk))
+    if cached is None or cached[0] != etag:
+        return None
+    return cached[1]
+
+
+def cache_details(pk, etag, data):
+    """
+    Function is used to cache the serialized details of a user under its ETag.
+    """
+    cache.set(_key(pk), (etag, dict(data)), timeout=settings.USER_DETAILS_CACHE_TIMEOUT)
+
+
+def invalidate_details(pk):
+    """
+    Function is used by the write paths to drop the cached details of a user.
+    """
+    cache.delete(_key(pk))
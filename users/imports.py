@@ -0,0 +1,275 @@
+import csv
+import io
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import stripe
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.db import connection, transaction
+from django.db.models import Q
+from rest_framework import serializers
+
+import constants
+from payments.services import claim_customer, create_claimed_customer, save_customer
+from stripe_utils.ratelimit import TokenBucket
+from .models import User, UserImport, UserImportChunk
+from .serializers import UserSerializer
+
+"""
+    This module contains the bulk import of users: a streaming validation pass which stages the users in chunks,
+    then a chunk by chunk import with bulk inserts and concurrent Stripe customer creation.
+"""
+
+logger = logging.getLogger('django')
+
+# Validation errors kept on the import, the others are only counted.
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportUserSerializer(UserSerializer):
+    """
+    serializer to validate the rows of a bulk import, uniqueness is checked once per chunk instead of per row
+    """
+    password = serializers.CharField(write_only=True, required=False, allow_blank=True)
+
+    class Meta(UserSerializer.Meta):
+        extra_kwargs = {
+            'username': {'validators': [UnicodeUsernameValidator()]},
+            'email': {'validators': []},
+        }
+
+
+def taken_users(fields):
+    """
+    Function is used to find which usernames and emails of some users already belong to a user.
+    :param fields: list of dicts with the username and email of a user.
+    :return: set of the taken usernames and lowercased emails.
+    """
+    usernames = Q(username__in=[user['username'] for user in fields])
+    emails = Q(email__in=[user['email'] for user in fields])
+    taken = set()
+    for username, email in User.objects.filter(usernames | emails).values_list('username', 'email'):
+        taken.update((username, email.lower()))
+    return taken
+
+
+def read_csv(stream):
+    """
+    Function is used to iterate the rows of a CSV file with a header line, without loading it in memory.
+    :param stream: binary or text file object.
+    :return: iterator of dicts.
+    """
+    if isinstance(stream.read(0), bytes):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    return csv.DictReader(stream)
+
+
+class UserImporter:
+    """
+        This is a class for importing many users at once.
+
+        ``stage()`` validates the rows in one streaming pass and stores them in chunks, ``run()`` imports the
+        chunks: one ``bulk_create`` per chunk, then the Stripe customers of the chunk are created concurrently under
+        a rate limit. A chunk which fails is kept with its rows, running the import again only retries the chunks
+        which are not done.
+
+        Attributes:
+            chunk_size (int): Users inserted per ``bulk_create``.
+            workers (int): Concurrent ``Customer.create`` calls.
+            rate (float): Maximum ``Customer.create`` calls per second.
+    """
+
+    def __init__(self, chunk_size=500, workers=8, rate=20):
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.rate = rate
+
+    def stage(self, rows, name=''):
+        """
+        Function is used to validate the rows and store the valid ones in chunks of a new import.
+        :param rows: iterable of dicts with the fields of a user.
+        :param name: label of the import, for example the file name.
+        :return: UserImport.
+        """
+        user_import = UserImport.objects.create(name=name)
+        errors = []
+        seen_usernames = set()
+        seen_emails = set()
+        numbered = enumerate(rows, start=1)
+        number = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                batch = list(islice(numbered, self.chunk_size))
+                if not batch:
+                    break
+                user_import.total_rows += len(batch)
+                valid = []
+                for line, row in batch:
+                    serializer = ImportUserSerializer(data=row)
+                    if not serializer.is_valid():
+                        errors.append({'row': line, 'errors': serializer.errors})
+                        continue
+                    data = serializer.validated_data
+                    username, email = data['username'], data['email'].lower()
+                    if username in seen_usernames or email in seen_emails:
+                        errors.append({'row': line, 'errors': {'non_field_errors': [constants.IMPORT_DUPLICATE_USER]}})
+                        continue
+                    seen_usernames.add(username)
+                    seen_emails.add(email)
+                    valid.append((line, data))
+                taken = taken_users([data for _, data in valid])
+                new = []
+                for line, data in valid:
+                    if data['username'] in taken or data['email'].lower() in taken:
+                        errors.append({'row': line, 'errors': {'non_field_errors': [constants.IMPORT_USER_EXISTS]}})
+                    else:
+                        new.append((line, data))
+                valid = new
+                # Password hashing releases the GIL, hash the chunk on the pool.
+                hashes = executor.map(make_password, [data.get('password') or None for _, data in valid])
+                users = [dict(self._user_fields(data, password), row=line)
+                         for (line, data), password in zip(valid, hashes)]
+                if users:
+                    number += 1
+                    UserImportChunk.objects.create(user_import=user_import, number=number, rows=json.dumps(users))
+        user_import.invalid_rows = len(errors)
+        user_import.errors = json.dumps(errors[:MAX_REPORTED_ERRORS])
+        user_import.save()
+        return user_import
+
+    def _report_errors(self, user_import, errors):
+        reported = json.loads(user_import.errors)
+        user_import.invalid_rows += len(errors)
+        user_import.errors = json.dumps((reported + errors)[:MAX_REPORTED_ERRORS])
+
+    def _user_fields(self, data, password):
+        return {
+            'username': data['username'],
+            'email': data['email'],
+            'first_name': data['first_name'],
+            'last_name': data.get('last_name'),
+            'phone_number': data.get('phone_number'),
+            'password': password,
+        }
+
+    def run(self, user_import):
+        """
+        Function is used to import every chunk of an import which is not done yet, it also resumes failed imports.
+        :param user_import: staged UserImport.
+        :return: UserImport with its final status.
+        """
+        bucket = TokenBucket(self.rate)
+        user_import.status = UserImport.RUNNING
+        user_import.save(update_fields=['status', 'modified_on'])
+        chunk_ids = list(user_import.chunks.exclude(status=UserImportChunk.DONE).order_by('number')
+                         .values_list('id', flat=True))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for chunk_id in chunk_ids:
+                self._import_chunk(user_import, UserImportChunk.objects.get(pk=chunk_id), executor, bucket)
+        failed = user_import.chunks.exclude(status=UserImportChunk.DONE).exists()
+        user_import.status = UserImport.FAILED if failed else UserImport.DONE
+        user_import.save(update_fields=['status', 'modified_on'])
+        return user_import
+
+    def _insert_chunk(self, user_import, chunk):
+        """
+        Function is used to insert the users of a pending chunk. The rows which clashed with a user created since
+        the staging are reported as row errors, the ids of the inserted users are kept on the chunk.
+        """
+        rows = json.loads(chunk.rows)
+        lines = [row.pop('row', None) for row in rows]
+        with transaction.atomic():
+            # Write first, SQLite fails a read transaction which then writes.
+            chunk.save(update_fields=['attempts', 'modified_on'])
+            taken = taken_users(rows)
+            new = [row for row in rows if row['username'] not in taken and row['email'].lower() not in taken]
+            # A failed insert rolls back with the chunk still pending, so no row of a previous attempt is left.
+            User.objects.bulk_create([User(**row) for row in new])
+            # bulk_create does not return the ids on every database, read them back.
+            user_ids = list(User.objects.filter(username__in=[row['username'] for row in new])
+                            .values_list('id', flat=True))
+            UserImportChunk.objects.filter(pk=chunk.pk).update(status=UserImportChunk.INSERTED,
+                                                               user_ids=json.dumps(user_ids))
+        chunk.status = UserImportChunk.INSERTED
+        chunk.user_ids = json.dumps(user_ids)
+        self._report_errors(user_import, [
+            {'row': line, 'errors': {'non_field_errors': [constants.IMPORT_USER_EXISTS]}}
+            for line, row in zip(lines, rows) if row['username'] in taken or row['email'].lower() in taken])
+        user_import.imported_users += len(user_ids)
+        user_import.save(update_fields=['imported_users', 'invalid_rows', 'errors', 'modified_on'])
+
+    def _save_customer(self, user):
+        try:
+            return save_customer(user.pk, user.customer_id) == user.customer_id
+        except User.DoesNotExist:
+            return False
+
+    def _import_chunk(self, user_import, chunk, executor, bucket):
+        chunk.attempts += 1
+        try:
+            if chunk.status == UserImportChunk.PENDING:
+                self._insert_chunk(user_import, chunk)
+            users = list(User.objects.filter(pk__in=json.loads(chunk.user_ids), customer_id__isnull=True))
+            # A user claimed meanwhile through ensure_customer or another import is skipped.
+            claims = [(user, self._claim_customer(user)) for user in users]
+            claims = [(user, claim) for user, claim in claims if claim is not None]
+            users = [user for user, _ in claims]
+            results = list(executor.map(lambda item: self._create_customer(item[0], item[1], bucket), claims))
+            # A user deleted or provisioned meanwhile through ensure_customer is not counted, see save_customer.
+            saved = [self._save_customer(user) for user, error in zip(users, results) if error is None]
+            user_import.customers_created += sum(saved)
+            user_import.save(update_fields=['customers_created', 'modified_on'])
+            errors = [error for error in results if error is not None]
+            if errors:
+                raise errors[0]
+            chunk.status = UserImportChunk.DONE
+            chunk.rows = '[]'
+            chunk.last_error = ''
+        except Exception as e:
+            logger.exception("UserImporter chunk {} of import {} failed {}".format(chunk.number, user_import.pk, e))
+            if chunk.status != UserImportChunk.PENDING:
+                chunk.status = UserImportChunk.FAILED
+            chunk.last_error = str(e)
+        chunk.save(update_fields=['status', 'rows', 'attempts', 'last_error', 'modified_on'])
+
+    def _claim_customer(self, user):
+        try:
+            return claim_customer(user.pk)
+        except User.DoesNotExist:
+            return None
+
+    def _create_customer(self, user, claim, bucket):
+        bucket.acquire()
+        try:
+            user.customer_id = create_claimed_customer(user, claim)
+        except stripe.error.StripeError as e:
+            return e
+        finally:
+            # The claim of a failed create is released from this thread.
+            connection.close()
+        return None
+
+
+def run_in_background(importer, user_import):
+    """
+    Function is used by the import API to run a staged import on a thread, the request only waits for the staging.
+    An import interrupted by a restart is resumed with ``python manage.py import_users --resume <id>``.
+    :param importer: UserImporter.
+    :param user_import: staged UserImport.
+    :return: started thread.
+    """
+    def target():
+        try:
+            importer.run(user_import)
+        except Exception as e:
+            logger.exception("UserImporter import {} failed {}".format(user_import.pk, e))
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=target, name='user-import-{}'.format(user_import.pk), daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,59 @@
+import json
+import os
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.imports import UserImporter, read_csv
+from users.models import UserImport
+
+
+class Command(BaseCommand):
+    """
+    Command is used to import many users from a CSV file, or to resume an import which did not finish.
+    """
+    help = "Bulk import users from a CSV file (username,email,first_name,last_name,phone_number,password) and create " \
+           "their Stripe customers."
+
+    def add_arguments(self, parser):
+        """
+        Function is used to register the command line options.
+        :param parser: argparse parser of the command.
+        """
+        parser.add_argument('path', nargs='?', help="CSV file to import, - reads the standard input.")
+        parser.add_argument('--resume', type=int, help="Id of an import to resume instead of importing a file.")
+        parser.add_argument('--chunk-size', type=int, default=settings.USER_IMPORT_CHUNK_SIZE,
+                            help="Number of users inserted per bulk insert.")
+        parser.add_argument('--workers', type=int, default=settings.USER_IMPORT_WORKERS,
+                            help="Number of concurrent Stripe customer creations.")
+        parser.add_argument('--rate', type=float, default=settings.USER_IMPORT_RATE,
+                            help="Maximum Stripe customer creations per second.")
+
+    def handle(self, *args, **options):
+        """
+        Function is used to stage the file then import it chunk by chunk.
+        """
+        importer = UserImporter(chunk_size=options['chunk_size'], workers=options['workers'], rate=options['rate'])
+        if options['resume']:
+            try:
+                user_import = UserImport.objects.get(pk=options['resume'])
+            except UserImport.DoesNotExist:
+                raise CommandError("User import {} does not exist.".format(options['resume']))
+        elif options['path']:
+            if options['path'] == '-':
+                user_import = importer.stage(read_csv(sys.stdin), name='stdin')
+            else:
+                with open(options['path'], newline='', encoding='utf-8-sig') as stream:
+                    user_import = importer.stage(read_csv(stream), name=os.path.basename(options['path']))
+            self.stdout.write("Import {}: {} rows, {} invalid.".format(
+                user_import.pk, user_import.total_rows, user_import.invalid_rows))
+            for error in json.loads(user_import.errors):
+                self.stderr.write("Row {}: {}".format(error['row'], error['errors']))
+        else:
+            raise CommandError("Give the CSV file to import or --resume with the id of an import.")
+        user_import = importer.run(user_import)
+        self.stdout.write("Import {} {}: {} users inserted, {} Stripe customers created.".format(
+            user_import.pk, user_import.status, user_import.imported_users, user_import.customers_created))
+        if user_import.status == UserImport.FAILED:
+            raise CommandError("Some chunks failed, run the command again with --resume {}.".format(user_import.pk))
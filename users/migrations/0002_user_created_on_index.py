@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 06:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['created_on', 'id'], name='user_created_on_id'),
+        ),
+    ]
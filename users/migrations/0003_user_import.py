@@ -0,0 +1,50 @@
+# Generated by Django 3.1.14 on 2026-10-18 06:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_created_on_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserImport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='running', max_length=10)),
+                ('total_rows', models.PositiveIntegerField(default=0)),
+                ('invalid_rows', models.PositiveIntegerField(default=0)),
+                ('imported_users', models.PositiveIntegerField(default=0)),
+                ('customers_created', models.PositiveIntegerField(default=0)),
+                ('errors', models.TextField(default='[]')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='UserImportChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('modified_on', models.DateTimeField(auto_now=True)),
+                ('number', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('inserted', 'Inserted'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('rows', models.TextField(default='[]')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('user_import', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='users.userimport')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='userimportchunk',
+            constraint=models.UniqueConstraint(fields=('user_import', 'number'), name='unique_user_import_chunk'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_import'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userimportchunk',
+            name='user_ids',
+            field=models.TextField(default='[]'),
+        ),
+    ]
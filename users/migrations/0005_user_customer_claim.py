@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 07:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_import_chunk_user_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='customer_claim',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='customer_claimed_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -28,6 +28,16 @@ class User(AbstractUser, BaseModel):
     email = models.EmailField(max_length=50, blank=False, unique=True)
     phone_number = models.CharField(max_length=14, blank=True, null=True)
     customer_id = models.CharField(max_length=50, blank=True, null=True, unique=True)
+    # Idempotency key of the Stripe customer create claimed by a worker, set before the call so only one is sent.
+    customer_claim = models.CharField(max_length=32, blank=True, null=True)
+    # When the claim was taken, None once its call failed without an answer of Stripe so the next worker resends it.
+    customer_claimed_on = models.DateTimeField(blank=True, null=True)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Seek index of the user listing ordered by creation.
+            models.Index(fields=['created_on', 'id'], name='user_created_on_id'),
+        ]
 
     def __str__(self):
         """Default object return value, it will return username
@@ -35,3 +45,56 @@ class User(AbstractUser, BaseModel):
         """
         return self.username
 
+
+class UserImport(BaseModel):
+    """
+    UserImport class is define for the keep the progress of a bulk user import, so a failed import can be resumed.
+    :param BaseModel: Base class which has common attribute for the application.
+    """
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = ((RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed'))
+
+    name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=RUNNING)
+    total_rows = models.PositiveIntegerField(default=0)
+    invalid_rows = models.PositiveIntegerField(default=0)
+    imported_users = models.PositiveIntegerField(default=0)
+    customers_created = models.PositiveIntegerField(default=0)
+    # JSON list of the first validation errors with their row number.
+    errors = models.TextField(default='[]')
+
+    def __str__(self):
+        return "{} {}".format(self.name or self.pk, self.status)
+
+
+class UserImportChunk(BaseModel):
+    """
+    UserImportChunk class is define for the keep one validated chunk of a bulk user import until it is imported.
+    :param BaseModel: Base class which has common attribute for the application.
+    """
+    PENDING = 'pending'
+    INSERTED = 'inserted'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = ((PENDING, 'Pending'), (INSERTED, 'Inserted'), (DONE, 'Done'), (FAILED, 'Failed'))
+
+    user_import = models.ForeignKey(UserImport, on_delete=models.CASCADE, related_name='chunks')
+    number = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # JSON list of the validated users with their row number, passwords are already hashed. Emptied once the chunk
+    # is done.
+    rows = models.TextField(default='[]')
+    # JSON list of the ids of the users the chunk inserted, their Stripe customers are created next.
+    user_ids = models.TextField(default='[]')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_import', 'number'], name='unique_user_import_chunk'),
+        ]
+
+    def __str__(self):
+        return "{} #{} {}".format(self.user_import_id, self.number, self.status)
@@ -0,0 +1,146 @@
+import base64
+import json
+import math
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+import constants
+
+"""
+    This module contains the keyset (seek) pagination of the user listing.
+"""
+
+ORDERINGS = ('id', '-id', 'created_on', '-created_on')
+COUNT_MODES = ('exact', 'approximate', 'none')
+
+
+class InvalidPage(Exception):
+    """
+    Exception is raised when the pagination parameters of a listing can not be used.
+    """
+
+
+def encode_cursor(obj, ordering):
+    """
+    Function is used to build the opaque cursor pointing at a row of the listing.
+    :param obj: last or first row of a page.
+    :param ordering: ordering of the listing.
+    :return: url safe cursor.
+    """
+    field = ordering.lstrip('-')
+    position = [obj.id] if field == 'id' else [getattr(obj, field).isoformat(), obj.id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, ordering):
+    """
+    Function is used to read the row position stored in a cursor.
+    :return: list of the ordering value and the id, or of the id only when ordering by id.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if ordering.lstrip('-') == 'id':
+            return [int(position[0])]
+        value = parse_datetime(position[0])
+        if value is None:
+            raise ValueError(position[0])
+        return [value, int(position[1])]
+    except (ValueError, TypeError, IndexError, KeyError):
+        raise InvalidPage(constants.INVALID_CURSOR)
+
+
+def seek(queryset, ordering, position, forward):
+    """
+    Function is used to keep the rows after (or before) a position, the index on the ordering makes it a range scan.
+    :param queryset: rows of the listing.
+    :param ordering: ordering of the listing.
+    :param position: decoded cursor.
+    :param forward: True for the rows after the position, False for the rows before it.
+    :return: filtered queryset.
+    """
+    descending = ordering.startswith('-')
+    lookup = 'gt' if forward != descending else 'lt'
+    if len(position) == 1:
+        return queryset.filter(**{'id__' + lookup: position[0]})
+    field = ordering.lstrip('-')
+    value, pk = position
+    return queryset.filter(Q(**{field + '__' + lookup: value}) | Q(**{field: value, 'id__' + lookup: pk}))
+
+
+def approximate_count(model):
+    """
+    Function is used to read the row count estimated by the database statistics instead of scanning the table.
+    :param model: model of the table.
+    :return: estimated number of rows, the exact count when the database keeps no estimate.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute("SELECT table_rows FROM information_schema.tables "
+                           "WHERE table_schema = DATABASE() AND table_name = %s", [table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT count(*) FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if not cursor.fetchone()[0]:
+                return model.objects.count()
+            # Filled by ANALYZE, the first number of the stat is the row count of the table.
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+        else:
+            return model.objects.count()
+        row = cursor.fetchone()
+    if not row or row[0] is None or int(str(row[0]).split()[0]) <= 0:
+        return model.objects.count()
+    return int(str(row[0]).split()[0])
+
+
+def paginate(request, queryset, page_size, ordering, count_mode):
+    """
+    Function is used to get one page of a listing with keyset pagination.
+    :param request: request of the listing, its ``after`` or ``before`` cursor selects the page.
+    :param queryset: rows of the listing.
+    :param page_size: rows per page.
+    :param ordering: one of ``ORDERINGS``.
+    :param count_mode: one of ``COUNT_MODES``.
+    :return: dict with the page rows and the count, total_page, next and previous of the ApiResponse.
+    """
+    if ordering not in ORDERINGS:
+        raise InvalidPage(constants.INVALID_ORDERING.format(', '.join(ORDERINGS)))
+    if count_mode not in COUNT_MODES:
+        raise InvalidPage(constants.INVALID_COUNT_MODE.format(', '.join(COUNT_MODES)))
+    after = request.query_params.get(constants.PARAM_CURSOR_AFTER)
+    before = request.query_params.get(constants.PARAM_CURSOR_BEFORE)
+    tie_break = '-id' if ordering.startswith('-') else 'id'
+    order_by = [ordering] if ordering.lstrip('-') == 'id' else [ordering, tie_break]
+    reverse_order_by = [field[1:] if field.startswith('-') else '-' + field for field in order_by]
+
+    rows_queryset = queryset
+    if before:
+        # Walk backwards from the cursor then restore the listing order.
+        rows = list(seek(rows_queryset, ordering, decode_cursor(before, ordering), forward=False)
+                    .order_by(*reverse_order_by)[:page_size + 1])
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next = True
+    else:
+        if after:
+            rows_queryset = seek(rows_queryset, ordering, decode_cursor(after, ordering), forward=True)
+        rows = list(rows_queryset.order_by(*order_by)[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_previous = bool(after)
+
+    url = remove_query_param(remove_query_param(request.build_absolute_uri(), constants.PARAM_CURSOR_AFTER),
+                             constants.PARAM_CURSOR_BEFORE)
+    page = {'rows': rows, 'next': None, 'previous': None, 'count': None, 'total_page': None}
+    if rows and has_next:
+        page['next'] = replace_query_param(url, constants.PARAM_CURSOR_AFTER, encode_cursor(rows[-1], ordering))
+    if rows and has_previous:
+        page['previous'] = replace_query_param(url, constants.PARAM_CURSOR_BEFORE, encode_cursor(rows[0], ordering))
+    if count_mode != 'none':
+        page['count'] = approximate_count(queryset.model) if count_mode == 'approximate' else queryset.count()
+        page['total_page'] = math.ceil(page['count'] / page_size)
+    return page
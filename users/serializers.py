@@ -1,5 +1,7 @@
+import json
+
 from rest_framework import serializers
-from .models import User
+from .models import User, UserImport
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -34,3 +36,18 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ('id', 'first_name', 'last_name', 'username', 'email', 'phone_number', 'password', 'created_on',
                   'modified_on')
+
+
+class UserImportSerializer(serializers.ModelSerializer):
+    """
+    serializer to report the progress of a bulk user import
+    """
+    errors = serializers.SerializerMethodField()
+
+    def get_errors(self, obj):
+        return json.loads(obj.errors)
+
+    class Meta:
+        model = UserImport
+        fields = ('id', 'name', 'status', 'total_rows', 'invalid_rows', 'imported_users', 'customers_created', 'errors',
+                  'created_on', 'modified_on')
@@ -1,3 +1,231 @@
-from django.test import TestCase
+import base64
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+
+import constants
+from payments.tests import StripeStubMixin
+from stripe_card_payment import settings
+from .authentication import (ClaimsTokenObtainPairSerializer, StatelessJWTAuthentication, TokenClaimsUser,
+                             VERSION_CACHE, _version_key, check_version_cache, user_cache)
+from .imports import UserImporter
+from .models import User, UserImport, UserImportChunk
+
+
+class StatelessJWTAuthenticationTests(TransactionTestCase):
+    """
+        Class is used to check when the claims of an access token are trusted and that a change of the user revokes
+        them. The user changes commit at once, so their on_commit invalidation runs as in the views.
+    """
+
+    def setUp(self):
+        user_cache.clear()
+        self.authentication = StatelessJWTAuthentication()
+        self.user = User.objects.create_user(username='alice', email='alice@example.com', password='alice',
+                                             first_name='Alice', customer_id='cus_alice')
+
+    def test_claims_are_trusted_without_query(self):
+        token = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+        validated = self.authentication.get_validated_token(str(token))
+        with self.assertNumQueries(0):
+            user = self.authentication.get_user(validated)
+        self.assertIsInstance(user, TokenClaimsUser)
+        self.assertEqual(user.customer_id, 'cus_alice')
+
+    def test_change_revokes_claims(self):
+        token = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+        validated = self.authentication.get_validated_token(str(token))
+        self.user.email = 'alice@example.org'
+        self.user.save()
+        user = self.authentication.get_user(validated)
+        self.assertIsInstance(user, User)
+        self.assertEqual(user.email, 'alice@example.org')
+
+    def test_deactivated_user_is_refused(self):
+        token = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+        validated = self.authentication.get_validated_token(str(token))
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.get_user(validated)
+
+    def test_deleted_user_is_refused(self):
+        token = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+        validated = self.authentication.get_validated_token(str(token))
+        self.user.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.get_user(validated)
+
+    def test_evicted_version_is_not_trusted(self):
+        token = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+        validated = self.authentication.get_validated_token(str(token))
+        caches[VERSION_CACHE].delete(_version_key(self.user.pk))
+        self.assertIsInstance(self.authentication.get_user(validated), User)
+
+    def test_user_without_customer_is_loaded_once(self):
+        user = User.objects.create_user(username='bob', email='bob@example.com', password='bob', first_name='Bob')
+        token = ClaimsTokenObtainPairSerializer.get_token(user).access_token
+        validated = self.authentication.get_validated_token(str(token))
+        with self.assertNumQueries(1):
+            self.assertIsInstance(self.authentication.get_user(validated), User)
+        with self.assertNumQueries(0):
+            self.assertIsInstance(self.authentication.get_user(validated), User)
+
+
+class VersionCacheCheckTests(SimpleTestCase):
+    """
+        Class is used to check that the user versions can not be kept per process.
+    """
+
+    def test_shared_cache_passes(self):
+        self.assertEqual(check_version_cache(None), [])
+
+    def test_process_cache_is_refused(self):
+        locmem = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        with mock.patch.dict(settings.CACHES, {VERSION_CACHE: locmem}):
+            self.assertEqual([error.id for error in check_version_cache(None)], ['users.E002'])
+
+    def test_missing_cache_is_refused(self):
+        with mock.patch.dict(settings.CACHES):
+            del settings.CACHES[VERSION_CACHE]
+            self.assertEqual([error.id for error in check_version_cache(None)], ['users.E001'])
+
+
+class UsersListTests(TestCase):
+    """
+        Class is used to walk the keyset pages of the user listing and to check that forged cursors are refused.
+    """
+    path = '/api/users/list/'
+
+    def setUp(self):
+        self.client = APIClient()
+        admin = User.objects.create_user(username='admin', email='admin@example.com', password='admin',
+                                         is_staff=True)
+        self.client.force_authenticate(admin)
+        for number in range(7):
+            User.objects.create_user(username='user%s' % number, email='user%s@example.com' % number,
+                                     password='user')
+        # Rows sharing their created_on are told apart by their id.
+        User.objects.filter(username__in=['user1', 'user2', 'user3']).update(created_on=timezone.now())
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def walk(self, ordering):
+        ids, url, pages = [], self.path, []
+        params = {'ordering': ordering, 'page_size': 3}
+        while url:
+            page = self.get(url, **params)
+            pages.append(page)
+            ids.extend(user['id'] for user in page['data'])
+            url, params = page.get('next'), {}
+        return ids, pages
+
+    def test_pages_list_every_user_once(self):
+        for ordering in ('id', '-id', 'created_on', '-created_on'):
+            ids, pages = self.walk(ordering)
+            descending = ordering.startswith('-')
+            expected = list(User.objects.order_by(ordering, '-id' if descending else 'id').values_list('id', flat=True))
+            self.assertEqual(ids, expected, ordering)
+            self.assertEqual([len(page['data']) for page in pages], [3, 3, 2], ordering)
+            self.assertEqual(pages[0]['count'], 8)
+
+    def test_previous_page_is_the_page_before(self):
+        _, pages = self.walk('created_on')
+        previous = self.get(pages[2]['previous'])
+        self.assertEqual(previous['data'], pages[1]['data'])
+        first = self.get(previous['previous'])
+        self.assertEqual(first['data'], pages[0]['data'])
+        self.assertNotIn('previous', first)
+
+    def test_tampered_cursor_is_refused(self):
+        def cursor(position):
+            return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+        for ordering, after in (('id', 'not-a-cursor'), ('id', cursor(['x'])), ('id', cursor({})),
+                                ('created_on', cursor([5])), ('created_on', cursor(['yesterday', 1])),
+                                ('created_on', cursor(['2020-01-01T00:00:00', 'x']))):
+            response = self.client.get(self.path, {'ordering': ordering, 'after': after})
+            self.assertEqual(response.status_code, 400, (ordering, after))
+            self.assertEqual(response.json()['message'], constants.INVALID_CURSOR)
+
+    def test_invalid_parameters_are_refused(self):
+        for params in ({'ordering': 'password'}, {'count': 'some'}, {'page_size': 0}, {'page_size': 'ten'}):
+            self.assertEqual(self.client.get(self.path, params).status_code, 400, params)
+
+    def test_count_can_be_skipped(self):
+        page = self.client.get(self.path, {'count': 'none'}).json()
+        self.assertNotIn('count', page)
+        self.assertEqual(len(page['data']), 8)
+
+
+class UserImportTests(StripeStubMixin, TransactionTestCase):
+    """
+        Class is used to check that a bulk import reports the clashing rows and that a failed import is resumed
+        without duplicating users or customers.
+    """
+
+    def setUp(self):
+        self.use_stub()
+        self.importer = UserImporter(chunk_size=2, workers=2, rate=1000)
+
+    def rows(self, *names):
+        return [{'username': name, 'email': '%s@example.com' % name, 'first_name': name.title()} for name in names]
+
+    def errors(self, user_import):
+        return {error['row']: error['errors'] for error in json.loads(user_import.errors)}
+
+    def test_clashing_rows_are_reported_at_staging(self):
+        User.objects.create_user(username='taken', email='taken@example.com', password='taken')
+        rows = self.rows('ann', 'ann', 'taken', 'ben') + [{'username': 'noemail', 'first_name': 'No'}]
+        user_import = self.importer.run(self.importer.stage(rows))
+        self.assertEqual((user_import.status, user_import.total_rows, user_import.invalid_rows),
+                         (UserImport.DONE, 5, 3))
+        errors = self.errors(user_import)
+        self.assertEqual(errors[2], {'non_field_errors': [constants.IMPORT_DUPLICATE_USER]})
+        self.assertEqual(errors[3], {'non_field_errors': [constants.IMPORT_USER_EXISTS]})
+        self.assertIn('email', errors[5])
+        self.assertEqual(sorted(User.objects.filter(username__in=['ann', 'ben']).values_list('username', flat=True)),
+                         ['ann', 'ben'])
+
+    def test_rows_taken_after_staging_are_reported_at_import(self):
+        user_import = self.importer.stage(self.rows('ann', 'ben', 'cat'))
+        User.objects.create_user(username='other', email='ben@example.com', password='other')
+        user_import = self.importer.run(user_import)
+        self.assertEqual((user_import.status, user_import.imported_users, user_import.invalid_rows),
+                         (UserImport.DONE, 2, 1))
+        self.assertEqual(self.errors(user_import), {2: {'non_field_errors': [constants.IMPORT_USER_EXISTS]}})
+        self.assertFalse(User.objects.filter(username='ben').exists())
+
+    def test_failed_customers_are_created_on_resume(self):
+        self.stub.inject(status=500, path_prefix='/v1/customers')
+        with self.assertLogs('django', 'ERROR'):
+            user_import = self.importer.run(self.importer.stage(self.rows('ann', 'ben', 'cat')))
+        self.assertEqual((user_import.status, user_import.imported_users), (UserImport.FAILED, 3))
+        self.assertEqual(set(user_import.chunks.values_list('status', flat=True)), {UserImportChunk.FAILED})
+        self.stub.clear_faults()
+        user_import = self.importer.run(UserImport.objects.get(pk=user_import.pk))
+        self.assertEqual((user_import.status, user_import.imported_users, user_import.customers_created),
+                         (UserImport.DONE, 3, 3))
+        self.assertFalse(User.objects.filter(username__in=['ann', 'ben', 'cat'], customer_id__isnull=True).exists())
+        self.assertEqual(set(user_import.chunks.values_list('status', flat=True)), {UserImportChunk.DONE})
+
+    def test_failed_insert_is_retried_on_resume(self):
+        user_import = self.importer.stage(self.rows('ann', 'ben', 'cat'))
+        with mock.patch.object(User.objects, 'bulk_create', side_effect=DatabaseError('disk full')):
+            with self.assertLogs('django', 'ERROR'):
+                user_import = self.importer.run(user_import)
+        self.assertEqual(user_import.status, UserImport.FAILED)
+        self.assertFalse(User.objects.filter(username__in=['ann', 'ben', 'cat']).exists())
+        self.assertEqual(set(user_import.chunks.values_list('status', flat=True)), {UserImportChunk.PENDING})
+        user_import = self.importer.run(UserImport.objects.get(pk=user_import.pk))
+        self.assertEqual((user_import.status, user_import.imported_users), (UserImport.DONE, 3))
+        self.assertEqual(User.objects.filter(username__in=['ann', 'ben', 'cat']).count(), 3)
@@ -4,4 +4,6 @@ from . import views
 urlpatterns = [
     path('list/', views.UsersList.as_view(), name='users_list'),
     path('details/<int:pk>/', views.UserDetails.as_view(), name='user_details'),
+    path('import/', views.UserImportView.as_view(), name='user_import'),
+    path('import/<int:pk>/', views.UserImportView.as_view(), name='user_import_details'),
 ]
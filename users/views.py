@@ -1,16 +1,22 @@
 import logging
-import stripe
-from rest_framework import status
+from django.db import transaction
+from django.utils import timezone
+from django.utils.http import parse_etags
+from rest_framework import permissions, status
+from rest_framework.response import Response
 from rest_framework.views import APIView
 
 import constants
+from payments.models import OutboxMessage
 from response_utils import ApiResponse, get_error_message
-from .models import User
-from .serializers import UserSerializer
 from stripe_card_payment import settings
+from .caches import cache_details, get_cached_details, invalidate_details, user_etag
+from .imports import UserImporter, read_csv, run_in_background
+from .models import User, UserImport
+from .pagination import InvalidPage, paginate
+from .serializers import UserImportSerializer, UserSerializer
 
 logger = logging.getLogger('django')
-stripe.api_key = settings.STRIPE_SECRET_KEY
 
 
 class UsersList(APIView):
@@ -18,8 +24,44 @@ class UsersList(APIView):
     Class is used for list all the user or create new user.
     """
 
-    authentication_classes = []
-    permission_classes = []
+    def get_authenticators(self):
+        # Signing up needs no credentials, listing the users is reserved to the site maintainers.
+        if self.request.method == 'POST':
+            return []
+        return super(UsersList, self).get_authenticators()
+
+    def get_permissions(self):
+        if self.request.method == 'POST':
+            return []
+        return [permissions.IsAdminUser()]
+
+    def get(self, request):
+        """
+        Function is used to list the users one page at a time with keyset pagination.
+        :param request: request header with the optional ordering, page_size, count and after or before cursor.
+        :return: page of users with count, total_page, next and previous links.
+        """
+        try:
+            page_size = int(request.query_params.get(constants.PARAM_PAGE_SIZE, settings.USERS_LIST_PAGE_SIZE))
+            if not 0 < page_size <= settings.USERS_LIST_MAX_PAGE_SIZE:
+                raise ValueError(page_size)
+        except ValueError:
+            api_response = ApiResponse(status=0,
+                                       message=constants.INVALID_PAGE_SIZE.format(settings.USERS_LIST_MAX_PAGE_SIZE),
+                                       http_status=status.HTTP_400_BAD_REQUEST)
+            return api_response.create_response()
+        try:
+            page = paginate(request, User.objects.all(), page_size,
+                            request.query_params.get(constants.PARAM_ORDERING, 'id'),
+                            request.query_params.get(constants.PARAM_COUNT, settings.USERS_LIST_COUNT))
+        except InvalidPage as e:
+            api_response = ApiResponse(status=0, message=str(e), http_status=status.HTTP_400_BAD_REQUEST)
+            return api_response.create_response()
+        serializer = UserSerializer(page['rows'], many=True)
+        api_response = ApiResponse(status=1, data=serializer.data, message=constants.GET_USERS_SUCCESS,
+                                   http_status=status.HTTP_200_OK, length=len(page['rows']), count=page['count'],
+                                   total_page=page['total_page'], next=page['next'], previous=page['previous'])
+        return api_response.create_response()
 
     def post(self, request):
         """
@@ -30,12 +72,10 @@ class UsersList(APIView):
         serializer = UserSerializer(data=request.data)
         logger.info("UserList post request data is {}".format(request.data))
         if serializer.is_valid():
-            customer = stripe.Customer.create(
-                name=request.data.get('username'),
-                email=request.data.get('email'),
-                phone=request.data.get('phone_number'),
-            )
-            serializer.save(customer_id=customer['id'])
+            # The Stripe customer is created by the outbox dispatcher once the user is committed.
+            with transaction.atomic():
+                user = serializer.save()
+                OutboxMessage.objects.enqueue(OutboxMessage.CUSTOMER_CREATE, user.pk)
             api_response = ApiResponse(status=1, data=serializer.data, message=constants.CREATE_USER_SUCCESS,
                                        http_status=status.HTTP_201_CREATED)
             return api_response.create_response()
@@ -51,20 +91,37 @@ class UserDetails(APIView):
 
     def get(self, request, pk):
         """
-        Function is used for get user info with pk
+        Function is used for get user info with pk, answers 304 when the If-None-Match header holds the current ETag.
         :param request: request header with required info.
         :return: user info or send proper error status
         """
-        try:
-            user = User.objects.get(id=pk)
-        except User.DoesNotExist:
+        modified_on = User.objects.filter(id=pk).values_list('modified_on', flat=True).first()
+        if modified_on is None:
             api_response = ApiResponse(status=0, message=constants.USER_DOES_NOT_EXIST,
                                        http_status=status.HTTP_404_NOT_FOUND)
             return api_response.create_response()
-        serializer = UserSerializer(user)
-        api_response = ApiResponse(status=1, data=serializer.data, message=constants.GET_USER_SUCCESS,
+        etag = user_etag(pk, modified_on)
+        # Weak comparison, the compression middleware weakens the ETag of the gzipped responses.
+        if etag in [tag[2:] if tag.startswith('W/') else tag
+                    for tag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))]:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        data = get_cached_details(pk, etag)
+        if data is None:
+            try:
+                user = User.objects.get(id=pk)
+            except User.DoesNotExist:
+                api_response = ApiResponse(status=0, message=constants.USER_DOES_NOT_EXIST,
+                                           http_status=status.HTTP_404_NOT_FOUND)
+                return api_response.create_response()
+            # Cache under the ETag of the row actually serialized, it may have moved since the first query.
+            etag = user_etag(pk, user.modified_on)
+            data = UserSerializer(user).data
+            cache_details(pk, etag, data)
+        api_response = ApiResponse(status=1, data=data, message=constants.GET_USER_SUCCESS,
                                    http_status=status.HTTP_200_OK)
-        return api_response.create_response()
+        response = api_response.create_response()
+        response['ETag'] = etag
+        return response
 
     def put(self, request, pk):
         """
@@ -80,14 +137,10 @@ class UserDetails(APIView):
             return api_response.create_response()
         serializer = UserSerializer(user, data=request.data, partial=True)
         if serializer.is_valid():
-            if user.customer_id:
-                stripe.Customer.modify(
-                    user.customer_id,
-                    name=request.data.get('username', user.username),
-                    email=request.data.get('email', user.email),
-                    phone=request.data.get('phone_number', user.phone_number),
-                )
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
+                OutboxMessage.objects.enqueue(OutboxMessage.CUSTOMER_MODIFY, user.pk)
+            invalidate_details(pk)
             api_response = ApiResponse(status=1, data=serializer.data, message=constants.UPDATE_USER_SUCCESS,
                                        http_status=status.HTTP_201_CREATED)
             return api_response.create_response()
@@ -103,15 +156,65 @@ class UserDetails(APIView):
         :return: 200 ok or error message
         """
 
+        with transaction.atomic():
+            # Write first: SQLite ignores select_for_update and fails a read transaction which then writes. A
+            # customer stored after the delete is deleted by save_customer.
+            if not User.objects.filter(id=pk).update(modified_on=timezone.now()):
+                api_response = ApiResponse(status=0, message=constants.USER_DOES_NOT_EXIST,
+                                           http_status=status.HTTP_404_NOT_FOUND)
+                return api_response.create_response()
+            customer_id = User.objects.filter(id=pk).values_list('customer_id', flat=True).get()
+            User.objects.filter(id=pk).delete()
+            if customer_id:
+                OutboxMessage.objects.enqueue(OutboxMessage.CUSTOMER_DELETE, pk, customer_id=customer_id)
+        invalidate_details(pk)
+        api_response = ApiResponse(status=1, message=constants.DELETE_USER_SUCCESS, http_status=status.HTTP_200_OK)
+        return api_response.create_response()
+
+
+class UserImportView(APIView):
+    """
+    Class is used to start a bulk user import and follow its progress.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request):
+        """
+        Function is used to validate and stage the users then import them in the background.
+        :param request: request with a csv file in file or a list of users in users.
+        :return: import progress with json
+        """
+        upload = request.FILES.get(constants.PARAM_FILE)
+        users = request.data.get(constants.PARAM_USERS)
+        if upload is not None:
+            rows, name = read_csv(upload.file), upload.name
+        elif isinstance(users, list):
+            rows, name = users, 'api'
+        else:
+            api_response = ApiResponse(status=0, message=constants.IMPORT_USERS_MISSING_DATA,
+                                       http_status=status.HTTP_400_BAD_REQUEST)
+            return api_response.create_response()
+        importer = UserImporter(chunk_size=settings.USER_IMPORT_CHUNK_SIZE, workers=settings.USER_IMPORT_WORKERS,
+                                rate=settings.USER_IMPORT_RATE)
+        user_import = importer.stage(rows, name=name)
+        run_in_background(importer, user_import)
+        api_response = ApiResponse(status=1, data=UserImportSerializer(user_import).data,
+                                   message=constants.IMPORT_USERS_STARTED, http_status=status.HTTP_202_ACCEPTED)
+        return api_response.create_response()
+
+    def get(self, request, pk):
+        """
+        Function is used to get the progress of an import.
+        :param request: request header with required info.
+        :param pk: id of the import.
+        :return: import progress with json
+        """
         try:
-            user = User.objects.get(id=pk)
-        except User.DoesNotExist:
-            api_response = ApiResponse(status=0, message=constants.USER_DOES_NOT_EXIST,
+            user_import = UserImport.objects.get(pk=pk)
+        except UserImport.DoesNotExist:
+            api_response = ApiResponse(status=0, message=constants.USER_IMPORT_DOES_NOT_EXIST,
                                        http_status=status.HTTP_404_NOT_FOUND)
             return api_response.create_response()
-        customer_id = user.customer_id
-        user.delete()
-        if customer_id:
-            stripe.Customer.delete(customer_id)
-        api_response = ApiResponse(status=1, message=constants.DELETE_USER_SUCCESS, http_status=status.HTTP_200_OK)
+        api_response = ApiResponse(status=1, data=UserImportSerializer(user_import).data,
+                                   message=constants.GET_USER_IMPORT_SUCCESS, http_status=status.HTTP_200_OK)
         return api_response.create_response()